@@ -0,0 +1,83 @@
+# benchmarks/bench_index.py
+"""
+Exact vs approximate FaceDBMatcher search at growing DB sizes.
+
+Synthetic DB: N random L2-normalized 512-d identities. Queries are noisy
+copies of enrolled identities (cosine ~0.7 to their source), the regime
+a real probe embedding lives in.
+
+Reports per-query latency and recall@1 against the exact search
+for each index backend and n_probe setting. Random Gaussian identities have
+no cluster structure, so IVF recall here is a pessimistic bound.
+
+Run:
+    python -m benchmarks.bench_index
+    python -m benchmarks.bench_index --sizes 1000 10000 100000 --probes 4 16 64 128
+"""
+
+from __future__ import annotations
+import argparse
+import time
+from typing import Tuple
+
+import numpy as np
+
+from src.index import ExactIndex, IVFIndex, HNSWIndex, hnswlib
+
+def make_db(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    m = rng.standard_normal((n, dim)).astype(np.float32)
+    return m / np.linalg.norm(m, axis=1, keepdims=True)
+
+def make_queries(db: np.ndarray, n_q: int, noise: float, rng: np.random.Generator):
+    src = rng.integers(0, db.shape[0], size=n_q)
+    q = db[src] + noise * rng.standard_normal((n_q, db.shape[1])).astype(np.float32) / np.sqrt(db.shape[1])
+    return (q / np.linalg.norm(q, axis=1, keepdims=True)).astype(np.float32), src
+
+def time_queries(index, Q: np.ndarray) -> Tuple[float, np.ndarray]:
+    index.search(Q[0], k=1)
+    ids = np.empty(Q.shape[0], dtype=np.int64)
+    t0 = time.perf_counter()
+    for i in range(Q.shape[0]):
+        ids[i] = index.search(Q[i], k=1)[0][0, 0]
+    return (time.perf_counter() - t0) / Q.shape[0] * 1000.0, ids
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--probes", type=int, nargs="+", default=[4, 16, 64])
+    ap.add_argument("--dim", type=int, default=512)
+    ap.add_argument("--queries", type=int, default=300)
+    ap.add_argument("--noise", type=float, default=1.0)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'N':>8}  {'index':<16}{'build s':>9}{'ms/query':>10}{'recall@1':>10}")
+
+    for n in args.sizes:
+        db = make_db(n, args.dim, rng)
+        Q, _ = make_queries(db, args.queries, args.noise, rng)
+
+        exact = ExactIndex(db)
+        ms, truth = time_queries(exact, Q)
+        print(f"{n:>8}  {'exact':<16}{0.0:>9.2f}{ms:>10.3f}{1.0:>10.3f}")
+
+        t0 = time.perf_counter()
+        ivf = IVFIndex(db)
+        build = time.perf_counter() - t0
+        for p in args.probes:
+            ivf.n_probe = p
+            ms, ids = time_queries(ivf, Q)
+            print(f"{n:>8}  {f'ivf(probe={p})':<16}{build:>9.2f}{ms:>10.3f}{float(np.mean(ids == truth)):>10.3f}")
+
+        if hnswlib is not None:
+            t0 = time.perf_counter()
+            hnsw = HNSWIndex(db)
+            build = time.perf_counter() - t0
+            for ef in (32, 64, 128):
+                hnsw.ef = ef
+                ms, ids = time_queries(hnsw, Q)
+                print(f"{n:>8}  {f'hnsw(ef={ef})':<16}{build:>9.2f}{ms:>10.3f}{float(np.mean(ids == truth)):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
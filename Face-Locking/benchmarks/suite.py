@@ -0,0 +1,336 @@
+# benchmarks/suite.py
+"""
+Reproducible benchmark suite for the recognition pipeline (no camera needed).
+
+Fixtures:
+- the committed enrollment crops (data/enroll/<person>/*.jpg, aligned 112x112)
+- synthetic multi-face frames: 1-4 of those crops scaled up and pasted on a
+  flat background (fixed seed, so every run sees the same frames)
+- synthetic DBs of random L2-normalized identities for matching at several sizes
+
+Cases (latency per call, throughput in items/s):
+    detect.haar_facemesh      HaarFaceMesh5pt.detect (recognize.py), per frame
+    detect.haar_5pt           Haar5ptDetector.detect (haar_5pt.py), per frame
+    detect.haar_adaptive      HaarFaceMesh5pt.detect with AdaptiveHaar (--haar-budget-ms), per frame;
+                              each synthetic frame is held for 4 frames, like a static camera;
+                              fails the run when it finds fewer than --min-recall x the faces
+                              detect.haar_facemesh finds
+    detect.yunet              YuNetDetector.detect (detectors.py), per frame
+    detect.yunet.batch        YuNetDetector.detect_batch over --yunet-batch frames per call (items = frames)
+    align                     align_face_5pt, per face
+    align.batch               FaceAligner.align (batched solve, shared buffer), per frame
+    embed                     ArcFaceEmbedderONNX.embed (recognize.py), per crop
+    batch_embed               BatchEmbedder.embed_paths over all crops (no cache)
+    match.N<n>                FaceDBMatcher.match against an n-identity DB
+Embedding cases are skipped when the ONNX model is missing, YuNet cases when
+--yunet-model is missing.
+
+Results go to JSON. With a baseline, every case present in both is compared
+on p50 latency; a slowdown beyond --threshold fails the run (exit code 1).
+
+Run:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --update-baseline            # store this machine's baseline
+    python -m benchmarks.suite --threshold 0.15 --out benchmarks/results/ci.json
+    python -m benchmarks.suite --only detect match --db-sizes 1000 100000
+
+Microbenchmarks for single design choices stay separate
+(benchmarks/bench_preprocess.py, benchmarks/bench_index.py).
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+from src.detectors import YUNET_MODEL, YuNetDetector
+from src.haar_5pt import AdaptiveHaarConfig, FaceAligner, Haar5ptDetector, align_face_5pt
+from src.recognize import ArcFaceEmbedderONNX, FaceDBMatcher, HaarFaceMesh5pt
+
+ENROLL_DIR = Path("data/enroll")
+MODEL_PATH = Path("models/embedder_arcface.onnx")
+YUNET_PATH = Path(YUNET_MODEL)
+BASELINE_PATH = Path("benchmarks/baseline.json")
+RESULTS_PATH = Path("benchmarks/results/latest.json")
+
+# -------------------------
+# Fixtures
+# -------------------------
+
+def load_crops(enroll_dir: Path) -> List[Path]:
+    paths = sorted(enroll_dir.glob("*/*.jpg"))
+    if not paths:
+        raise RuntimeError(f"No enrollment crops under {enroll_dir} (run from the project root)")
+    return paths
+
+def synthetic_frames(crops: Sequence[np.ndarray], n_frames: int, seed: int = 0,
+                     size=(640, 480), face_px: int = 160) -> List[np.ndarray]:
+    """Frames of 1-4 non-overlapping faces on a flat background (3x2 slot grid)."""
+    rng = np.random.default_rng(seed)
+    W, H = size
+    cell_w, cell_h = W // 3, H // 2
+    frames = []
+    for _ in range(n_frames):
+        frame = np.empty((H, W, 3), dtype=np.uint8)
+        frame[:] = rng.integers(90, 140, size=3, dtype=np.uint8)
+        for slot in rng.permutation(6)[: int(rng.integers(1, 5))]:
+            face = cv2.resize(crops[int(rng.integers(len(crops)))], (face_px, face_px))
+            x = (slot % 3) * cell_w + int(rng.integers(0, cell_w - face_px + 1))
+            y = (slot // 3) * cell_h + int(rng.integers(0, cell_h - face_px + 1))
+            frame[y:y + face_px, x:x + face_px] = face
+        frames.append(frame)
+    return frames
+
+def synthetic_db(n: int, dim: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    m = rng.standard_normal((n, dim)).astype(np.float32)
+    m /= np.linalg.norm(m, axis=1, keepdims=True)
+    return {f"id{i:06d}": m[i] for i in range(n)}
+
+# -------------------------
+# Measurement
+# -------------------------
+
+def measure(fn: Callable[[object], object], inputs: Sequence, items_per_call: Optional[Sequence[int]] = None,
+            warmup: int = 5, min_time_s: float = 1.0, max_calls: int = 5000) -> dict:
+    """
+    Calls fn over inputs (cycling) for at least min_time_s.
+    items_per_call: faces per input (throughput counts items, not calls).
+    """
+    for i in range(min(warmup, len(inputs))):
+        fn(inputs[i])
+    lat: List[float] = []
+    items = 0
+    t_start = time.perf_counter()
+    i = 0
+    while len(lat) < max_calls and (time.perf_counter() - t_start < min_time_s or i < len(inputs)):
+        x = inputs[i % len(inputs)]
+        t0 = time.perf_counter()
+        fn(x)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+        items += items_per_call[i % len(inputs)] if items_per_call is not None else 1
+        i += 1
+    wall = time.perf_counter() - t_start
+    a = np.asarray(lat)
+    p50, p95, p99 = np.percentile(a, [50, 95, 99])
+    return {
+        "calls": int(a.size),
+        "items": int(items),
+        "mean_ms": float(a.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "items_per_s": float(items / wall) if wall > 0 else 0.0,
+    }
+
+def environment() -> dict:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        rev = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": rev,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "onnxruntime": ort.__version__,
+    }
+
+# -------------------------
+# Cases
+# -------------------------
+
+def run_suite(args) -> Dict[str, dict]:
+    crop_paths = load_crops(args.enroll)
+    crops = [c for c in (cv2.imread(str(p)) for p in crop_paths) if c is not None]
+    frames = synthetic_frames(crops, args.frames, seed=args.seed)
+    want = lambda group: not args.only or group in args.only
+    results: Dict[str, dict] = {}
+
+    def report(name: str, r: dict):
+        results[name] = r
+        print(f"{name:<22}{r['calls']:>7}{r['mean_ms']:>10.3f}{r['p50_ms']:>10.3f}"
+              f"{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['items_per_s']:>12.1f}")
+
+    print(f"[bench] {len(crops)} crops, {len(frames)} synthetic frames, min {args.min_time:.1f}s per case")
+
+    det = HaarFaceMesh5pt(min_size=(70, 70), debug=False)
+    dets = [det.detect(f, max_faces=5) for f in frames] if want("detect") or want("align") else []
+    if dets:
+        print(f"[bench] detect.haar_facemesh finds {sum(len(d) for d in dets)} faces in {len(frames)} frames")
+    print(f"{'case':<22}{'calls':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'items/s':>12}")
+    if want("detect"):
+        report("detect.haar_facemesh", measure(lambda f: det.detect(f, max_faces=5), frames,
+                                               min_time_s=args.min_time))
+        results["detect.haar_facemesh"]["faces"] = sum(len(d) for d in dets)
+        det1 = Haar5ptDetector(min_size=(70, 70), debug=False)
+        report("detect.haar_5pt", measure(lambda f: det1.detect(f, max_faces=1), frames,
+                                          min_time_s=args.min_time))
+        det_a = HaarFaceMesh5pt(min_size=(70, 70), debug=False,
+                                adaptive=AdaptiveHaarConfig(budget_ms=args.haar_budget_ms))
+        held = [f for f in frames for _ in range(4)]
+        report("detect.haar_adaptive", measure(lambda f: det_a.detect(f, max_faces=5), held,
+                                               min_time_s=args.min_time))
+        a = det_a.adaptive
+        found = sum(len(det_a.detect(f, max_faces=5)) for f in held) / 4
+        results["detect.haar_adaptive"]["faces"] = found
+        print(f"[bench] detect.haar_adaptive: level {a.level} (ceiling {a.ceiling}), {a.sweeps} sweeps, "
+              f"{a.roi_calls} ROI searches, {found:.0f} faces per pass over the frames")
+        if not args.yunet_model.exists():
+            print(f"[bench] yunet cases skipped: model not found at {args.yunet_model}")
+        else:
+            det_y = YuNetDetector(model_path=str(args.yunet_model), min_size=(70, 70), max_batch=args.yunet_batch)
+            print(f"[bench] detect.yunet finds {sum(len(det_y.detect(f, max_faces=5)) for f in frames)} faces "
+                  f"in {len(frames)} frames ({'batched' if det_y.batched else 'fixed batch 1'} model)")
+            report("detect.yunet", measure(lambda f: det_y.detect(f, max_faces=5), frames,
+                                           min_time_s=args.min_time))
+            chunks = [frames[i:i + args.yunet_batch] for i in range(0, len(frames), args.yunet_batch)]
+            report("detect.yunet.batch", measure(lambda c: det_y.detect_batch(c, max_faces=5), chunks,
+                                                 items_per_call=[len(c) for c in chunks],
+                                                 min_time_s=args.min_time))
+
+    if want("align"):
+        pairs = [(f, d.kps) for f, ds in zip(frames, dets) for d in ds]
+        if not pairs:
+            print("[bench] align skipped: no faces detected in the synthetic frames")
+        else:
+            report("align", measure(lambda p: align_face_5pt(p[0], p[1], out_size=(112, 112)), pairs,
+                                    min_time_s=args.min_time))
+            per_frame = [(f, np.stack([d.kps for d in ds])) for f, ds in zip(frames, dets) if ds]
+            aligner = FaceAligner(out_size=(112, 112))
+            report("align.batch", measure(lambda p: aligner.align(p[0], p[1]), per_frame,
+                                          items_per_call=[len(k) for _, k in per_frame],
+                                          min_time_s=args.min_time))
+
+    has_model = args.model.exists()
+    if not has_model and (want("embed") or want("batch_embed")):
+        print(f"[bench] embed cases skipped: model not found at {args.model}")
+    if has_model and want("embed"):
+        emb = ArcFaceEmbedderONNX(model_path=str(args.model), input_size=(112, 112))
+        report("embed", measure(emb.embed, crops, min_time_s=args.min_time))
+    if has_model and want("batch_embed"):
+        from src.batch_embed import BatchEmbedder
+        from src.embed import ArcFaceEmbedderONNX as BatchModel
+        be = BatchEmbedder(BatchModel(model_path=str(args.model), max_batch=args.batch_size),
+                           batch_size=args.batch_size)
+        report("batch_embed", measure(lambda ps: be.embed_paths(ps), [crop_paths],
+                                      items_per_call=[len(crop_paths)], warmup=1, min_time_s=args.min_time))
+
+    if want("match"):
+        rng = np.random.default_rng(args.seed + 1)
+        for n in args.db_sizes:
+            db = synthetic_db(n, args.dim, seed=args.seed)
+            matcher = FaceDBMatcher(db=db, dist_thresh=0.34)
+            q = rng.standard_normal((256, args.dim)).astype(np.float32)
+            q /= np.linalg.norm(q, axis=1, keepdims=True)
+            report(f"match.N{n}", measure(matcher.match, list(q), min_time_s=args.min_time))
+
+    return results
+
+# -------------------------
+# Baseline comparison
+# -------------------------
+
+def check_recall(results: Dict[str, dict], min_recall: float) -> List[str]:
+    """Faster detect cases whose face count fell below min_recall x the full-resolution Haar's."""
+    ref = results.get("detect.haar_facemesh", {}).get("faces")
+    if not ref:
+        return []
+    low = []
+    for name in ("detect.haar_adaptive",):
+        found = results.get(name, {}).get("faces")
+        if found is None:
+            continue
+        ok = found >= min_recall * ref
+        print(f"[bench] {name} finds {found:.0f}/{ref} faces of detect.haar_facemesh"
+              f"{'' if ok else f'  (< {min_recall:.0%}: RECALL LOSS)'}")
+        if not ok:
+            low.append(name)
+    return low
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Names of cases whose p50 latency grew by more than threshold (fraction)."""
+    regressed = []
+    print(f"\n{'case':<22}{'base p50':>10}{'p50':>10}{'change':>9}")
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            print(f"{name:<22}{'-':>10}{r['p50_ms']:>10.3f}{'new':>9}")
+            continue
+        change = r["p50_ms"] / max(b["p50_ms"], 1e-9) - 1.0
+        flag = ""
+        if change > threshold:
+            regressed.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<22}{b['p50_ms']:>10.3f}{r['p50_ms']:>10.3f}{change:>+8.1%}{flag}")
+    return regressed
+
+def main():
+    ap = argparse.ArgumentParser(description="Recognition pipeline benchmark suite")
+    ap.add_argument("--enroll", type=Path, default=ENROLL_DIR)
+    ap.add_argument("--model", type=Path, default=MODEL_PATH)
+    ap.add_argument("--frames", type=int, default=24, help="synthetic multi-face frames")
+    ap.add_argument("--db-sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    ap.add_argument("--dim", type=int, default=512)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--haar-budget-ms", type=float, default=10.0, help="budget of detect.haar_adaptive")
+    ap.add_argument("--yunet-model", type=Path, default=YUNET_PATH)
+    ap.add_argument("--yunet-batch", type=int, default=8, help="frames per call in detect.yunet.batch")
+    ap.add_argument("--min-time", type=float, default=1.0, help="seconds per case")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--only", nargs="+", choices=["detect", "align", "embed", "batch_embed", "match"])
+    ap.add_argument("--out", type=Path, default=RESULTS_PATH)
+    ap.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    ap.add_argument("--threshold", type=float, default=0.20, help="allowed p50 slowdown (0.20 = 20%%)")
+    ap.add_argument("--min-recall", type=float, default=0.5,
+                    help="detect.haar_adaptive must find this fraction of detect.haar_facemesh's faces")
+    ap.add_argument("--update-baseline", action="store_true", help="write results as the new baseline")
+    args = ap.parse_args()
+
+    results = run_suite(args)
+    doc = {"environment": environment(), "config": {
+        "frames": args.frames, "db_sizes": args.db_sizes, "dim": args.dim,
+        "batch_size": args.batch_size, "seed": args.seed}, "results": results}
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(doc, indent=2), encoding="utf-8")
+    print(f"\n[bench] results -> {args.out}")
+
+    low = check_recall(results, args.min_recall)
+    if low:
+        print(f"[bench] ❌ recall below {args.min_recall:.0%} of full-resolution Haar: {', '.join(low)}")
+        sys.exit(1)
+
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(doc, indent=2), encoding="utf-8")
+        print(f"[bench] baseline updated -> {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"[bench] no baseline at {args.baseline} (create one with --update-baseline)")
+        return
+
+    base = json.loads(args.baseline.read_text(encoding="utf-8"))
+    regressed = compare(results, base.get("results", {}), args.threshold)
+    if regressed:
+        print(f"[bench] ❌ {len(regressed)} case(s) slower than baseline by >{args.threshold:.0%}: "
+              f"{', '.join(regressed)}")
+        sys.exit(1)
+    print(f"[bench] ✅ no case slower than baseline by >{args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# src/batch_embed.py
+"""
+Batch embedding engine for files on disk (enrollment crops, eval sets).
+
+crop paths -> JPEG decode (thread pool, cv2.imread releases the GIL)
+           -> batches of batch_size -> ArcFaceEmbedderONNX.embed_batch
+
+- decoding runs ahead of the ONNX call (bounded prefetch), so the CPU decodes
+  batch i+1 while batch i is in sess.run
+- processes > 0 shards the path list over worker processes, each with its own
+  session and intra-op threads split evenly (multi-socket / many-core hosts)
+- a batch that fails is retried image by image, skipping only the bad ones
+- with an EmbeddingCache (src/embed_cache.py) crops are hashed first and only
+  the ones never embedded with this model are decoded and run
+- every run records images/s (BatchEmbedStats)
+
+Usage:
+    be = BatchEmbedder(embedder, batch_size=32)
+    res = be.embed_paths(paths)         # res.indices, res.embeddings (N, D)
+    print(res.stats.format())
+"""
+
+from __future__ import annotations
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .embed import ArcFaceEmbedderONNX, OrtSessionConfig, prepare_optimized_model
+from .embed_cache import EmbeddingCache, file_digest
+
+AcceptFn = Callable[[np.ndarray], bool]
+
+# -------------------------
+# Results
+# -------------------------
+
+@dataclass
+class BatchEmbedStats:
+    images: int = 0        # paths requested
+    embedded: int = 0      # embeddings produced
+    cached: int = 0        # of those, served from the embedding cache
+    skipped: int = 0       # unreadable, rejected by accept() or failed to embed
+    decode_s: float = 0.0  # summed over decode threads
+    embed_s: float = 0.0
+    wall_s: float = 0.0
+
+    @property
+    def images_per_s(self) -> float:
+        return self.embedded / self.wall_s if self.wall_s > 0 else 0.0
+
+    def merge(self, other: "BatchEmbedStats") -> None:
+        self.images += other.images
+        self.embedded += other.embedded
+        self.cached += other.cached
+        self.skipped += other.skipped
+        self.decode_s += other.decode_s
+        self.embed_s += other.embed_s
+
+    def format(self) -> str:
+        return (f"[batch-embed] {self.embedded}/{self.images} images in {self.wall_s:.2f}s "
+                f"({self.images_per_s:.1f} img/s, cached {self.cached}, embed {self.embed_s:.2f}s, "
+                f"decode {self.decode_s:.2f}s cpu, skipped {self.skipped})")
+
+@dataclass
+class BatchEmbedResult:
+    indices: np.ndarray      # (N,) positions in the input path list
+    embeddings: np.ndarray   # (N, D) float32, L2-normalized
+    stats: BatchEmbedStats
+    shapes: Optional[np.ndarray] = None  # (N, 2) crop (h, w), used to fill the cache
+
+    def split(self, counts: Sequence[int]) -> List[List[np.ndarray]]:
+        """Regroup by consecutive input ranges of the given sizes (e.g. per person)."""
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        out: List[List[np.ndarray]] = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            sel = np.nonzero((self.indices >= a) & (self.indices < b))[0]
+            out.append([self.embeddings[i] for i in sel])
+        return out
+
+# -------------------------
+# Engine
+# -------------------------
+
+def _decode(path: Path, accept: Optional[AcceptFn]) -> Tuple[Optional[np.ndarray], float]:
+    t0 = time.perf_counter()
+    img = cv2.imread(str(path))
+    if img is not None and accept is not None and not accept(img):
+        img = None
+    return img, time.perf_counter() - t0
+
+class BatchEmbedder:
+    def __init__(
+        self,
+        embedder: ArcFaceEmbedderONNX,
+        batch_size: int = 32,
+        decode_workers: int = 4,
+        processes: int = 0,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        """
+        embedder      : used in-process; its max_batch caps the real sess.run batch
+        batch_size    : crops handed to embed_batch at a time
+        decode_workers: JPEG decode threads
+        processes     : >0 shards work over that many processes (own sessions)
+        cache         : skip crops already embedded with this model
+        """
+        self.embedder = embedder
+        self.batch_size = max(1, int(batch_size))
+        self.decode_workers = max(1, int(decode_workers))
+        self.processes = max(0, int(processes))
+        self.cache = cache
+
+    def _embed_images(self, imgs: List[np.ndarray]) -> List[Optional[np.ndarray]]:
+        try:
+            return [r.embedding for r in self.embedder.embed_batch(imgs)]
+        except Exception:
+            out: List[Optional[np.ndarray]] = []
+            for img in imgs:
+                try:
+                    out.append(self.embedder.embed(img).embedding)
+                except Exception:
+                    out.append(None)
+            return out
+
+    def _run_local(self, paths: Sequence[Path], accept: Optional[AcceptFn]) -> BatchEmbedResult:
+        stats = BatchEmbedStats(images=len(paths))
+        t_start = time.perf_counter()
+        idx: List[int] = []
+        embs: List[np.ndarray] = []
+        shapes: List[Tuple[int, int]] = []
+
+        def flush(batch_idx: List[int], batch_imgs: List[np.ndarray]):
+            t0 = time.perf_counter()
+            vecs = self._embed_images(batch_imgs)
+            stats.embed_s += time.perf_counter() - t0
+            for i, img, v in zip(batch_idx, batch_imgs, vecs):
+                if v is None:
+                    stats.skipped += 1
+                else:
+                    idx.append(i)
+                    embs.append(v)
+                    shapes.append(img.shape[:2])
+
+        with ThreadPoolExecutor(self.decode_workers, thread_name_prefix="decode") as pool:
+            pending = deque()
+            it = iter(enumerate(paths))
+            prefetch = 2 * self.batch_size
+            batch_idx: List[int] = []
+            batch_imgs: List[np.ndarray] = []
+            while True:
+                while len(pending) < prefetch:
+                    nxt = next(it, None)
+                    if nxt is None:
+                        break
+                    pending.append((nxt[0], pool.submit(_decode, nxt[1], accept)))
+                if not pending:
+                    break
+                i, fut = pending.popleft()
+                img, dt = fut.result()
+                stats.decode_s += dt
+                if img is None:
+                    stats.skipped += 1
+                    continue
+                batch_idx.append(i)
+                batch_imgs.append(img)
+                if len(batch_imgs) >= self.batch_size:
+                    flush(batch_idx, batch_imgs)
+                    batch_idx, batch_imgs = [], []
+            if batch_imgs:
+                flush(batch_idx, batch_imgs)
+
+        stats.embedded = len(embs)
+        stats.wall_s = time.perf_counter() - t_start
+        E = np.stack(embs, axis=0).astype(np.float32) if embs else np.zeros((0, 0), np.float32)
+        return BatchEmbedResult(np.asarray(idx, dtype=np.int64), E, stats,
+                                np.asarray(shapes, dtype=np.int64).reshape(-1, 2))
+
+    def _run_processes(self, paths: Sequence[Path], accept: Optional[AcceptFn]) -> BatchEmbedResult:
+        t_start = time.perf_counter()
+        n = min(self.processes, max(1, len(paths) // self.batch_size))
+        shards = [list(range(k, len(paths), n)) for k in range(n)]
+
+        cfg = self.embedder.session_cfg or OrtSessionConfig()
+        if cfg.intra_op_threads <= 0:
+            cfg = replace(cfg, intra_op_threads=max(1, (os.cpu_count() or 1) // n))
+        model_path = self.embedder.model_path
+        # optimize once here; workers only load the finished graph and never write the cache
+        opt = prepare_optimized_model(model_path, cfg)
+        if opt is not None:
+            model_path = str(opt)
+            cfg = replace(cfg, optimized_model_path=None, graph_optimization="disable", model_variant="fp32")
+        job = dict(
+            model_path=model_path,
+            input_size=(self.embedder.in_w, self.embedder.in_h),
+            max_batch=self.embedder.max_batch,
+            session_cfg=cfg,
+            batch_size=self.batch_size,
+            decode_workers=max(1, self.decode_workers // n),
+        )
+
+        stats = BatchEmbedStats()
+        idx: List[np.ndarray] = []
+        embs: List[np.ndarray] = []
+        shapes: List[np.ndarray] = []
+        ctx = multiprocessing.get_context("spawn")  # no forked ORT thread pools
+        with ProcessPoolExecutor(n, mp_context=ctx) as pool:
+            futs = [pool.submit(_embed_shard, job, [paths[i] for i in sh], accept) for sh in shards]
+            for sh, fut in zip(shards, futs):
+                res = fut.result()
+                stats.merge(res.stats)
+                if res.embeddings.size:
+                    idx.append(np.asarray(sh, dtype=np.int64)[res.indices])
+                    embs.append(res.embeddings)
+                    shapes.append(res.shapes)
+
+        stats.wall_s = time.perf_counter() - t_start
+        if not embs:
+            return BatchEmbedResult(np.zeros(0, np.int64), np.zeros((0, 0), np.float32), stats)
+        all_idx = np.concatenate(idx)
+        order = np.argsort(all_idx, kind="stable")
+        return BatchEmbedResult(all_idx[order], np.concatenate(embs, axis=0)[order], stats,
+                                np.concatenate(shapes, axis=0)[order])
+
+    def embed_paths(self, paths: Sequence[Path], accept: Optional[AcceptFn] = None) -> BatchEmbedResult:
+        """
+        Embed image files in input order. accept(img) -> False skips an image
+        (must be picklable when processes > 0, e.g. a functools.partial).
+        """
+        paths = [Path(p) for p in paths]
+        if self.cache is not None:
+            return self._run_cached(paths, accept)
+        return self._run(paths, accept)
+
+    def _run(self, paths: List[Path], accept: Optional[AcceptFn]) -> BatchEmbedResult:
+        if self.processes > 0 and len(paths) > self.batch_size:
+            return self._run_processes(paths, accept)
+        return self._run_local(paths, accept)
+
+    def _run_cached(self, paths: List[Path], accept: Optional[AcceptFn]) -> BatchEmbedResult:
+        t_start = time.perf_counter()
+        with ThreadPoolExecutor(self.decode_workers, thread_name_prefix="hash") as pool:
+            digests = list(pool.map(file_digest, paths))
+        found = self.cache.get_many([d for d in digests if d is not None])
+
+        hit_idx: List[int] = []
+        hit_emb: List[np.ndarray] = []
+        hit_shape: List[Tuple[int, int]] = []
+        miss: List[int] = []
+        skipped = 0
+        for i, d in enumerate(digests):
+            if d is None or d not in found:
+                miss.append(i)
+                continue
+            emb, (h, w) = found[d]
+            # accept() only sees the crop's shape here (zero-stride stand-in, no decode)
+            if accept is not None and not accept(np.broadcast_to(np.zeros(1, np.uint8), (h, w, 3))):
+                skipped += 1
+                continue
+            hit_idx.append(i)
+            hit_emb.append(emb)
+            hit_shape.append((h, w))
+
+        res = self._run([paths[i] for i in miss], accept) if miss else None
+        stats = BatchEmbedStats(images=len(paths), cached=len(hit_idx), skipped=skipped)
+        idx_parts = [np.asarray(hit_idx, dtype=np.int64)]
+        emb_parts = [np.stack(hit_emb).astype(np.float32)] if hit_emb else []
+        shape_parts = [np.asarray(hit_shape, dtype=np.int64).reshape(-1, 2)]
+        if res is not None:
+            miss_arr = np.asarray(miss, dtype=np.int64)
+            stats.merge(res.stats)
+            stats.images -= res.stats.images
+            if res.embeddings.size:
+                idx_parts.append(miss_arr[res.indices])
+                emb_parts.append(res.embeddings)
+                shape_parts.append(res.shapes)
+                self.cache.put_many([(digests[miss_arr[j]], res.embeddings[k], tuple(res.shapes[k]))
+                                     for k, j in enumerate(res.indices) if digests[miss_arr[j]] is not None])
+
+        stats.embedded = stats.cached + (res.stats.embedded if res is not None else 0)
+        stats.wall_s = time.perf_counter() - t_start
+        if not emb_parts:
+            return BatchEmbedResult(np.zeros(0, np.int64), np.zeros((0, 0), np.float32), stats,
+                                    np.zeros((0, 2), np.int64))
+        all_idx = np.concatenate(idx_parts)
+        order = np.argsort(all_idx, kind="stable")
+        return BatchEmbedResult(all_idx[order], np.concatenate(emb_parts, axis=0)[order], stats,
+                                np.concatenate(shape_parts, axis=0)[order])
+
+def _embed_shard(job: dict, paths: List[Path], accept: Optional[AcceptFn]) -> BatchEmbedResult:
+    """Worker-process entry point: own session, same decode/batch loop."""
+    embedder = ArcFaceEmbedderONNX(
+        model_path=job["model_path"],
+        input_size=job["input_size"],
+        max_batch=job["max_batch"],
+        session_cfg=job["session_cfg"],
+    )
+    be = BatchEmbedder(embedder, batch_size=job["batch_size"], decode_workers=job["decode_workers"])
+    return be._run_local(paths, accept)
@@ -0,0 +1,247 @@
+# src/detectors.py
+"""
+Face detector backends behind one interface.
+
+Every backend returns FaceDet (box + 5 keypoints [Leye, Reye, Nose, Lmouth, Rmouth]
+in full-frame coordinates), so FaceTracker, alignment and the embedders do not
+care which one runs:
+
+    haar    HaarFaceMesh5pt (recognize.py): Haar cascade, then MediaPipe FaceMesh
+            (or the geometric fallback) for the keypoints
+    yunet   YuNetDetector: ONE CNN pass gives boxes AND keypoints, no Haar and no
+            FaceMesh. Model: face_detection_yunet_2023mar.onnx from opencv_zoo,
+            saved as models/face_detection_yunet_2023mar.onnx
+
+Interface (FaceDetector):
+    detect(frame_bgr, max_faces)        -> List[FaceDet]
+    detect_batch(frames, max_faces)     -> List[List[FaceDet]], frames of any size
+
+YuNet runs on onnxruntime (session shared through src/registry.py). Frames are
+letterboxed into input_size, so a list of frames is one sess.run when the model
+has a dynamic batch dimension (one run per frame otherwise). Decoding matches
+cv2.FaceDetectorYN: per stride 8/16/32 grid cell, score = sqrt(cls * obj),
+box/keypoints as offsets from the cell, then NMS. backend="opencv" runs
+cv2.FaceDetectorYN itself instead (one frame per call, serialized).
+
+Run:
+    python -m src.recognize --detector yunet [--detector-model path.onnx]
+    python -m benchmarks.suite --only detect        # haar vs yunet, same frames
+"""
+
+from __future__ import annotations
+import threading
+from pathlib import Path
+from typing import List, Optional, Protocol, Sequence, Tuple, runtime_checkable
+
+import cv2
+import numpy as np
+
+from . import registry
+from .embed import OrtSessionConfig
+from .haar_5pt import AdaptiveHaarConfig
+from .profiling import PROFILER
+from .recognize import FaceDet, HaarFaceMesh5pt, _bbox_from_5pt, _clip_xyxy, _kps_span_ok
+
+DETECTORS = ("haar", "yunet")
+YUNET_BACKENDS = ("ort", "opencv")
+YUNET_MODEL = "models/face_detection_yunet_2023mar.onnx"
+
+# -------------------------
+# Interface
+# -------------------------
+
+@runtime_checkable
+class FaceDetector(Protocol):
+    def detect(self, frame_bgr: np.ndarray, max_faces: int = 5) -> List[FaceDet]: ...
+
+    def detect_batch(self, frames: Sequence[np.ndarray], max_faces: int = 5) -> List[List[FaceDet]]: ...
+
+# -------------------------
+# YuNet
+# -------------------------
+
+class YuNetDetector:
+    STRIDES = (8, 16, 32)
+
+    def __init__(
+        self,
+        model_path: str = YUNET_MODEL,
+        input_size: Tuple[int, int] = (320, 320),
+        score_thresh: float = 0.9,
+        nms_thresh: float = 0.3,
+        top_k: int = 50,
+        min_size: Tuple[int, int] = (70, 70),
+        max_batch: int = 8,
+        backend: str = "ort",
+        session_cfg: Optional[OrtSessionConfig] = None,
+    ):
+        """
+        input_size  : network (w, h); rounded up to multiples of 32. Frames are
+                      scaled to fit (aspect kept) and zero-padded right/bottom.
+        min_size    : faces smaller than this (full-frame pixels) are dropped, like Haar's minSize
+        max_batch   : frames per sess.run in detect_batch
+        """
+        if backend not in YUNET_BACKENDS:
+            raise ValueError(f"Unknown YuNet backend: {backend!r} (expected one of {YUNET_BACKENDS})")
+        if not Path(model_path).exists():
+            raise FileNotFoundError(f"YuNet model not found: {model_path} "
+                                    "(face_detection_yunet_2023mar.onnx from opencv_zoo)")
+        self.model_path = str(model_path)
+        self.backend = backend
+        self.score_thresh = float(score_thresh)
+        self.nms_thresh = float(nms_thresh)
+        self.top_k = int(top_k)
+        self.min_size = tuple(map(int, min_size))
+        self.max_batch = max(1, int(max_batch))
+        self.in_w = (int(input_size[0]) + 31) // 32 * 32
+        self.in_h = (int(input_size[1]) + 31) // 32 * 32
+
+        self.sess = None
+        self._cv = None
+        self._cv_lock = threading.Lock()
+        if backend == "ort":
+            # detector session: FP32 file as given, thread settings from FACE_ORT_*
+            cfg = session_cfg or OrtSessionConfig.from_env(model_variant="fp32", optimized_model_path=None)
+            self.sess = registry.get_session(self.model_path, cfg)
+            inp = self.sess.get_inputs()[0]
+            self.in_name = inp.name
+            n, _, h, w = inp.shape
+            if isinstance(h, int) and isinstance(w, int) and h > 0 and w > 0:
+                self.in_w, self.in_h = w, h  # fixed-size export
+            self.batched = not (isinstance(n, int) and n > 0)
+            self.out_names = [f"{k}_{s}" for k in ("cls", "obj", "bbox", "kps") for s in self.STRIDES]
+            missing = set(self.out_names) - {o.name for o in self.sess.get_outputs()}
+            if missing:
+                raise ValueError(f"{model_path} is not a YuNet model (missing outputs {sorted(missing)})")
+        else:
+            self._cv = cv2.FaceDetectorYN.create(self.model_path, "", (self.in_w, self.in_h),
+                                                 self.score_thresh, self.nms_thresh, self.top_k)
+        self.detect_batch([np.zeros((self.in_h, self.in_w, 3), dtype=np.uint8)])  # warm-up
+
+    # ---- pre / post ----
+
+    def _letterbox(self, frame_bgr: np.ndarray, out: np.ndarray) -> float:
+        """Scale frame into out (in_h, in_w, 3) uint8, top-left, zero-padded. Returns the scale."""
+        H, W = frame_bgr.shape[:2]
+        s = min(self.in_w / W, self.in_h / H)
+        w, h = min(self.in_w, max(1, int(round(W * s)))), min(self.in_h, max(1, int(round(H * s))))
+        out[:] = 0
+        if (w, h) == (W, H):
+            out[:h, :w] = frame_bgr
+        else:
+            out[:h, :w] = cv2.resize(frame_bgr, (w, h), interpolation=cv2.INTER_LINEAR)
+        return s
+
+    def _decode(self, outs: List[np.ndarray], i: int) -> np.ndarray:
+        """Rows [x, y, w, h, 10 x kps, score] of image i in network coordinates, after NMS."""
+        rows = []
+        for j, s in enumerate(self.STRIDES):
+            cols = self.in_w // s
+            cls = outs[j][i].reshape(-1)
+            obj = outs[3 + j][i].reshape(-1)
+            score = np.sqrt(np.clip(cls, 0.0, 1.0) * np.clip(obj, 0.0, 1.0))
+            keep = np.flatnonzero(score >= self.score_thresh)
+            if keep.size == 0:
+                continue
+            c = (keep % cols).astype(np.float32)
+            r = (keep // cols).astype(np.float32)
+            bb = outs[6 + j][i].reshape(-1, 4)[keep]
+            kp = outs[9 + j][i].reshape(-1, 5, 2)[keep]
+            w = np.exp(bb[:, 2]) * s
+            h = np.exp(bb[:, 3]) * s
+            x = (c + bb[:, 0]) * s - w / 2.0
+            y = (r + bb[:, 1]) * s - h / 2.0
+            kps = (kp + np.stack([c, r], axis=1)[:, None, :]) * s
+            rows.append(np.column_stack([x, y, w, h, kps.reshape(-1, 10), score[keep]]))
+        if not rows:
+            return np.zeros((0, 15), dtype=np.float32)
+        d = np.concatenate(rows, axis=0).astype(np.float32)
+        # integer rects, as cv2.FaceDetectorYN feeds its NMS
+        idx = cv2.dnn.NMSBoxes(d[:, :4].astype(np.int32).tolist(), d[:, 14].tolist(), self.score_thresh,
+                               self.nms_thresh, top_k=self.top_k)
+        return d[np.asarray(idx, dtype=np.int64).reshape(-1)]
+
+    def _to_faces(self, dets: np.ndarray, scale: float, W: int, H: int, max_faces: int) -> List[FaceDet]:
+        if len(dets) == 0:
+            return []
+        dets = dets[np.argsort(-(dets[:, 2] * dets[:, 3]))]  # largest first, like Haar
+        out: List[FaceDet] = []
+        for row in dets:
+            w = float(row[2]) / scale
+            if min(w, float(row[3]) / scale) < min(self.min_size):
+                continue
+            kps = (row[4:14].reshape(5, 2) / scale).astype(np.float32)
+            if kps[0, 0] > kps[1, 0]:
+                kps[[0, 1]] = kps[[1, 0]]
+            if kps[3, 0] > kps[4, 0]:
+                kps[[3, 4]] = kps[[4, 3]]
+            if not _kps_span_ok(kps, min_eye_dist=max(8.0, 0.15 * w)):
+                continue
+            bb = _bbox_from_5pt(kps, pad_x=0.55, pad_y_top=0.85, pad_y_bot=1.15)
+            x1, y1, x2, y2 = _clip_xyxy(bb[0], bb[1], bb[2], bb[3], W, H)
+            out.append(FaceDet(x1=x1, y1=y1, x2=x2, y2=y2, score=float(row[14]), kps=kps))
+            if len(out) >= max_faces:
+                break
+        return out
+
+    # ---- detection ----
+
+    def _run_ort(self, frames: Sequence[np.ndarray]) -> List[Tuple[np.ndarray, float]]:
+        # per-call buffers: detect() may run on several threads (service executor)
+        canvas = np.empty((len(frames), self.in_h, self.in_w, 3), dtype=np.uint8)
+        scales = [self._letterbox(f, canvas[i]) for i, f in enumerate(frames)]
+        x = np.ascontiguousarray(canvas.transpose(0, 3, 1, 2), dtype=np.float32)
+        step = len(frames) if self.batched else 1
+        results: List[Tuple[np.ndarray, float]] = []
+        for s in range(0, len(frames), step):
+            with PROFILER.time("yunet"):
+                outs = self.sess.run(self.out_names, {self.in_name: x[s:s + step]})
+            for i in range(min(step, len(frames) - s)):
+                results.append((self._decode(outs, i), scales[s + i]))
+        return results
+
+    def _run_opencv(self, frame_bgr: np.ndarray) -> Tuple[np.ndarray, float]:
+        canvas = np.empty((self.in_h, self.in_w, 3), dtype=np.uint8)
+        scale = self._letterbox(frame_bgr, canvas)
+        with self._cv_lock, PROFILER.time("yunet"):
+            _, faces = self._cv.detect(canvas)
+        return (np.zeros((0, 15), dtype=np.float32) if faces is None else faces), scale
+
+    def detect(self, frame_bgr: np.ndarray, max_faces: int = 5) -> List[FaceDet]:
+        return self.detect_batch([frame_bgr], max_faces=max_faces)[0]
+
+    def detect_batch(self, frames: Sequence[np.ndarray], max_faces: int = 5) -> List[List[FaceDet]]:
+        out: List[List[FaceDet]] = []
+        for s in range(0, len(frames), self.max_batch):
+            chunk = frames[s:s + self.max_batch]
+            if self.backend == "ort":
+                raw = self._run_ort(chunk)
+            else:
+                raw = [self._run_opencv(f) for f in chunk]
+            for f, (dets, scale) in zip(chunk, raw):
+                out.append(self._to_faces(dets, scale, f.shape[1], f.shape[0], max_faces))
+        return out
+
+# -------------------------
+# Factory
+# -------------------------
+
+def create_detector(
+    kind: str = "haar",
+    min_size: Tuple[int, int] = (70, 70),
+    max_faces: int = 5,
+    landmark_mode: str = "frame",
+    adaptive: Optional[AdaptiveHaarConfig] = None,
+    model_path: Optional[str] = None,
+    **kwargs,
+) -> FaceDetector:
+    """
+    "haar"  -> HaarFaceMesh5pt(min_size, landmark_mode, max_faces, adaptive)
+    "yunet" -> YuNetDetector(model_path or YUNET_MODEL, min_size, **kwargs)
+    """
+    if kind == "haar":
+        return HaarFaceMesh5pt(min_size=min_size, debug=False, landmark_mode=landmark_mode,
+                               max_faces=max_faces, adaptive=adaptive)
+    if kind == "yunet":
+        return YuNetDetector(model_path=model_path or YUNET_MODEL, min_size=min_size, **kwargs)
+    raise ValueError(f"Unknown detector: {kind!r} (expected one of {DETECTORS})")
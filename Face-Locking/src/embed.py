@@ -14,13 +14,18 @@ Keys:
 
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Tuple, Optional
+from pathlib import Path
+from typing import List, Tuple, Optional
+import json
+import os
 import time
 import cv2
 import numpy as np
 import onnxruntime as ort
 
 from .haar_5pt import Haar5ptDetector, align_face_5pt
+from . import registry
+from .profiling import PROFILER, profiled
 
 # -------------------------
 # Data
@@ -32,6 +37,218 @@ class EmbeddingResult:
     norm_before: float
     dim: int
 
+# -------------------------
+# ONNX Runtime session config
+# -------------------------
+
+_GRAPH_OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+_EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+MODEL_VARIANTS = ("fp32", "int8", "fp16")
+
+def variant_path(model_path: str, variant: str) -> Path:
+    """models/embedder_arcface.onnx + "int8" -> models/embedder_arcface.int8.onnx"""
+    p = Path(model_path)
+    if variant == "fp32":
+        return p
+    return p.with_name(f"{p.stem}.{variant}{p.suffix}")
+
+def resolve_model_path(model_path: str, variant: str = "fp32") -> Path:
+    """
+    Pick the model file for a variant.
+    "auto" prefers int8, then fp16, then the FP32 original, whichever exists.
+    An explicit variant must exist on disk.
+    """
+    if variant == "auto":
+        for v in ("int8", "fp16"):
+            p = variant_path(model_path, v)
+            if p.exists():
+                return p
+        return Path(model_path)
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown model variant: {variant!r} (expected one of {MODEL_VARIANTS} or 'auto')")
+    p = variant_path(model_path, variant)
+    if not p.exists():
+        raise FileNotFoundError(f"Model variant '{variant}' not found: {p}. Run: python -m src.quantize")
+    return p
+
+@dataclass
+class OrtSessionConfig:
+    """
+    SessionOptions for the embedder, shared by recognize / embed / enroll / evaluate.
+
+    Thread counts of 0 let ONNX Runtime pick (one thread per physical core).
+    When several camera processes share a host, give each a slice of the
+    cores, e.g. intra_op_threads=2, or set FACE_ORT_INTRA_THREADS in the env.
+    """
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    graph_optimization: str = "all"       # disable | basic | extended | all
+    execution_mode: str = "sequential"    # sequential | parallel
+    enable_cpu_mem_arena: bool = True
+    enable_mem_pattern: bool = True
+    # If set, the optimized graph is written here on first load and reused afterwards.
+    # With graph_optimization="all" the cached graph is host-specific (NCHWc layouts).
+    optimized_model_path: Optional[Path] = None
+    providers: Tuple[str, ...] = ("CPUExecutionProvider",)
+    # fp32 | int8 | fp16 | auto ; quantized files sit next to the FP32 model (see src/quantize.py)
+    model_variant: str = "fp32"
+
+    @classmethod
+    def from_env(cls, **overrides) -> "OrtSessionConfig":
+        """Defaults, overridden by FACE_ORT_* environment variables, then by kwargs."""
+        cfg = cls()
+        env = os.environ
+        if "FACE_ORT_INTRA_THREADS" in env:
+            cfg.intra_op_threads = int(env["FACE_ORT_INTRA_THREADS"])
+        if "FACE_ORT_INTER_THREADS" in env:
+            cfg.inter_op_threads = int(env["FACE_ORT_INTER_THREADS"])
+        if "FACE_ORT_GRAPH_OPT" in env:
+            cfg.graph_optimization = env["FACE_ORT_GRAPH_OPT"]
+        if "FACE_ORT_OPTIMIZED_MODEL" in env:
+            cfg.optimized_model_path = Path(env["FACE_ORT_OPTIMIZED_MODEL"])
+        if "FACE_MODEL_VARIANT" in env:
+            cfg.model_variant = env["FACE_MODEL_VARIANT"]
+        for k, v in overrides.items():
+            setattr(cfg, k, v)
+        return cfg
+
+    def to_session_options(self) -> ort.SessionOptions:
+        if self.graph_optimization not in _GRAPH_OPT_LEVELS:
+            raise ValueError(f"Unknown graph_optimization: {self.graph_optimization!r}")
+        if self.execution_mode not in _EXECUTION_MODES:
+            raise ValueError(f"Unknown execution_mode: {self.execution_mode!r}")
+
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = int(self.intra_op_threads)
+        so.inter_op_num_threads = int(self.inter_op_threads)
+        so.graph_optimization_level = _GRAPH_OPT_LEVELS[self.graph_optimization]
+        so.execution_mode = _EXECUTION_MODES[self.execution_mode]
+        so.enable_cpu_mem_arena = bool(self.enable_cpu_mem_arena)
+        so.enable_mem_pattern = bool(self.enable_mem_pattern)
+        return so
+
+def optimized_cache_path(model_path: str, cfg: OrtSessionConfig) -> Optional[Path]:
+    """File the optimized graph of model_path under cfg is cached in (None: no caching)."""
+    if cfg.optimized_model_path is None:
+        return None
+    src = resolve_model_path(str(model_path), cfg.model_variant)
+    # keep one cache file per variant so switching variants never loads a stale graph
+    variant = "fp32" if src == Path(model_path) else src.suffixes[-2].lstrip(".")
+    return variant_path(str(cfg.optimized_model_path), variant)
+
+def _cache_key(src: Path, cfg: OrtSessionConfig) -> dict:
+    """What an optimized graph depends on besides the model's mtime; stored next to it as <file>.json."""
+    return {
+        "model": str(src.resolve()),
+        "graph_optimization": cfg.graph_optimization,
+        "providers": list(cfg.providers),
+        "onnxruntime": ort.__version__,
+    }
+
+def _cache_valid(opt: Path, src: Path, key: dict) -> bool:
+    if not (opt.exists() and src.exists() and opt.stat().st_mtime >= src.stat().st_mtime):
+        return False
+    try:
+        return json.loads(opt.with_name(opt.name + ".json").read_text(encoding="utf-8")) == key
+    except (OSError, ValueError):
+        return False
+
+def create_session(model_path: str, cfg: Optional[OrtSessionConfig] = None) -> ort.InferenceSession:
+    """
+    Build an InferenceSession from cfg.
+
+    model_path is the FP32 model; cfg.model_variant may swap in a quantized
+    sibling file. With optimized_model_path set: if the cached optimized graph
+    is newer than the model and was built with the same optimization level,
+    providers and onnxruntime version (sidecar <file>.json), it is loaded with
+    graph optimization disabled (already done); otherwise the model is
+    optimized and saved to that path.
+    The graph is written to a temporary file and renamed into place, so a
+    concurrent reader never sees a partial file.
+    """
+    cfg = cfg or OrtSessionConfig()
+    so = cfg.to_session_options()
+    src = resolve_model_path(str(model_path), cfg.model_variant)
+    path = str(src)
+
+    opt = optimized_cache_path(str(model_path), cfg)
+    tmp = None
+    key = _cache_key(src, cfg)
+    if opt is not None:
+        if _cache_valid(opt, src, key):
+            path = str(opt)
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        else:
+            opt.parent.mkdir(parents=True, exist_ok=True)
+            tmp = opt.with_name(f"{opt.name}.{os.getpid()}.tmp")
+            so.optimized_model_filepath = str(tmp)
+
+    sess = ort.InferenceSession(path, sess_options=so, providers=list(cfg.providers))
+    if tmp is not None and tmp.exists():
+        os.replace(tmp, opt)
+        opt.with_name(opt.name + ".json").write_text(json.dumps(key), encoding="utf-8")
+    return sess
+
+def prepare_optimized_model(model_path: str, cfg: OrtSessionConfig) -> Optional[Path]:
+    """
+    Write (or refresh) cfg's cached optimized graph now and return it, or None
+    without a cache path. Lets a parent build the file once before handing it
+    to worker processes, instead of every worker optimizing into the same path.
+    """
+    opt = optimized_cache_path(str(model_path), cfg)
+    if opt is None:
+        return None
+    create_session(str(model_path), cfg)
+    return opt if opt.exists() else None
+
+# -------------------------
+# Preprocessing
+# -------------------------
+
+# ArcFace input normalization: (x - 127.5) / 128
+ARCFACE_MEAN = 127.5
+ARCFACE_SCALE = 1.0 / 128.0
+
+# Bump whenever preprocess_into's output changes: cached embeddings
+# (src/embed_cache.py) made with another version are ignored.
+PREPROCESS_VERSION = 1
+
+@profiled("preprocess")
+def preprocess_into(
+    images: List[np.ndarray],
+    out: np.ndarray,
+    input_size: Tuple[int, int] = (112, 112),
+) -> np.ndarray:
+    """
+    Write aligned BGR uint8 crops straight into a preallocated NCHW float32 blob.
+
+    Each crop is cast-copied once through a BGR->RGB, HWC->CHW view, then
+    mean/scale run in place over the whole batch, so crops already at
+    input_size cost no temporary arrays.
+    out: (B, 3, H, W) float32 with B >= len(images).
+    Returns the view out[:len(images)].
+    """
+    in_w, in_h = int(input_size[0]), int(input_size[1])
+    n = len(images)
+    for i, img in enumerate(images):
+        if img.shape[:2] != (in_h, in_w):
+            img = cv2.resize(img, (in_w, in_h), interpolation=cv2.INTER_LINEAR)
+        np.copyto(out[i], img[:, :, ::-1].transpose(2, 0, 1), casting="unsafe")
+    blob = out[:n]
+    np.subtract(blob, ARCFACE_MEAN, out=blob)
+    np.multiply(blob, ARCFACE_SCALE, out=blob)
+    return blob
+
 # -------------------------
 # Embedder
 # -------------------------
@@ -41,36 +258,44 @@ class ArcFaceEmbedderONNX:
     ArcFace / InsightFace-style ONNX embedder.
     Input: aligned 112x112 BGR image.
     Output: L2-normalized embedding vector.
+
+    The embedder owns a (max_batch, 3, H, W) input buffer that is reused on
+    every call, so one instance must not be shared between threads.
     """
 
     def __init__(
         self,
         model_path: str = "models/embedder_arcface.onnx",
         input_size: Tuple[int, int] = (112, 112),
+        max_batch: int = 8,
+        session_cfg: Optional[OrtSessionConfig] = None,
         debug: bool = False,
     ):
         self.in_w, self.in_h = input_size
         self.debug = debug
+        self.model_path = model_path
+        self.session_cfg = session_cfg  # kept so worker processes can open the same session
+        self.model_file = resolve_model_path(model_path, (session_cfg or OrtSessionConfig()).model_variant)
 
-        self.sess = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.sess = registry.get_session(model_path, session_cfg)  # shared per process
         self.in_name = self.sess.get_inputs()[0].name
         self.out_name = self.sess.get_outputs()[0].name
 
+        # Some exported ArcFace graphs pin the batch axis to 1; those can only run face-by-face.
+        batch_dim = self.sess.get_inputs()[0].shape[0]
+        self.fixed_batch = isinstance(batch_dim, int) and batch_dim == 1
+        self.max_batch = 1 if self.fixed_batch else max(1, int(max_batch))
+
+        self._buf = np.empty((self.max_batch, 3, self.in_h, self.in_w), dtype=np.float32)
+
         if debug:
             print("[embed] model loaded")
             print("[embed] input:", self.sess.get_inputs()[0].shape)
             print("[embed] output:", self.sess.get_outputs()[0].shape)
 
     def _preprocess(self, aligned_bgr: np.ndarray) -> np.ndarray:
-        if aligned_bgr.shape[:2] != (self.in_h, self.in_w):
-            aligned_bgr = cv2.resize(aligned_bgr, (self.in_w, self.in_h))
-
-        rgb = cv2.cvtColor(aligned_bgr, cv2.COLOR_BGR2RGB).astype(np.float32)
-        rgb = (rgb - 127.5) / 128.0
-        # Change (H, W, C) to (C, H, W)
-        rgb = np.transpose(rgb, (2, 0, 1))
-        x = rgb[None, ...] 
-        return x.astype(np.float32)
+        # NOTE: returns a view of the shared input buffer
+        return preprocess_into([aligned_bgr], self._buf, (self.in_w, self.in_h))
 
     @staticmethod
     def _l2_normalize(v: np.ndarray, eps: float = 1e-12):
@@ -79,11 +304,29 @@ class ArcFaceEmbedderONNX:
 
     def embed(self, aligned_bgr: np.ndarray) -> EmbeddingResult:
         x = self._preprocess(aligned_bgr)
-        y = self.sess.run([self.out_name], {self.in_name: x})[0]
+        with PROFILER.time("onnx_run"):
+            y = self.sess.run([self.out_name], {self.in_name: x})[0]
         v = y.reshape(-1).astype(np.float32)
         v_norm, n0 = self._l2_normalize(v)
         return EmbeddingResult(v_norm, n0, v_norm.size)
 
+    def embed_batch(self, aligned_list: List[np.ndarray]) -> List[EmbeddingResult]:
+        """
+        Embed several aligned crops, max_batch crops per sess.run.
+        Normalization is done once over each (n, D) output.
+        """
+        out: List[EmbeddingResult] = []
+        for s in range(0, len(aligned_list), self.max_batch):
+            chunk = aligned_list[s:s + self.max_batch]
+            x = preprocess_into(chunk, self._buf, (self.in_w, self.in_h))
+            with PROFILER.time("onnx_run"):
+                y = self.sess.run([self.out_name], {self.in_name: x})[0]
+            Y = np.asarray(y, dtype=np.float32).reshape(len(chunk), -1)
+            norms = np.linalg.norm(Y, axis=1) + 1e-12
+            Yn = (Y / norms[:, None]).astype(np.float32)
+            out.extend(EmbeddingResult(Yn[i], float(norms[i]), Yn.shape[1]) for i in range(Yn.shape[0]))
+        return out
+
 # -------------------------
 # Visualization helpers
 # -------------------------
@@ -162,6 +405,7 @@ def main():
 
     emb_model = ArcFaceEmbedderONNX(
         model_path="models/embedder_arcface.onnx",
+        session_cfg=OrtSessionConfig.from_env(),
         debug=False,
     )
 
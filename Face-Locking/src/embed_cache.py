@@ -0,0 +1,131 @@
+# src/embed_cache.py
+"""
+Persistent embedding cache for crops on disk (sqlite, data/cache/embeddings.sqlite).
+
+A row is keyed by (crop content hash, model key), where the model key is
+the hash of the model file + PREPROCESS_VERSION + input size. Unchanged
+crops are therefore never embedded twice, renamed/copied crops still hit,
+and a changed model or preprocessing simply stops matching old rows.
+
+Eviction: the models table remembers the model key last used per model
+file path. When the file at that path changes (retrained / re-exported),
+rows of its previous key are deleted on open, unless another path still
+uses that key. Variants live at different paths (embedder_arcface.int8.onnx),
+so alternating fp32 / int8 runs (quantize gate) do not evict each other.
+
+Used through BatchEmbedder(cache=EmbeddingCache.for_embedder(embedder)).
+"""
+
+from __future__ import annotations
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .embed import PREPROCESS_VERSION
+
+DEFAULT_CACHE_PATH = Path("data/cache/embeddings.sqlite")
+
+# -------------------------
+# Hashing
+# -------------------------
+
+def file_digest(path: Path, chunk: int = 1 << 20) -> Optional[str]:
+    """blake2b-128 of the file content, None if unreadable."""
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(chunk), b""):
+                h.update(block)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+# -------------------------
+# Cache
+# -------------------------
+
+class EmbeddingCache:
+    def __init__(self, model_file: Path, input_size: Tuple[int, int] = (112, 112),
+                 path: Path = DEFAULT_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS models (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, model_key TEXT);
+            CREATE TABLE IF NOT EXISTS embeddings (
+                content_hash TEXT, model_key TEXT, dim INTEGER, h INTEGER, w INTEGER, emb BLOB,
+                PRIMARY KEY (content_hash, model_key));
+        """)
+        self.model_key = self._model_key(Path(model_file), input_size)
+        self.hits = 0  # get_many lookups (per requested hash) since open
+        self.misses = 0
+
+    @classmethod
+    def for_embedder(cls, embedder, path: Path = DEFAULT_CACHE_PATH) -> "EmbeddingCache":
+        return cls(embedder.model_file, (embedder.in_w, embedder.in_h), path)
+
+    def _model_key(self, model_file: Path, input_size: Tuple[int, int]) -> str:
+        """Model file hash (reused while size/mtime match) + preprocessing version."""
+        mpath = str(model_file.resolve())
+        st = model_file.stat()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT size, mtime_ns, model_key FROM models WHERE path=?", (mpath,)).fetchone()
+            suffix = f":pp{PREPROCESS_VERSION}:{input_size[0]}x{input_size[1]}"
+            if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns and row[2].endswith(suffix):
+                return row[2]
+
+            key = file_digest(model_file) + suffix
+            if row is not None and row[2] != key:
+                # model at this path changed: drop its old rows unless another path still uses them
+                shared = self._db.execute(
+                    "SELECT COUNT(*) FROM models WHERE model_key=? AND path<>?", (row[2], mpath)).fetchone()[0]
+                if not shared:
+                    n = self._db.execute("DELETE FROM embeddings WHERE model_key=?", (row[2],)).rowcount
+                    print(f"[embed-cache] model changed ({model_file.name}), evicted {n} embeddings")
+            self._db.execute("INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?)",
+                             (mpath, st.st_size, st.st_mtime_ns, key))
+            return key
+
+    def get_many(self, hashes: Sequence[str]) -> Dict[str, Tuple[np.ndarray, Tuple[int, int]]]:
+        """content hash -> (embedding, (h, w) of the crop) for the hashes present."""
+        out: Dict[str, Tuple[np.ndarray, Tuple[int, int]]] = {}
+        uniq = list(dict.fromkeys(hashes))
+        with self._lock:
+            for s in range(0, len(uniq), 500):  # stay under sqlite's bound-parameter limit
+                chunk = uniq[s:s + 500]
+                q = (f"SELECT content_hash, dim, h, w, emb FROM embeddings "
+                     f"WHERE model_key=? AND content_hash IN ({','.join('?' * len(chunk))})")
+                for ch, dim, h, w, blob in self._db.execute(q, [self.model_key, *chunk]):
+                    out[ch] = (np.frombuffer(blob, dtype=np.float32, count=dim), (h, w))
+            hit = sum(1 for ch in hashes if ch in out)
+            self.hits += hit
+            self.misses += len(hashes) - hit
+        return out
+
+    def put_many(self, rows: List[Tuple[str, np.ndarray, Tuple[int, int]]]) -> None:
+        """rows: (content hash, embedding, (h, w)); one transaction."""
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)",
+                [(ch, self.model_key, int(e.size), int(hw[0]), int(hw[1]),
+                  np.ascontiguousarray(e, dtype=np.float32).tobytes())
+                 for ch, e, hw in rows],
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings WHERE model_key=?",
+                                    (self.model_key,)).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
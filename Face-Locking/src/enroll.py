@@ -5,13 +5,22 @@ enroll.py
 Enrollment tool using your working pipeline:
 camera -> Haar detection -> FaceMesh 5pt -> align_face_5pt (112x112) -> ArcFace embedding
 
-Stores template per identity (mean embedding, L2-normalized).
+Stores template(s) per identity:
+- templates_per_identity = 1: mean embedding, L2-normalized (D,)
+- templates_per_identity = K: K representative embeddings (K, D), picked by
+  spherical k-means or farthest-point sampling over all samples. The matcher
+  pools over them, which holds up better under pose / lighting changes.
 
 Re-enroll behavior:
 - If data/enroll/<name> already contains aligned crops, those are loaded,
   embedded again, and INCLUDED in the template. New captures are appended.
 
-Outputs:
+Outputs (db_format="emb", default):
+- data/db/face_db.emb(+.idx.npy, .json)  memory-mapped DB, saving appends
+  only the enrolled identity (src/facedb.py). An existing face_db.npz is
+  migrated on first use.
+
+Outputs (db_format="npz", legacy, whole file rewritten on every save):
 - data/db/face_db.npz   (name -> embedding vector)
 - data/db/face_db.json  (metadata)
 
@@ -29,7 +38,7 @@ Controls:
 from __future__ import annotations
 import json
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, List, Optional
 
@@ -37,7 +46,11 @@ import cv2
 import numpy as np
 
 from .haar_5pt import Haar5ptDetector, align_face_5pt
-from .embed import ArcFaceEmbedderONNX
+from . import registry
+from .embed import ArcFaceEmbedderONNX, OrtSessionConfig
+from .facedb import FaceDB, migrate_npz
+from .batch_embed import BatchEmbedder
+from .embed_cache import DEFAULT_CACHE_PATH, EmbeddingCache
 
 # -------------------------
 # Config
@@ -48,6 +61,10 @@ class EnrollConfig:
     out_db_npz: Path = Path("data/db/face_db.npz")
     out_db_json: Path = Path("data/db/face_db.json")
 
+    # "emb": append-only memmap DB (src/facedb.py), "npz": legacy full rewrite
+    db_format: str = "emb"
+    out_db_emb: Path = Path("data/db/face_db.emb")
+
     save_crops: bool = True
     crops_dir: Path = Path("data/enroll")
 
@@ -55,6 +72,20 @@ class EnrollConfig:
     auto_capture_every_s: float = 0.25
     max_existing_crops: int = 300
 
+    # templates per identity (1 = single mean embedding)
+    templates_per_identity: int = 1
+    template_method: str = "kmeans"  # kmeans | fps
+
+    # re-embedding existing crops: batched ONNX, threaded JPEG decode
+    batch_size: int = 32
+    decode_workers: int = 4
+    embed_processes: int = 0  # >0: shard over worker processes
+    embed_cache: bool = True  # reuse embeddings of unchanged crops (data/cache/)
+    embed_cache_path: Path = DEFAULT_CACHE_PATH
+
+    # ONNX Runtime threading / optimization
+    ort: OrtSessionConfig = field(default_factory=OrtSessionConfig.from_env)
+
     # UI
     window_main: str = "enroll"
     window_aligned: str = "aligned_112"
@@ -70,13 +101,26 @@ def ensure_dirs(cfg: EnrollConfig) -> None:
         cfg.crops_dir.mkdir(parents=True, exist_ok=True)
 
 def load_db(cfg: EnrollConfig) -> Dict[str, np.ndarray]:
+    if cfg.db_format == "emb":
+        if not FaceDB.exists_at(cfg.out_db_emb) and cfg.out_db_npz.exists():
+            print(f"[enroll] migrating {cfg.out_db_npz} -> {cfg.out_db_emb}")
+            migrate_npz(cfg.out_db_npz, cfg.out_db_emb, json_path=cfg.out_db_json)
+        if FaceDB.exists_at(cfg.out_db_emb):
+            return {k: np.array(v, dtype=np.float32) for k, v in FaceDB(cfg.out_db_emb).items()}
+        return {}
     if cfg.out_db_npz.exists():
         data = np.load(cfg.out_db_npz, allow_pickle=True)
         return {k: data[k].astype(np.float32) for k in data.files}
     return {}
 
-def save_db(cfg: EnrollConfig, db: Dict[str, np.ndarray], meta: dict) -> None:
+def save_db(cfg: EnrollConfig, db: Dict[str, np.ndarray], meta: dict, name: Optional[str] = None) -> None:
+    """name: the identity that changed; the emb format appends just that one."""
     ensure_dirs(cfg)
+    if cfg.db_format == "emb":
+        fdb = FaceDB(cfg.out_db_emb)
+        for n in ([name] if name is not None else sorted(db)):
+            fdb.put(n, db[n], meta=meta)
+        return
     np.savez(cfg.out_db_npz, **{k: v.astype(np.float32) for k, v in db.items()})
     cfg.out_db_json.write_text(json.dumps(meta, indent=2), encoding="utf-8")
 
@@ -87,6 +131,47 @@ def mean_embedding(embeddings: List[np.ndarray]) -> np.ndarray:
     m = m / (np.linalg.norm(m) + 1e-12)
     return m.astype(np.float32)
 
+def _normalize_rows(E: np.ndarray) -> np.ndarray:
+    return (E / (np.linalg.norm(E, axis=1, keepdims=True) + 1e-12)).astype(np.float32)
+
+def farthest_point_templates(E: np.ndarray, k: int) -> np.ndarray:
+    """k samples spread over the set: start near the mean, then repeatedly add the sample least similar to all chosen."""
+    m = E.mean(axis=0)
+    chosen = [int(np.argmax(E @ m))]
+    best_sim = E @ E[chosen[0]]
+    while len(chosen) < k:
+        i = int(np.argmin(best_sim))
+        chosen.append(i)
+        best_sim = np.maximum(best_sim, E @ E[i])
+    return E[chosen].copy()
+
+def kmeans_templates(E: np.ndarray, k: int, iters: int = 15) -> np.ndarray:
+    """Spherical k-means centroids (seeded by farthest-point sampling)."""
+    C = farthest_point_templates(E, k)
+    for _ in range(iters):
+        a = np.argmax(E @ C.T, axis=1)
+        sums = np.zeros_like(C)
+        np.add.at(sums, a, E)
+        counts = np.bincount(a, minlength=k)
+        sums[counts == 0] = C[counts == 0]  # keep the old centroid for empty clusters
+        C = _normalize_rows(sums)
+    return C
+
+def select_templates(embeddings: List[np.ndarray], k: int, method: str = "kmeans") -> np.ndarray:
+    """
+    K representative templates, (K, D) L2-normalized. K is capped at the
+    sample count; k <= 1 returns the single mean embedding (D,).
+    """
+    if k <= 1:
+        return mean_embedding(embeddings)
+    E = _normalize_rows(np.stack([e.reshape(-1) for e in embeddings], axis=0).astype(np.float32))
+    k = min(int(k), E.shape[0])
+    if method == "kmeans":
+        return kmeans_templates(E, k)
+    if method == "fps":
+        return farthest_point_templates(E, k)
+    raise ValueError(f"Unknown template_method: {method!r} (kmeans | fps)")
+
 # -------------------------
 # Crops loader
 # -------------------------
@@ -105,25 +190,21 @@ def load_existing_samples_from_crops(
     person_dir: Path,
 ) -> List[np.ndarray]:
     """
-    Reads aligned crops from disk and re-embeds them.
+    Reads aligned crops from disk and re-embeds them (batched, see batch_embed.py).
     """
     if not cfg.save_crops:
         return []
 
     crops = _list_existing_crops(person_dir, cfg.max_existing_crops)
-    base: List[np.ndarray] = []
-
-    for p in crops:
-        img = cv2.imread(str(p))
-        if img is None:
-            continue
-        try:
-            r = emb.embed(img)
-            base.append(r.embedding)
-        except Exception:
-            continue
+    if not crops:
+        return []
 
-    return base
+    cache = EmbeddingCache.for_embedder(emb, cfg.embed_cache_path) if cfg.embed_cache else None
+    be = BatchEmbedder(emb, batch_size=cfg.batch_size, decode_workers=cfg.decode_workers,
+                       processes=cfg.embed_processes, cache=cache)
+    res = be.embed_paths(crops)
+    print(res.stats.format())
+    return list(res.embeddings)
 
 # -------------------------
 # UI helpers
@@ -170,7 +251,9 @@ def main():
 
     # Pipeline
     det = Haar5ptDetector(min_size=(70, 70), smooth_alpha=0.80, debug=False)
-    emb = ArcFaceEmbedderONNX(model_path="models/embedder_arcface.onnx", input_size=(112, 112), debug=False)
+    emb = ArcFaceEmbedderONNX(model_path="models/embedder_arcface.onnx", input_size=(112, 112),
+                              max_batch=cfg.batch_size, session_cfg=cfg.ort, debug=False)
+    registry.warm_up(batch_sizes=(1,))
 
     db = load_db(cfg)
     person_dir = cfg.crops_dir / name
@@ -313,12 +396,13 @@ def main():
                     continue
 
                 all_samples = base_samples + new_samples
-                template = mean_embedding(all_samples)
+                template = select_templates(all_samples, cfg.templates_per_identity, cfg.template_method)
                 db[name] = template
 
                 meta = {
                     "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "embedding_dim": int(template.size),
+                    "embedding_dim": int(template.shape[-1]),
+                    "templates_per_identity": {k: int(v.reshape(-1, v.shape[-1]).shape[0]) for k, v in db.items()},
                     "names": sorted(db.keys()),
                     "samples_existing_used": int(len(base_samples)),
                     "samples_new_used": int(len(new_samples)),
@@ -326,7 +410,7 @@ def main():
                     "note": "Embeddings are L2-normalized vectors. Matching uses cosine similarity.",
                 }
 
-                save_db(cfg, db, meta)
+                save_db(cfg, db, meta, name=name)
                 status_msg = f"Saved '{name}' to DB. Total identities: {len(db)}"
                 print(status_msg)
 
@@ -344,15 +428,16 @@ def main():
         if new_samples and total >= 3:
             print(f"\nFinal Auto-Save: Saving {len(new_samples)} new samples for '{name}' before exit...")
             all_samples = base_samples + new_samples
-            template = mean_embedding(all_samples)
+            template = select_templates(all_samples, cfg.templates_per_identity, cfg.template_method)
             db[name] = template
             meta = {
                 "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "embedding_dim": int(template.size),
+                "embedding_dim": int(template.shape[-1]),
+                "templates_per_identity": {k: int(v.reshape(-1, v.shape[-1]).shape[0]) for k, v in db.items()},
                 "names": sorted(db.keys()),
                 "samples_total_used": int(len(all_samples)),
             }
-            save_db(cfg, db, meta)
+            save_db(cfg, db, meta, name=name)
             print("Successfully saved to database.")
 
         cap.release()
@@ -12,19 +12,27 @@ Assumptions:
 Outputs:
 - Prints summary stats for genuine/impostor cosine distances
 - Suggests a threshold based on a target FAR
+- EER and TAR@FAR; optional ROC/DET points CSV (EvalConfig.curves_out)
+
+All embeddings are stacked into one matrix with label ids; the Gram matrix
+is computed in row blocks and FAR/FRR for every threshold come from a
+single sort + cumulative sums (no per-pair Python loops).
 
 Run: python -m src.evaluate
 """
 
 from __future__ import annotations
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
-import cv2
 import numpy as np
 
-from .embed import ArcFaceEmbedderONNX
+from .embed import ArcFaceEmbedderONNX, OrtSessionConfig
+from .batch_embed import BatchEmbedder
+from .embed_cache import DEFAULT_CACHE_PATH, EmbeddingCache
 
 # -------------------------
 # Config
@@ -39,9 +47,23 @@ class EvalConfig:
     target_far: float = 0.01  # 1% FAR target
     thresholds: Tuple[float, float, float] = (0.10, 1.20, 0.01)  # start, end, step
 
+    # Reported operating points; ROC/DET points CSV (None = don't write)
+    tar_at_far: Tuple[float, ...] = (1e-1, 1e-2, 1e-3, 1e-4)
+    curves_out: Optional[Path] = None
+
     # Optional sanity constraints
     require_size: Tuple[int, int] = (112, 112)
 
+    # batched embedding of the crops (threaded decode, optional process pool)
+    batch_size: int = 32
+    decode_workers: int = 4
+    embed_processes: int = 0
+    embed_cache: bool = True  # reuse embeddings of unchanged crops (data/cache/)
+    embed_cache_path: Path = DEFAULT_CACHE_PATH
+
+    # ONNX Runtime threading / optimization
+    ort: OrtSessionConfig = field(default_factory=OrtSessionConfig.from_env)
+
 # -------------------------
 # Math
 # -------------------------
@@ -71,56 +93,191 @@ def _is_aligned_crop(img: np.ndarray, req: Tuple[int, int]) -> bool:
     h, w = img.shape[:2]
     return (w, h) == (int(req[0]), int(req[1]))
 
+def _person_crops(person_dir: Path, cfg: EvalConfig) -> List[Path]:
+    return sorted(list(person_dir.glob("*.jpg")))[: cfg.max_imgs_per_person]
+
+def _batch_embedder(embedder, cfg: EvalConfig) -> BatchEmbedder:
+    if isinstance(embedder, BatchEmbedder):
+        return embedder
+    cache = EmbeddingCache.for_embedder(embedder, cfg.embed_cache_path) if cfg.embed_cache else None
+    return BatchEmbedder(embedder, batch_size=cfg.batch_size, decode_workers=cfg.decode_workers,
+                         processes=cfg.embed_processes, cache=cache)
+
+def _accept(cfg: EvalConfig):
+    # Skip non-aligned crops (partial: picklable for worker processes)
+    return partial(_is_aligned_crop, req=cfg.require_size) if cfg.require_size is not None else None
+
 def load_embeddings_for_person(
     embedder: ArcFaceEmbedderONNX,
     person_dir: Path,
     cfg: EvalConfig,
 ) -> List[np.ndarray]:
-    imgs = sorted(list(person_dir.glob("*.jpg")))[: cfg.max_imgs_per_person]
-    embs: List[np.ndarray] = []
-
-    for img_path in imgs:
-        img = cv2.imread(str(img_path))
-        if img is None:
-            continue
+    res = _batch_embedder(embedder, cfg).embed_paths(_person_crops(person_dir, cfg), accept=_accept(cfg))
+    return list(res.embeddings)
 
-        # Skip non-aligned crops
-        if cfg.require_size is not None and not _is_aligned_crop(img, cfg.require_size):
-            continue
-
-        res = embedder.embed(img)
-        embs.append(res.embedding)
+def load_all_embeddings(
+    embedder: ArcFaceEmbedderONNX,
+    cfg: EvalConfig,
+    verbose: bool = True,
+) -> Dict[str, List[np.ndarray]]:
+    """
+    name -> embeddings, for every person with >= min_imgs_per_person valid crops.
+    All people's crops go through one batched run, so batches span people.
+    """
+    people = list_people(cfg)
+    crops = [_person_crops(pdir, cfg) for pdir in people]
+    res = _batch_embedder(embedder, cfg).embed_paths([p for c in crops for p in c], accept=_accept(cfg))
+    if verbose:
+        print(res.stats.format())
 
-    return embs
+    per_person: Dict[str, List[np.ndarray]] = {}
+    for pdir, embs in zip(people, res.split([len(c) for c in crops])):
+        name = pdir.name
+        if len(embs) >= cfg.min_imgs_per_person:
+            per_person[name] = embs
+        elif verbose:
+            print(f"Skipping {name}: only {len(embs)} valid aligned crops "
+                  f"(need >= {cfg.min_imgs_per_person}).")
+    return per_person
 
 # -------------------------
 # Eval
 # -------------------------
 
+def stack_embeddings(per_person: Dict[str, List[np.ndarray]]) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """(N, D) float32 matrix, (N,) label ids, names (label id -> name)."""
+    names = sorted(per_person.keys())
+    E = np.stack([e.reshape(-1) for n in names for e in per_person[n]], axis=0).astype(np.float32)
+    labels = np.repeat(np.arange(len(names)), [len(per_person[n]) for n in names])
+    return E, labels, names
+
 def pairwise_distances(embs_a: List[np.ndarray], embs_b: List[np.ndarray], same: bool) -> List[float]:
-    dists: List[float] = []
+    A = np.stack([e.reshape(-1) for e in embs_a]).astype(np.float32)
     if same:
-        for i in range(len(embs_a)):
-            for j in range(i + 1, len(embs_a)):
-                dists.append(cosine_distance(embs_a[i], embs_a[j]))
-    else:
-        for ea in embs_a:
-            for eb in embs_b:
-                dists.append(cosine_distance(ea, eb))
-    return dists
+        iu = np.triu_indices(A.shape[0], k=1)
+        return (1.0 - (A @ A.T)[iu]).tolist()
+    B = np.stack([e.reshape(-1) for e in embs_b]).astype(np.float32)
+    return (1.0 - A @ B.T).reshape(-1).tolist()
+
+def genuine_impostor_blocked(E: np.ndarray, labels: np.ndarray, block: int = 2048) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Every unordered pair i < j once, split by label into genuine / impostor
+    cosine distances. The Gram matrix is built block_rows x (N - row) at a
+    time, so peak extra memory is ~block * N floats on top of the outputs.
+    """
+    N = E.shape[0]
+    counts = np.bincount(labels)
+    n_gen = int((counts * (counts - 1) // 2).sum())
+    n_imp = N * (N - 1) // 2 - n_gen
+    genuine = np.empty(n_gen, dtype=np.float32)
+    impostor = np.empty(n_imp, dtype=np.float32)
+
+    gi = ii = 0
+    for a in range(0, N, block):
+        b = min(N, a + block)
+        S = E[a:b] @ E[a:].T                               # (rows, N - a)
+        upper = np.arange(a, N)[None, :] > np.arange(a, b)[:, None]
+        same = labels[a:b, None] == labels[None, a:]
+        g = 1.0 - S[upper & same]
+        i = 1.0 - S[upper & ~same]
+        genuine[gi:gi + g.size] = g
+        impostor[ii:ii + i.size] = i
+        gi += g.size
+        ii += i.size
+    return genuine, impostor
+
+def genuine_impostor(per_person: Dict[str, List[np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """All same-person and cross-person cosine distances."""
+    if not per_person:
+        return np.zeros(0, np.float32), np.zeros(0, np.float32)
+    E, labels, _ = stack_embeddings(per_person)
+    return genuine_impostor_blocked(E, labels)
+
+def far_frr_at(genuine: np.ndarray, impostor: np.ndarray, thr: float) -> Tuple[float, float]:
+    """FAR / FRR at a single distance threshold (accept if dist <= thr)."""
+    far = float(np.count_nonzero(impostor <= thr) / impostor.size) if impostor.size else 0.0
+    frr = float(np.count_nonzero(genuine > thr) / genuine.size) if genuine.size else 0.0
+    return far, frr
 
-def sweep_thresholds(genuine: np.ndarray, impostor: np.ndarray, cfg: EvalConfig):
+@dataclass
+class ErrorCurves:
+    """FAR / FRR at every distinct distance (accept if dist <= threshold), ascending thresholds."""
+    thresholds: np.ndarray
+    far: np.ndarray
+    frr: np.ndarray
+
+    @property
+    def tar(self) -> np.ndarray:
+        return 1.0 - self.frr
+
+    def at(self, thr) -> Tuple[np.ndarray, np.ndarray]:
+        """FAR, FRR at arbitrary thresholds (step function lookup)."""
+        k = np.searchsorted(self.thresholds, np.asarray(thr, dtype=np.float64), side="right") - 1
+        return self.far[k], self.frr[k]
+
+    def eer(self) -> Tuple[float, float]:
+        """(EER, threshold) where FAR and FRR cross."""
+        k = int(np.argmin(np.abs(self.far - self.frr)))
+        return float((self.far[k] + self.frr[k]) / 2.0), float(self.thresholds[k])
+
+    def tar_at_far(self, target_far: float) -> Tuple[float, float]:
+        """(best TAR, its threshold) with FAR <= target_far."""
+        ok = np.nonzero(self.far <= target_far)[0]
+        k = int(ok[-1])  # FAR is non-decreasing in the threshold, TAR too
+        return float(self.tar[k]), float(self.thresholds[k])
+
+    def roc_points(self, n: int = 200) -> np.ndarray:
+        """(n, 3) rows of (threshold, FAR, TAR), subsampled for plotting / CSV."""
+        idx = np.unique(np.linspace(0, self.thresholds.size - 1, n).astype(np.int64))
+        return np.stack([self.thresholds[idx], self.far[idx], self.tar[idx]], axis=1)
+
+    def det_points(self, n: int = 200) -> np.ndarray:
+        """(n, 3) rows of (threshold, FAR, FRR)."""
+        idx = np.unique(np.linspace(0, self.thresholds.size - 1, n).astype(np.int64))
+        return np.stack([self.thresholds[idx], self.far[idx], self.frr[idx]], axis=1)
+
+def _ordered_bits(x: np.ndarray) -> np.ndarray:
+    """float32 -> uint32 whose unsigned order matches the float order."""
+    u = np.ascontiguousarray(x, dtype=np.float32).view(np.uint32)
+    return np.where(u & 0x80000000, ~u, u | 0x80000000).astype(np.uint32)
+
+def _from_ordered_bits(k: np.ndarray) -> np.ndarray:
+    return np.where(k & 0x80000000, k & 0x7FFFFFFF, ~k).astype(np.uint32).view(np.float32)
+
+def error_curves(genuine: np.ndarray, impostor: np.ndarray) -> ErrorCurves:
+    """
+    One sort of all distances + cumulative sums of accepted genuine / impostor pairs.
+    The impostor flag rides in the low bit of a uint64 sort key, which sorts
+    several times faster than an argsort over tens of millions of pairs.
+    """
+    key = np.concatenate([_ordered_bits(genuine), _ordered_bits(impostor)]).astype(np.uint64) << np.uint64(1)
+    key[genuine.size:] |= np.uint64(1)
+    key.sort()
+
+    imp_acc = np.cumsum(key & np.uint64(1))
+    gen_acc = np.arange(1, key.size + 1) - imp_acc
+    bits = (key >> np.uint64(1)).astype(np.uint32)
+
+    last = np.ones(key.size, dtype=bool)  # last index of each run of equal distances
+    last[:-1] = bits[1:] != bits[:-1]
+
+    n_gen = max(1, genuine.size)
+    n_imp = max(1, impostor.size)
+    thresholds = np.concatenate([[-np.inf], _from_ordered_bits(bits[last]).astype(np.float64)])
+    far = np.concatenate([[0.0], imp_acc[last] / n_imp])
+    frr = np.concatenate([[1.0], 1.0 - gen_acc[last] / n_gen])
+    return ErrorCurves(thresholds, far, frr)
+
+def sweep_thresholds(genuine: np.ndarray, impostor: np.ndarray, cfg: EvalConfig,
+                     curves: Optional[ErrorCurves] = None):
     t0, t1, step = cfg.thresholds
     thresholds = np.arange(t0, t1 + 1e-9, step, dtype=np.float32)
 
     # FAR: impostor accepted => dist <= thr
     # FRR: genuine rejected => dist > thr
-    results = []
-    for thr in thresholds:
-        far = float(np.mean(impostor <= thr)) if impostor.size else 0.0
-        frr = float(np.mean(genuine > thr)) if genuine.size else 0.0
-        results.append((float(thr), far, frr))
-    return results
+    curves = curves or error_curves(genuine, impostor)
+    far, frr = curves.at(thresholds)
+    return [(float(t), float(a), float(r)) for t, a, r in zip(thresholds, far, frr)]
 
 def describe(arr: np.ndarray) -> str:
     if arr.size == 0:
@@ -140,6 +297,8 @@ def main():
     embedder = ArcFaceEmbedderONNX(
         model_path="models/embedder_arcface.onnx",
         input_size=(112, 112),
+        max_batch=cfg.batch_size,
+        session_cfg=cfg.ort,
         debug=False,
     )
 
@@ -149,40 +308,21 @@ def main():
         return
 
     # Load embeddings per person
-    per_person: Dict[str, List[np.ndarray]] = {}
-    for pdir in people_dirs:
-        name = pdir.name
-        embs = load_embeddings_for_person(embedder, pdir, cfg)
-        if len(embs) >= cfg.min_imgs_per_person:
-            per_person[name] = embs
-        else:
-            print(f"Skipping {name}: only {len(embs)} valid aligned crops "
-                  f"(need >= {cfg.min_imgs_per_person}).")
-
-    names = sorted(per_person.keys())
-    if len(names) < 1:
+    per_person = load_all_embeddings(embedder, cfg)
+    if len(per_person) < 1:
         print("Not enough data to evaluate. Enroll more samples.")
         return
 
-    # Genuine
-    genuine_all: List[float] = []
-    for name in names:
-        genuine_all.extend(pairwise_distances(per_person[name], per_person[name], same=True))
-
-    # Impostor
-    impostor_all: List[float] = []
-    for i in range(len(names)):
-        for j in range(i + 1, len(names)):
-            impostor_all.extend(pairwise_distances(per_person[names[i]], per_person[names[j]], same=False))
-
-    genuine = np.array(genuine_all, dtype=np.float32)
-    impostor = np.array(impostor_all, dtype=np.float32)
+    t_eval = time.perf_counter()
+    genuine, impostor = genuine_impostor(per_person)
+    curves = error_curves(genuine, impostor)
+    t_eval = time.perf_counter() - t_eval
 
     print("\n=== Distance Distributions (cosine distance = 1 - cosine similarity) ===")
     print(f"Genuine (same person):   {describe(genuine)}")
     print(f"Impostor (diff persons): {describe(impostor)}")
 
-    results = sweep_thresholds(genuine, impostor, cfg)
+    results = sweep_thresholds(genuine, impostor, cfg, curves)
 
     # Choose threshold with FAR <= target_far and minimal FRR
     best = None
@@ -206,6 +346,22 @@ def main():
         print(f"\nNo threshold in range met FAR <= {cfg.target_far*100:.1f}%. "
               "Try widening threshold sweep range or collecting more varied samples.")
 
+    if genuine.size and impostor.size:
+        eer, eer_thr = curves.eer()
+        print(f"\n=== Operating Points ({genuine.size + impostor.size} pairs in {t_eval:.2f}s) ===")
+        print(f"EER={eer*100:.2f}% at thr={eer_thr:.3f}")
+        for far_target in cfg.tar_at_far:
+            tar, thr = curves.tar_at_far(far_target)
+            print(f"TAR@FAR={far_target:g}: {tar*100:6.2f}%  (thr={thr:.3f})")
+
+        if cfg.curves_out is not None:
+            cfg.curves_out.parent.mkdir(parents=True, exist_ok=True)
+            roc = curves.roc_points()
+            det = curves.det_points()
+            np.savetxt(cfg.curves_out, np.column_stack([roc, det[:, 2]]), delimiter=",",
+                       header="threshold,far,tar,frr", comments="", fmt="%.6f")
+            print(f"ROC/DET points written to {cfg.curves_out}")
+
     print()
 
 
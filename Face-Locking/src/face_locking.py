@@ -15,7 +15,8 @@ from __future__ import annotations
 import time
 import json
 import math
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
@@ -23,10 +24,18 @@ from datetime import datetime
 import cv2
 import numpy as np
 
-from .haar_5pt import align_face_5pt
+from .haar_5pt import AdaptiveHaarConfig, FaceAligner
+from . import registry
+from .embed import OrtSessionConfig
+from .detectors import create_detector
+from .facedb import resolve_db_path
+from .index import DEFAULT_N_PROBE, index_path_for
+from .pipeline import FramePacket, FramePipeline, frame_stage
+from .profiling import PROFILER, start_exporter_from_env
+from .track import FaceTracker
 from .recognize import (
-    HaarFaceMesh5pt, ArcFaceEmbedderONNX, FaceDBMatcher, 
-    load_db_npz, FaceDet, MatchResult, cosine_distance
+    ArcFaceEmbedderONNX, FaceDBMatcher, 
+    DBWatcher, load_db, FaceDet, MatchResult, cosine_distance
 )
 
 # -------------------------
@@ -40,6 +49,20 @@ class FaceLockConfig:
     lock_timeout_seconds: float = 3.0        # release lock after this time without detection
     tracking_tolerance: float = 0.45         # lower threshold while tracking
     
+    # Detection: full Haar + FaceMesh every N frames, optical-flow tracking in between
+    detect_every_n: int = 5
+    landmark_mode: str = "frame"             # FaceMesh: frame | track | roi (see recognize.LANDMARK_MODES)
+    haar_budget_ms: float = 0.0              # > 0: adaptive Haar (downscaled, ROI-first) within this budget
+    detector: str = "haar"                   # haar | yunet (src/detectors.py)
+    detector_model: Optional[str] = None     # YuNet ONNX, default models/face_detection_yunet_2023mar.onnx
+    
+    # Per-track embedding reuse: re-embed a tracked face only when it is new,
+    # after reembed_interval_s, or when it moved/deformed past these limits
+    reembed_interval_s: float = 1.0
+    reembed_box_shift: float = 0.15          # box center shift, fraction of box width
+    reembed_kps_shift: float = 0.10          # mean keypoint shift (after removing translation), fraction of eye distance
+    embedding_smoothing: float = 0.6         # EMA weight of the previous embedding (0 = no smoothing)
+    
     # Action detection parameters
     movement_threshold: float = 30.0         # pixels for left/right movement
     blink_threshold: float = 0.25           # eye aspect ratio threshold
@@ -48,6 +71,16 @@ class FaceLockConfig:
     # History recording
     history_dir: Path = Path("data/history")
     
+    # Face DB: polled in the background, new enrollments are swapped in live (0 = off)
+    db_path: Path = Path("data/db/face_db.npz")
+    db_watch_interval_s: float = 1.0
+    index: str = "exact"                     # exact | ivf | hnsw (src/index.py); ANN indexes saved next to the DB
+    n_probe: int = DEFAULT_N_PROBE           # ivf: lists scanned per query
+    ef: int = 64                             # hnsw: search breadth
+    
+    # ONNX Runtime threading / optimization
+    ort: OrtSessionConfig = field(default_factory=OrtSessionConfig.from_env)
+    
     # UI
     window_name: str = "Face Locking System"
 
@@ -55,6 +88,16 @@ class FaceLockConfig:
 # Action Detection Classes
 # -------------------------
 
+@dataclass
+class TrackEmbedding:
+    """Cached identity of one tracked face"""
+    embedding: np.ndarray        # smoothed, L2-normalized
+    match: MatchResult
+    kps: np.ndarray              # keypoints when last embedded
+    center: Tuple[float, float]  # box center when last embedded
+    width: float
+    embedded_at: float
+
 @dataclass
 class FaceAction:
     timestamp: float
@@ -190,26 +233,52 @@ class ActionDetector:
 class FaceLockingSystem:
     """Main face locking system"""
     
-    def __init__(self, config: FaceLockConfig, target_identity: str):
+    def __init__(self, config: FaceLockConfig, target_identity: str, db: Optional[Dict[str, np.ndarray]] = None):
         self.config = config
         self.target_identity = target_identity
         
         # Initialize components
-        self.detector = HaarFaceMesh5pt(min_size=(70, 70), debug=False)
+        self.detector = FaceTracker(
+            create_detector(config.detector, min_size=(70, 70), landmark_mode=config.landmark_mode,
+                            adaptive=AdaptiveHaarConfig(budget_ms=config.haar_budget_ms)
+                            if config.haar_budget_ms > 0 else None,
+                            model_path=config.detector_model),
+            detect_every=config.detect_every_n
+        )
         self.embedder = ArcFaceEmbedderONNX(
             model_path="models/embedder_arcface.onnx", 
-            input_size=(112, 112)
+            input_size=(112, 112),
+            session_cfg=config.ort
         )
+        self.aligner = FaceAligner(out_size=(112, 112))  # reused crop buffer for embed_batch
+        # models come from the per-process registry; run them once before the first frame
+        registry.warm_up(batch_sizes=(1, self.embedder.max_batch))
         
-        # Load face database
-        db = load_db_npz(Path("data/db/face_db.npz"))
-        self.matcher = FaceDBMatcher(db=db, dist_thresh=0.34)
+        # Face database (already loaded by main, else loaded here; hot-reloaded off-thread by the watcher)
+        db_path = resolve_db_path(config.db_path)
+        if db is None:
+            db = load_db(db_path)
+        self.matcher = FaceDBMatcher(
+            db=db, dist_thresh=0.34, index=config.index,
+            index_path=index_path_for(db_path, config.index) if config.index != "exact" else None,
+            n_probe=config.n_probe, ef=config.ef,
+        )
+        self._db_version = self.matcher.version
+        self.db_watcher: Optional[DBWatcher] = None
+        if config.db_watch_interval_s > 0:
+            self.db_watcher = DBWatcher(self.matcher, config.db_path, config.db_watch_interval_s).start()
         
         # Action detection
         self.action_detector = ActionDetector(config)
         
-        # Locking state
+        # Per-track embedding cache (track_id -> TrackEmbedding)
+        self.track_cache: Dict[int, TrackEmbedding] = {}
+        self.embed_count = 0
+        self.reuse_count = 0
+        
+        # Locking state (owned by the thread running process_frame; other threads use request_release)
         self.is_locked = False
+        self._release_requested = threading.Event()
         self.locked_face: Optional[FaceDet] = None
         self.last_detection_time: Optional[float] = None
         self.lock_start_time: Optional[float] = None
@@ -228,6 +297,13 @@ class FaceLockingSystem:
         """Process a single frame and return annotated frame"""
         vis_frame = frame.copy()
         
+        # Manual release from the UI thread, applied between frames
+        if self._release_requested.is_set():
+            self._release_requested.clear()
+            if self.is_locked:
+                self._release_lock()
+                print("🔓 Manually released lock")
+        
         # Detect all faces
         faces = self.detector.detect(frame, max_faces=5)
         
@@ -243,14 +319,81 @@ class FaceLockingSystem:
         
         return vis_frame
     
+    def _needs_embedding(self, face: FaceDet, cached: Optional[TrackEmbedding], now: float) -> bool:
+        """Decide whether a tracked face must be re-embedded this frame"""
+        if face.track_id < 0 or cached is None:
+            return True
+        if now - cached.embedded_at >= self.config.reembed_interval_s:
+            return True
+        
+        cx, cy = (face.x1 + face.x2) / 2, (face.y1 + face.y2) / 2
+        if math.hypot(cx - cached.center[0], cy - cached.center[1]) > self.config.reembed_box_shift * max(cached.width, 1.0):
+            return True
+        
+        # keypoint deformation (pose / expression change), translation removed
+        d = (face.kps - face.kps.mean(axis=0)) - (cached.kps - cached.kps.mean(axis=0))
+        eye_dist = float(np.linalg.norm(cached.kps[1] - cached.kps[0]))
+        return float(np.linalg.norm(d, axis=1).mean()) > self.config.reembed_kps_shift * max(eye_dist, 1.0)
+    
+    def _match_faces(self, faces: List[FaceDet], frame: np.ndarray) -> List[MatchResult]:
+        """
+        Identity of every face. Stable tracks reuse their cached (smoothed)
+        embedding; the rest are aligned and embedded in a single ONNX call.
+        """
+        now = time.time()
+        
+        # DB was swapped: cached embeddings are still valid, their identities may not be
+        if self.matcher.version != self._db_version:
+            self._db_version = self.matcher.version
+            for cached in self.track_cache.values():
+                cached.match = self.matcher.match(cached.embedding)
+        
+        todo = [i for i, face in enumerate(faces)
+                if self._needs_embedding(face, self.track_cache.get(face.track_id), now)]
+        
+        results: List[Optional[MatchResult]] = [None] * len(faces)
+        if todo:
+            aligned, _ = self.aligner.align(frame, [faces[i].kps for i in todo])
+            embeddings = self.embedder.embed_batch(aligned)
+            self.embed_count += len(todo)
+            
+            alpha = self.config.embedding_smoothing
+            for i, emb in zip(todo, embeddings):
+                face = faces[i]
+                cached = self.track_cache.get(face.track_id)
+                if cached is not None and alpha > 0:
+                    emb = alpha * cached.embedding + (1.0 - alpha) * emb
+                    emb = (emb / (np.linalg.norm(emb) + 1e-12)).astype(np.float32)
+                match_result = self.matcher.match(emb)
+                results[i] = match_result
+                
+                if face.track_id >= 0:
+                    self.track_cache[face.track_id] = TrackEmbedding(
+                        embedding=emb,
+                        match=match_result,
+                        kps=face.kps.copy(),
+                        center=((face.x1 + face.x2) / 2, (face.y1 + face.y2) / 2),
+                        width=float(face.x2 - face.x1),
+                        embedded_at=now,
+                    )
+        
+        for i, face in enumerate(faces):
+            if results[i] is None:
+                results[i] = self.track_cache[face.track_id].match
+                self.reuse_count += 1
+        
+        # forget tracks that are gone
+        live = {face.track_id for face in faces}
+        for tid in list(self.track_cache):
+            if tid not in live:
+                del self.track_cache[tid]
+        
+        return results
+    
     def _try_lock_target(self, faces: List[FaceDet], frame: np.ndarray):
         """Try to lock onto target identity"""
-        for face in faces:
-            # Get face embedding
-            aligned, _ = align_face_5pt(frame, face.kps, out_size=(112, 112))
-            embedding = self.embedder.embed(aligned)
-            match_result = self.matcher.match(embedding)
-            
+        match_results = self._match_faces(faces, frame)
+        for face, match_result in zip(faces, match_results):
             # Check if this is our target with high confidence
             if (match_result.name == self.target_identity and 
                 match_result.similarity >= self.config.lock_confidence_threshold):
@@ -276,11 +419,8 @@ class FaceLockingSystem:
         best_match: Optional[Tuple[FaceDet, float]] = None
         
         # Find best matching face for our locked target
-        for face in faces:
-            aligned, _ = align_face_5pt(frame, face.kps, out_size=(112, 112))
-            embedding = self.embedder.embed(aligned)
-            match_result = self.matcher.match(embedding)
-            
+        match_results = self._match_faces(faces, frame)
+        for face, match_result in zip(faces, match_results):
             # Use lower threshold while tracking
             if (match_result.name == self.target_identity and 
                 match_result.similarity >= self.config.tracking_tolerance):
@@ -307,8 +447,12 @@ class FaceLockingSystem:
                 
                 self._release_lock()
     
+    def request_release(self):
+        """Release the lock at the start of the next processed frame (safe from any thread)"""
+        self._release_requested.set()
+    
     def _release_lock(self):
-        """Release the face lock"""
+        """Release the face lock (processing thread only)"""
         if self.is_locked:
             lock_duration = time.time() - self.lock_start_time if self.lock_start_time else 0
             print(f"🔓 RELEASED lock on {self.target_identity} (duration: {lock_duration:.1f}s)")
@@ -440,13 +584,13 @@ def main():
     """Main face locking application"""
     
     # Load available identities
-    db_path = Path("data/db/face_db.npz")
+    db_path = resolve_db_path(Path("data/db/face_db.npz"))
     if not db_path.exists():
         print("❌ No face database found! Please run enrollment first.")
         print("Run: python -m src.enroll")
         return
     
-    db = load_db_npz(db_path)
+    db = load_db(db_path)
     available_identities = list(db.keys())
     
     if not available_identities:
@@ -486,7 +630,7 @@ def main():
     
     # Initialize system
     config = FaceLockConfig()
-    face_locker = FaceLockingSystem(config, target_identity)
+    face_locker = FaceLockingSystem(config, target_identity, db=db)
     
     # Start camera
     cap = cv2.VideoCapture(0)
@@ -498,45 +642,50 @@ def main():
     print("Position the target person in front of the camera...")
     print("The system will automatically lock when it recognizes them with high confidence.")
     
+    # Capture runs on its own thread (newest frame only); process_frame runs on a worker
+    pipe = FramePipeline(cap, [("process", frame_stage(face_locker.process_frame))])
+    exporter = start_exporter_from_env()
+    
+    def render(pkt: FramePacket) -> bool:
+        # Display
+        cv2.imshow(config.window_name, pkt.output)
+        
+        # Handle key presses
+        key = cv2.waitKey(1) & 0xFF
+        if key == ord('q'):
+            return False
+        elif key == ord('r'):
+            face_locker.request_release()
+        elif key == ord('t'):
+            print("\n🔄 Change target (restart required)")
+            return False
+        elif key == ord('s'):
+            print(f"\n📊 Stats:")
+            print(f"  Target: {target_identity}")
+            print(f"  Locked: {face_locker.is_locked}")
+            print(f"  Actions recorded: {len(face_locker.action_history)}")
+            print(f"  Embeddings computed/reused: {face_locker.embed_count}/{face_locker.reuse_count}")
+            if face_locker.history_file:
+                print(f"  History file: {face_locker.history_file.name}")
+            print(pipe.format_stats())
+            print(PROFILER.format())
+        return True
+    
     try:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("❌ Failed to read from camera!")
-                break
-            
-            # Process frame
-            processed_frame = face_locker.process_frame(frame)
-            
-            # Display
-            cv2.imshow(config.window_name, processed_frame)
-            
-            # Handle key presses
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
-            elif key == ord('r'):
-                if face_locker.is_locked:
-                    face_locker._release_lock()
-                    print("🔓 Manually released lock")
-            elif key == ord('t'):
-                print("\n🔄 Change target (restart required)")
-                break
-            elif key == ord('s'):
-                print(f"\n📊 Stats:")
-                print(f"  Target: {target_identity}")
-                print(f"  Locked: {face_locker.is_locked}")
-                print(f"  Actions recorded: {len(face_locker.action_history)}")
-                if face_locker.history_file:
-                    print(f"  History file: {face_locker.history_file.name}")
+        pipe.run(render)
     
     except KeyboardInterrupt:
         print("\n⏹️ Interrupted by user")
     
     finally:
-        # Cleanup
+        # Cleanup (pipe.run stopped the worker; make sure it has exited before touching lock state)
+        pipe.stop()
         if face_locker.is_locked:
             face_locker._release_lock()
+        if face_locker.db_watcher is not None:
+            face_locker.db_watcher.stop()
+        if exporter is not None:
+            exporter.stop()
         
         cap.release()
         cv2.destroyAllWindows()
@@ -0,0 +1,384 @@
+# src/facedb.py
+"""
+Memory-mapped, append-only face database.
+
+On disk (next to each other in data/db/):
+- face_db.emb          raw embedding rows, (T, D) float32 or float16, C order
+                       (face_db.emb.g<N> after the N-th rewrite / compact)
+- face_db.emb.idx.npy  name / offset / count / generation per identity
+                       (structured array, no pickle)
+- face_db.emb.json     sidecar: format version, dtype, dim, enrollment metadata
+
+Why:
+- enrolling an identity appends its rows and rewrites only the tiny index,
+  instead of re-saving every embedding like np.savez does
+- loading is np.memmap(mode="r"): zero-copy, and every recognizer process on
+  the host shares the same page-cache pages instead of a private copy
+
+Re-enrolling a name appends new rows and repoints the index; the old rows
+become dead space until `compact` rewrites the file. The index is replaced
+atomically (os.replace) AFTER the rows are flushed, so a reader never sees
+an entry whose rows are not on disk yet. A rewrite (compact, migrate) never
+touches the file readers map: its rows go to a new generation file, and the
+index that names that generation is published last; older generations are
+deleted afterwards. A reader holding an old index either maps the old rows
+or fails to open them, never the new rows under old offsets. One writer at a
+time; run `compact` while no enrollment is running.
+
+Run:
+    python -m src.facedb migrate                      # data/db/face_db.npz -> data/db/face_db.emb
+    python -m src.facedb migrate --dtype float16
+    python -m src.facedb info
+    python -m src.facedb compact
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+FORMAT_NAME = "facedb-emb"
+FORMAT_VERSION = 2  # 2: index carries the data file generation
+NAME_MAX = 64
+
+_INDEX_DTYPE = np.dtype([("name", f"U{NAME_MAX}"), ("offset", "<i8"), ("count", "<i4"), ("gen", "<i4")])
+
+# -------------------------
+# Helpers
+# -------------------------
+
+def _replace_atomic(path: Path, write_fn) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def resolve_db_path(db_path: Path) -> Path:
+    """
+    data/db/face_db.npz -> data/db/face_db.emb if that exists (migrated DB),
+    else the path unchanged.
+    """
+    db_path = Path(db_path)
+    emb = db_path.with_suffix(".emb")
+    if db_path.suffix != ".emb" and FaceDB.exists_at(emb):
+        return emb
+    return db_path
+
+# -------------------------
+# FaceDB
+# -------------------------
+
+class FaceDB:
+    """
+    Read side behaves like a read-only Dict[str, np.ndarray] (keys / items /
+    db[name]); values are views into the memmap, (D,) for one template and
+    (K, D) for several. Write side: put() / remove() / rewrite() / compact().
+    """
+    def __init__(self, path: Path, dtype: str = "float32", dim: Optional[int] = None):
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".idx.npy")
+        self.meta_path = self.path.with_name(self.path.name + ".json")
+
+        self.dtype = np.dtype(dtype)
+        self.dim = dim
+        self.meta: dict = {}
+        self.generation = 0  # data file in use: path (0) or path.g<N>
+        self._entries: Dict[str, Tuple[int, int]] = {}
+        self._mm: Optional[np.memmap] = None
+
+        if self.meta_path.exists():
+            header = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            if header.get("format") != FORMAT_NAME:
+                raise RuntimeError(f"{self.meta_path} is not a {FORMAT_NAME} sidecar")
+            if int(header.get("version", 0)) > FORMAT_VERSION:
+                raise RuntimeError(f"{self.meta_path}: format version {header['version']} is newer than supported")
+            self.dtype = np.dtype(header["dtype"])
+            self.dim = int(header["dim"])
+            self.meta = header.get("meta", {})
+        self.refresh()
+
+    @staticmethod
+    def exists_at(path: Path) -> bool:
+        path = Path(path)
+        # the index is published last; the data file it names may be path or path.g<N>
+        return path.with_name(path.name + ".idx.npy").exists()
+
+    def data_path(self, generation: Optional[int] = None) -> Path:
+        g = self.generation if generation is None else int(generation)
+        return self.path if g == 0 else self.path.with_name(f"{self.path.name}.g{g}")
+
+    # ---- read side ----
+
+    def refresh(self) -> None:
+        """Re-read the index and re-map the rows (cheap; call after another process wrote)."""
+        entries: Dict[str, Tuple[int, int]] = {}
+        gen = 0
+        if self.index_path.exists():
+            idx = np.load(self.index_path, allow_pickle=False)
+            if "gen" in idx.dtype.names and len(idx):
+                gen = int(idx["gen"][0])
+            for name, off, cnt in zip(idx["name"], idx["offset"], idx["count"]):
+                entries[str(name)] = (int(off), int(cnt))
+
+        data = self.data_path(gen)
+        mm = None
+        rows = 0
+        if entries and not data.exists():
+            # a rewrite published a newer index and removed this generation between our reads
+            raise RuntimeError(f"{self.index_path}: data file {data.name} is missing (DB rewritten, retry)")
+        if self.dim and data.exists():
+            rows = data.stat().st_size // (self.dim * self.dtype.itemsize)  # ignores a torn tail row
+            if rows > 0:
+                mm = np.memmap(data, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+
+        for name, (off, cnt) in entries.items():
+            if off + cnt > rows:
+                raise RuntimeError(f"{self.index_path}: entry {name!r} points past the end of {data}")
+        self.generation = gen
+        self._mm = mm
+        self._entries = entries
+
+    @property
+    def num_rows(self) -> int:
+        return 0 if self._mm is None else int(self._mm.shape[0])
+
+    @property
+    def live_rows(self) -> int:
+        return sum(c for _, c in self._entries.values())
+
+    def matrix(self) -> Optional[np.memmap]:
+        """All rows on disk, including dead ones, (T, D) read-only memmap."""
+        return self._mm
+
+    def keys(self) -> List[str]:
+        return sorted(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        off, cnt = self._entries[name]
+        rows = self._mm[off:off + cnt]
+        return rows[0] if cnt == 1 else rows
+
+    def items(self) -> Iterator[Tuple[str, np.ndarray]]:
+        for name in self.keys():
+            yield name, self[name]
+
+    def packed(self) -> Tuple[List[str], Optional[np.ndarray], np.ndarray]:
+        """
+        (names, mat, counts): identities in file order with their rows stacked
+        contiguously. After compact() (or when nothing was re-enrolled) mat
+        is the memmap itself, no copy; otherwise live rows are gathered.
+        """
+        order = sorted(self._entries.items(), key=lambda kv: kv[1][0])
+        names = [n for n, _ in order]
+        counts = np.array([c for _, (_, c) in order], dtype=np.int64)
+        if not names:
+            return [], None, counts
+
+        end = 0
+        for _, (off, cnt) in order:
+            if off != end:
+                break
+            end += cnt
+        else:
+            return names, self._mm[:end], counts
+
+        mat = np.concatenate([self._mm[off:off + cnt] for _, (off, cnt) in order], axis=0)
+        return names, mat, counts
+
+    # ---- write side ----
+
+    def _write_index(self, entries: Dict[str, Tuple[int, int]], generation: Optional[int] = None) -> None:
+        gen = self.generation if generation is None else int(generation)
+        idx = np.empty(len(entries), dtype=_INDEX_DTYPE)
+        for i, (name, (off, cnt)) in enumerate(sorted(entries.items(), key=lambda kv: kv[1][0])):
+            idx[i] = (name, off, cnt, gen)
+        _replace_atomic(self.index_path, lambda f: np.save(f, idx, allow_pickle=False))
+
+    def _write_meta(self) -> None:
+        header = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "dtype": self.dtype.name,
+            "dim": int(self.dim),
+            "meta": self.meta,
+        }
+        _replace_atomic(self.meta_path, lambda f: f.write(json.dumps(header, indent=2).encode("utf-8")))
+
+    def put(self, name: str, embeddings: np.ndarray, meta: Optional[dict] = None) -> None:
+        """Append (D,) or (K, D) embeddings for name (replacing any previous entry)."""
+        if len(name) > NAME_MAX:
+            raise ValueError(f"Name longer than {NAME_MAX} characters: {name!r}")
+        E = np.asarray(embeddings, dtype=np.float32)
+        E = E.reshape(-1, E.shape[-1])
+        if self.dim is None:
+            self.dim = int(E.shape[1])
+        if E.shape[1] != self.dim:
+            raise ValueError(f"Embedding dim {E.shape[1]} != DB dim {self.dim}")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if meta is not None:
+            self.meta = meta
+        if not self.meta_path.exists() or meta is not None:
+            self._write_meta()
+
+        with open(self.data_path(), "ab") as f:
+            # a torn row from an interrupted append would shift every later row
+            size = f.tell()
+            row_bytes = self.dim * self.dtype.itemsize
+            if size % row_bytes:
+                f.truncate(size - size % row_bytes)
+                f.seek(0, os.SEEK_END)
+            offset = f.tell() // row_bytes
+            f.write(np.ascontiguousarray(E.astype(self.dtype)).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        entries = dict(self._entries)
+        entries[name] = (int(offset), int(E.shape[0]))
+        self._write_index(entries)
+        self.refresh()
+
+    def remove(self, name: str) -> None:
+        entries = dict(self._entries)
+        entries.pop(name)
+        self._write_index(entries)
+        self.refresh()
+
+    def rewrite(self, db: Dict[str, np.ndarray]) -> None:
+        """Replace the whole DB with db (name -> (D,) / (K, D)), rows sorted by name."""
+        names = sorted(db)
+        blocks = [np.asarray(db[n], dtype=np.float32) for n in names]
+        blocks = [b.reshape(-1, b.shape[-1]) for b in blocks]
+        if blocks and self.dim is None:
+            self.dim = int(blocks[0].shape[1])
+        entries: Dict[str, Tuple[int, int]] = {}
+        off = 0
+        for n, b in zip(names, blocks):
+            if len(n) > NAME_MAX:
+                raise ValueError(f"Name longer than {NAME_MAX} characters: {n!r}")
+            if b.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {b.shape[1]} for {n!r} != DB dim {self.dim}")
+            entries[n] = (off, b.shape[0])
+            off += b.shape[0]
+
+        data = np.concatenate(blocks, axis=0).astype(self.dtype) if blocks else np.empty((0,), self.dtype)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # new rows under a new generation; readers keep the old file until the index names this one
+        old = self.generation
+        gen = old + 1
+        _replace_atomic(self.data_path(gen), lambda f: f.write(np.ascontiguousarray(data).tobytes()))
+        self._write_meta()
+        self._write_index(entries, generation=gen)
+        self._mm = None
+        self.refresh()
+        if self.generation != gen:  # empty DB: the index carries no generation, appends restart at path
+            self.data_path(gen).unlink(missing_ok=True)
+        self._remove_generations(keep=self.generation)
+
+    def _remove_generations(self, keep: int) -> None:
+        """Delete data files of other generations (readers that still map one keep their pages on POSIX)."""
+        for p in [self.path] + list(self.path.parent.glob(f"{self.path.name}.g*")):
+            g = 0 if p == self.path else p.name[len(self.path.name) + 2:]
+            if str(g).isdigit() and int(g) != keep:
+                try:
+                    p.unlink()
+                except OSError:
+                    pass  # e.g. still mapped on Windows; the next rewrite retries
+
+    def compact(self) -> int:
+        """Rewrite live rows only, sorted by name. Returns the number of dead rows dropped."""
+        dead = self.num_rows - self.live_rows
+        self.rewrite({n: np.asarray(self[n]) for n in self.keys()})
+        return int(dead)
+
+# -------------------------
+# Migration
+# -------------------------
+
+def migrate_npz(
+    npz_path: Path,
+    out_path: Path,
+    json_path: Optional[Path] = None,
+    dtype: str = "float32",
+    overwrite: bool = False,
+) -> FaceDB:
+    """face_db.npz (+ face_db.json metadata) -> face_db.emb in one pass, names sorted."""
+    if FaceDB.exists_at(out_path) and not overwrite:
+        raise FileExistsError(f"{out_path} already exists (use --overwrite)")
+    for p in (out_path, out_path.with_name(out_path.name + ".idx.npy"), out_path.with_name(out_path.name + ".json"),
+              *out_path.parent.glob(f"{out_path.name}.g*")):
+        if p.exists():
+            p.unlink()
+
+    data = np.load(str(npz_path), allow_pickle=False)
+    meta = {}
+    if json_path is not None and json_path.exists():
+        meta = json.loads(json_path.read_text(encoding="utf-8"))
+    meta["migrated_from"] = str(npz_path)
+    meta["migrated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    db = FaceDB(out_path, dtype=dtype)
+    db.meta = meta
+    db.rewrite({name: data[name] for name in data.files})
+    return db
+
+# -------------------------
+# Main
+# -------------------------
+
+def main():
+    ap = argparse.ArgumentParser(description="Memory-mapped face DB tools.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    m = sub.add_parser("migrate", help="convert face_db.npz/json into the .emb format")
+    m.add_argument("--npz", type=Path, default=Path("data/db/face_db.npz"))
+    m.add_argument("--json", type=Path, default=Path("data/db/face_db.json"))
+    m.add_argument("--out", type=Path, default=Path("data/db/face_db.emb"))
+    m.add_argument("--dtype", choices=("float32", "float16"), default="float32")
+    m.add_argument("--overwrite", action="store_true")
+
+    for cmd in ("info", "compact"):
+        s = sub.add_parser(cmd)
+        s.add_argument("--db", type=Path, default=Path("data/db/face_db.emb"))
+
+    args = ap.parse_args()
+
+    if args.cmd == "migrate":
+        if not args.npz.exists():
+            raise FileNotFoundError(f"DB not found: {args.npz}")
+        db = migrate_npz(args.npz, args.out, json_path=args.json, dtype=args.dtype, overwrite=args.overwrite)
+        print(f"[facedb] ✅ {args.npz} -> {args.out}: {len(db)} identities, {db.num_rows} rows, {db.dtype.name}")
+        return
+
+    if not FaceDB.exists_at(args.db):
+        raise FileNotFoundError(f"DB not found: {args.db}")
+    db = FaceDB(args.db)
+
+    if args.cmd == "info":
+        print(f"{args.db}: {len(db)} identities, dim={db.dim}, dtype={db.dtype.name}")
+        print(f"rows: {db.num_rows} on disk, {db.live_rows} live")
+        for name in db.keys():
+            print(f"  {name:<24} {db[name].reshape(-1, db.dim).shape[0]} template(s)")
+    elif args.cmd == "compact":
+        dropped = db.compact()
+        print(f"[facedb] compacted {args.db}: dropped {dropped} dead rows, {db.num_rows} rows left")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,12 +14,17 @@ Run:
 """
 
 from __future__ import annotations
+import time
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional, Tuple, List
 
 import cv2
 import numpy as np
 
+from . import registry
+from .profiling import PROFILER, profiled
+
 try:
     import mediapipe as mp
 except Exception as e:
@@ -38,6 +43,7 @@ class FaceKpsBox:
     y2: int
     score: float
     kps: np.ndarray  # (5,2) float32
+    track_id: int = -1  # set by FaceTracker
 
 # -------------------------
 # Helpers
@@ -75,6 +81,54 @@ def _estimate_norm_5pt(kps_5x2: np.ndarray, out_size: Tuple[int, int] = (112, 11
         )
     return M.astype(np.float32)
 
+# ArcFace 112x112 template (same points as in _estimate_norm_5pt)
+ARCFACE_5PT = np.array([
+    [38.2946, 51.6963],  # left eye
+    [73.5318, 51.5014],  # right eye
+    [56.0252, 71.7366],  # nose
+    [41.5493, 92.3655],  # left mouth
+    [70.7299, 92.2041],  # right mouth
+], dtype=np.float32)
+
+@lru_cache(maxsize=8)
+def _similarity_weights(out_size: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """(10, 4) weights giving [sum a.b, sum a x b, sum x, sum y] from flattened kps, template mean."""
+    dst = ARCFACE_5PT.astype(np.float64) * np.array([out_size[0] / 112.0, out_size[1] / 112.0])
+    mu = dst.mean(axis=0)
+    d = dst - mu
+    Wt = np.zeros((10, 4), dtype=np.float64)
+    Wt[0::2, 0], Wt[1::2, 0] = d[:, 0], d[:, 1]    # x*dx + y*dy
+    Wt[0::2, 1], Wt[1::2, 1] = d[:, 1], -d[:, 0]   # x*dy - y*dx
+    Wt[0::2, 2] = 1.0
+    Wt[1::2, 3] = 1.0
+    return Wt, mu
+
+def similarity_5pt_batch(kps: np.ndarray, out_size: Tuple[int, int] = (112, 112)) -> np.ndarray:
+    """
+    Least-squares similarity transforms (rotation + uniform scale + translation,
+    no reflection) from N sets of 5 points to the ArcFace template, solved in
+    closed form for all faces at once (Umeyama; in 2-D the rotation and scale
+    reduce to two dot products with the centered template, so one (N,10)x(10,4)
+    product does it). Matches estimateAffinePartial2D(LMEDS) on clean 5-point
+    sets, without its sampling.
+    kps: (N, 5, 2) in [Leye, Reye, Nose, Lmouth, Rmouth] order -> (N, 2, 3) float32.
+    """
+    Wt, mu = _similarity_weights((int(out_size[0]), int(out_size[1])))
+    F = np.asarray(kps, dtype=np.float64).reshape(-1, 10)
+    P = F @ Wt
+    var = np.einsum("ij,ij->i", F, F) - (P[:, 2] ** 2 + P[:, 3] ** 2) / 5.0  # sum |p - mean|^2
+    cs = P[:, :2] / np.maximum(var, 1e-12)[:, None]
+    c, s = cs[:, 0], cs[:, 1]
+    mx, my = P[:, 2] / 5.0, P[:, 3] / 5.0
+
+    M = np.empty((F.shape[0], 2, 3), dtype=np.float32)
+    M[:, 0, 0], M[:, 0, 1] = c, -s
+    M[:, 1, 0], M[:, 1, 1] = s, c
+    M[:, 0, 2] = mu[0] - (c * mx - s * my)
+    M[:, 1, 2] = mu[1] - (s * mx + c * my)
+    return M
+
+@profiled("align")
 def align_face_5pt(
     frame_bgr: np.ndarray,
     kps_5x2: np.ndarray,
@@ -95,6 +149,65 @@ def align_face_5pt(
     )
     return aligned, M
 
+@profiled("align")
+def align_faces_5pt(
+    frame_bgr: np.ndarray,
+    kps: np.ndarray,
+    out_size: Tuple[int, int] = (112, 112),
+    out: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    align_face_5pt for N faces of one frame: (aligned (N, H, W, 3) uint8, M (N, 2, 3)).
+
+    All transforms are solved at once (similarity_5pt_batch) and every face is
+    warped straight into out[i], so no per-face arrays are allocated
+    (warpAffine only samples the pixels its output needs, so a full-frame
+    source costs the same as a cropped one). out: preallocated
+    (>= N, H, W, 3) uint8 buffer (e.g. FaceAligner's), else one is made.
+    The result is out[:N] and feeds embed_batch directly.
+    """
+    out_w, out_h = int(out_size[0]), int(out_size[1])
+    kps = np.asarray(kps, dtype=np.float32).reshape(-1, 5, 2)
+    n = kps.shape[0]
+    if out is None:
+        out = np.empty((n, out_h, out_w, 3), dtype=np.uint8)
+    elif out.shape[0] < n or out.shape[1:] != (out_h, out_w, 3) or out.dtype != np.uint8:
+        raise ValueError(f"out must be (>={n}, {out_h}, {out_w}, 3) uint8, got {out.shape} {out.dtype}")
+    M = similarity_5pt_batch(kps, out_size)
+    if n == 0:
+        return out[:0], M
+
+    for i in range(n):
+        cv2.warpAffine(
+            frame_bgr,
+            M[i],
+            (out_w, out_h),
+            dst=out[i],
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(0, 0, 0),
+        )
+    return out[:n], M
+
+class FaceAligner:
+    """Owns a growing (capacity, H, W, 3) buffer for align_faces_5pt; reused call after call."""
+    def __init__(self, out_size: Tuple[int, int] = (112, 112), capacity: int = 8):
+        self.out_size = (int(out_size[0]), int(out_size[1]))
+        self._buf = np.empty((max(1, int(capacity)), self.out_size[1], self.out_size[0], 3), dtype=np.uint8)
+
+    def reserve(self, n: int) -> np.ndarray:
+        """The buffer, grown to hold at least n crops (contents are not kept when it grows)."""
+        if n > self._buf.shape[0]:
+            self._buf = np.empty((max(n, 2 * self._buf.shape[0]),) + self._buf.shape[1:], dtype=np.uint8)
+        return self._buf
+
+    def align(self, frame_bgr: np.ndarray, kps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (aligned (N, H, W, 3), M (N, 2, 3)). NOTE: aligned is a view of the
+        shared buffer, valid until the next call.
+        """
+        return align_faces_5pt(frame_bgr, kps, self.out_size, out=self.reserve(len(kps)))
+
 def _clip_box_xyxy(b: np.ndarray, W: int, H: int) -> np.ndarray:
     bb = b.astype(np.float32).copy()
     bb[0] = np.clip(bb[0], 0, W - 1)
@@ -144,6 +257,177 @@ def _kps_span_ok(kps: np.ndarray, min_eye_dist: float = 12.0) -> bool:
         return False
     return True
 
+# -------------------------
+# Adaptive Haar search
+# -------------------------
+
+# (extra downscale on top of the min_size fit, scaleFactor, minNeighbors), cheapest last.
+# A coarser scale step yields fewer overlapping hits per face, so minNeighbors drops
+# with it; otherwise the coarse levels lose most faces.
+ADAPTIVE_LEVELS: Tuple[Tuple[float, float, int], ...] = (
+    (1.00, 1.10, 5), (1.00, 1.15, 4), (1.00, 1.20, 3), (1.25, 1.20, 3), (1.50, 1.25, 2), (2.00, 1.30, 2),
+)
+
+@dataclass
+class AdaptiveHaarConfig:
+    budget_ms: float = 10.0       # target detectMultiScale time of one detect() call (full sweep included)
+    full_sweep_every: int = 8     # whole-frame search every N calls (and whenever no face is known)
+    roi_margin: float = 0.6       # ROI = last face grown by this fraction of its size on each side
+    face_px: int = 36             # size a min_size face keeps after downscaling
+    window: int = 24              # cascade training window (haarcascade_frontalface_*: 24x24)
+    max_level: int = 3            # most aggressive ADAPTIVE_LEVELS entry ever used (recall floor)
+    recover_sweeps: int = 16      # clean sweeps before a lowered ceiling is raised one level again
+
+class AdaptiveHaar:
+    """
+    detectMultiScale with less work per frame, for one stream:
+    - the frame is downscaled so that a min_size face keeps face_px pixels
+      (faces smaller than min_size were never reported anyway; right at the
+      24 px cascade window Haar misses many faces, hence the margin)
+    - between full sweeps, only ROIs around the last detected faces are searched;
+      a sweep runs every full_sweep_every calls, when nothing is known, and right
+      after a known face was lost
+    - a cost model (ms per searched pyramid pixel, EMA over all calls) picks the
+      least aggressive ADAPTIVE_LEVELS entry that fits budget_ms, separately for a
+      sweep (self.level) and for the ROIs of a call
+    - recall floor: levels above cfg.max_level are never used. When a sweep finds
+      fewer faces than were known just before it, the frame is searched again one
+      level finer; only if that finds more faces (the coarse level lost them, they
+      did not just leave) does the ceiling drop below the coarse level. After
+      cfg.recover_sweeps sweeps without such a loss the ceiling rises one level
+    Downscaling alone saves less than it sounds: detectMultiScale already skips
+    pyramid scales below minSize; the budget is met mostly through scaleFactor,
+    the extra downscale of the higher levels and the ROI search.
+    Boxes are returned as (N, 4) x, y, w, h int32 in full-resolution coordinates.
+    """
+    def __init__(self, cascade, min_size: Tuple[int, int], cfg: Optional[AdaptiveHaarConfig] = None,
+                 debug: bool = False):
+        self.cascade = cascade
+        self.cfg = cfg or AdaptiveHaarConfig()
+        self.min_size = tuple(map(int, min_size))
+        self.debug = bool(debug)
+        self.base_scale = max(1.0, min(self.min_size) / float(max(self.cfg.window, self.cfg.face_px)))
+        self.level = 0
+        self.max_ceiling = max(0, min(int(self.cfg.max_level), len(ADAPTIVE_LEVELS) - 1))
+        self.ceiling = self.max_ceiling
+        self._clean_sweeps = 0
+        self._ms_per_unit: Optional[float] = None
+        self._known = np.zeros((0, 4), dtype=np.int32)
+        self._calls = 0
+        self._force_sweep = True
+        self.sweeps = 0
+        self.roi_calls = 0
+
+    @staticmethod
+    def _pyramid_units(w: float, h: float, scale_factor: float) -> float:
+        """Pixels visited over the whole scale pyramid: w*h / (1 - sf^-2)."""
+        return w * h / (1.0 - scale_factor ** -2)
+
+    def _search(self, gray: np.ndarray, level: int, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        extra, sf, neighbors = ADAPTIVE_LEVELS[level]
+        d = self.base_scale * extra
+        roi = gray[y0:y1, x0:x1]
+        h, w = roi.shape[:2]
+        sw, sh = max(1, int(round(w / d))), max(1, int(round(h / d)))
+        if sw < self.cfg.window or sh < self.cfg.window:
+            return np.zeros((0, 4), dtype=np.int32)
+        small = cv2.resize(roi, (sw, sh), interpolation=cv2.INTER_AREA) if d > 1.0 else roi
+        mn = max(self.cfg.window, int(round(min(self.min_size) / d)))
+
+        t0 = time.perf_counter()
+        faces = self.cascade.detectMultiScale(small, scaleFactor=sf, minNeighbors=neighbors,
+                                              flags=cv2.CASCADE_SCALE_IMAGE, minSize=(mn, mn))
+        k = (time.perf_counter() - t0) * 1000.0 / self._pyramid_units(sw, sh, sf)
+        self._ms_per_unit = k if self._ms_per_unit is None else 0.8 * self._ms_per_unit + 0.2 * k
+
+        if faces is None or len(faces) == 0:
+            return np.zeros((0, 4), dtype=np.int32)
+        f = np.asarray(faces, dtype=np.float32)
+        f[:, [0, 2]] *= w / float(sw)
+        f[:, [1, 3]] *= h / float(sh)
+        f[:, 0] += x0
+        f[:, 1] += y0
+        return np.round(f).astype(np.int32)
+
+    def _rois(self, W: int, H: int) -> List[Tuple[int, int, int, int]]:
+        """Grown last-known boxes, overlapping ones merged, as x0, y0, x1, y1."""
+        m = self.cfg.roi_margin
+        rois = []
+        for x, y, w, h in self._known.tolist():
+            rois.append([max(0, int(x - m * w)), max(0, int(y - m * h)),
+                         min(W, int(x + w + m * w)), min(H, int(y + h + m * h))])
+        merged = True
+        while merged and len(rois) > 1:
+            merged = False
+            for i in range(len(rois)):
+                for j in range(i + 1, len(rois)):
+                    a, b = rois[i], rois[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        rois[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del rois[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [tuple(r) for r in rois]
+
+    def _level_for(self, sizes: List[Tuple[int, int]], current: int) -> int:
+        """Least aggressive level whose predicted time over these search areas fits the budget."""
+        if self._ms_per_unit is None:
+            return min(current, self.ceiling)
+        for lv, (extra, sf, _) in enumerate(ADAPTIVE_LEVELS[:self.ceiling + 1]):
+            d = self.base_scale * extra
+            ms = self._ms_per_unit * sum(self._pyramid_units(w / d, h / d, sf) for w, h in sizes)
+            # stepping back down needs some headroom, so the level does not flap
+            if ms <= self.cfg.budget_ms * (1.0 if lv >= current else 0.8):
+                return lv
+        return self.ceiling
+
+    def detect(self, gray: np.ndarray) -> np.ndarray:
+        H, W = gray.shape[:2]
+        sweep = (self._force_sweep or len(self._known) == 0
+                 or self._calls % max(1, self.cfg.full_sweep_every) == 0)
+        self._calls += 1
+
+        if sweep:
+            level = self._level_for([(W, H)], self.level)
+            if level != self.level and self.debug:
+                print(f"[haar_5pt] adaptive level {self.level} -> {level} (downscale "
+                      f"{self.base_scale * ADAPTIVE_LEVELS[level][0]:.2f}, sf {ADAPTIVE_LEVELS[level][1]})")
+            self.level = level
+            self.sweeps += 1
+            faces = self._search(gray, level, 0, 0, W, H)
+            lost = False
+            if level > 0 and len(faces) < len(self._known):
+                # fewer faces than a moment ago: left the scene, or missed by this level?
+                finer = self._search(gray, level - 1, 0, 0, W, H)
+                if len(finer) > len(faces):
+                    lost = True
+                    faces = finer
+                    self.ceiling = self.level = level - 1
+                    if self.debug:
+                        print(f"[haar_5pt] adaptive level {level} lost faces, ceiling -> {self.ceiling}")
+            self._clean_sweeps = 0 if lost else self._clean_sweeps + 1
+            if self.ceiling < self.max_ceiling and self._clean_sweeps >= max(1, self.cfg.recover_sweeps):
+                self.ceiling += 1
+                self._clean_sweeps = 0
+            self._force_sweep = False
+        else:
+            # ROIs are small: usually the finest level fits, which keeps tracked faces found
+            rois = self._rois(W, H)
+            level = self._level_for([(x1 - x0, y1 - y0) for x0, y0, x1, y1 in rois], 0)
+            self.roi_calls += 1
+            found = [self._search(gray, level, *r) for r in rois]
+            faces = np.concatenate(found, axis=0) if found else np.zeros((0, 4), dtype=np.int32)
+            # a known face went missing (left, or moved out of its ROI): look everywhere next time
+            self._force_sweep = len(faces) < len(self._known)
+        self._known = faces
+        return faces
+
+    def reset(self) -> None:
+        self._known = np.zeros((0, 4), dtype=np.int32)
+        self._force_sweep = True
+
 # -------------------------
 # Detector
 # -------------------------
@@ -155,41 +439,25 @@ class Haar5ptDetector:
         min_size: Tuple[int, int] = (60, 60),
         smooth_alpha: float = 0.80,
         debug: bool = True,
+        adaptive: Optional[AdaptiveHaarConfig] = None,
     ):
         self.debug = bool(debug)
         self.min_size = tuple(map(int, min_size))
         self.smooth_alpha = float(smooth_alpha)
 
-        # Haar cascade
-        if haar_xml is None:
-            haar_xml = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-        self.face_cascade = cv2.CascadeClassifier(haar_xml)
-        if self.face_cascade.empty():
-            raise RuntimeError(f"Failed to load Haar cascade: {haar_xml}")
+        # Haar cascade, loaded once per process (src/registry.py)
+        self.face_cascade = registry.get_cascade(haar_xml)
+        # adaptive=None: full-resolution search every frame
+        self.adaptive = AdaptiveHaar(self.face_cascade, self.min_size, adaptive, debug=self.debug) if adaptive else None
 
-        # MediaPipe FaceMesh - Use fallback for compatibility
         if mp is None:
             print("⚠️  MediaPipe not available, using geometric estimation fallback")
-            self.mp_face_mesh = None
-            self._use_mediapipe = False
-        else:
-            try:
-                # Try to use MediaPipe solutions (older API)
-                self.mp_face_mesh = mp.solutions.face_mesh.FaceMesh(
-                    static_image_mode=False,
-                    max_num_faces=1,
-                    refine_landmarks=True,
-                    min_detection_confidence=0.5,
-                    min_tracking_confidence=0.5,
-                )
-                self._use_mediapipe = True
-                if self.debug:
-                    print("✅ Using MediaPipe FaceMesh for landmark detection")
-            except (AttributeError, Exception) as e:
-                if self.debug:
-                    print(f"⚠️  MediaPipe FaceMesh not available ({e}), using geometric estimation")
-                self.mp_face_mesh = None
-                self._use_mediapipe = False
+        # tracking FaceMesh (static_image_mode=False) follows one stream, so it belongs to this detector
+        self.mp_face_mesh = registry.create_face_mesh(max_num_faces=1) if mp is not None else None
+        self._use_mediapipe = self.mp_face_mesh is not None
+        if self.debug:
+            print("✅ Using MediaPipe FaceMesh for landmark detection" if self._use_mediapipe
+                  else "⚠️  MediaPipe FaceMesh not available, using geometric estimation")
 
         # FaceMesh landmark indices for 5 points
         self.IDX_LEFT_EYE = 33
@@ -200,8 +468,12 @@ class Haar5ptDetector:
 
         self._prev_box: Optional[np.ndarray] = None
         self._prev_kps: Optional[np.ndarray] = None
+        self.fallback_count = 0  # landmarks estimated from the Haar box (also PROFILER "landmark_fallback")
 
+    @profiled("haar")
     def _haar_faces(self, gray: np.ndarray) -> np.ndarray:
+        if self.adaptive is not None:
+            return self.adaptive.detect(gray)
         faces = self.face_cascade.detectMultiScale(
             gray,
             scaleFactor=1.1,
@@ -213,18 +485,23 @@ class Haar5ptDetector:
             return np.zeros((0, 4), dtype=np.int32)
         return faces.astype(np.int32)
 
-    def _facemesh_5pt(self, frame_bgr: np.ndarray) -> Optional[np.ndarray]:
+    @profiled("facemesh")
+    def _facemesh_5pt(self, frame_bgr: np.ndarray, face: np.ndarray) -> Optional[np.ndarray]:
+        """
+        5pt for the frame's face; face = the Haar box (x, y, w, h) detect() picked,
+        used by the geometric fallback so the cascade never runs a second time.
+        """
         H, W = frame_bgr.shape[:2]
         
         if not self._use_mediapipe or self.mp_face_mesh is None:
             # Use geometric estimation fallback
-            return self._simple_5pt_estimation(frame_bgr)
+            return self._simple_5pt_estimation(face)
         
         try:
             rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
             res = self.mp_face_mesh.process(rgb)
             if not res.multi_face_landmarks:
-                return self._simple_5pt_estimation(frame_bgr)
+                return self._simple_5pt_estimation(face)
 
             lm = res.multi_face_landmarks[0].landmark
             idxs = [
@@ -249,26 +526,16 @@ class Haar5ptDetector:
             if self.debug:
                 print(f"MediaPipe processing failed: {e}, using fallback")
             # Fallback to geometric estimation
-            return self._simple_5pt_estimation(frame_bgr)
+            return self._simple_5pt_estimation(face)
     
-    def _simple_5pt_estimation(self, frame_bgr: np.ndarray) -> Optional[np.ndarray]:
+    def _simple_5pt_estimation(self, face: np.ndarray) -> np.ndarray:
         """
-        Fallback method: estimate 5 points from Haar face detection
+        Fallback method: estimate 5 points from the Haar box (x, y, w, h)
         This is less accurate but ensures compatibility
         """
-        H, W = frame_bgr.shape[:2]
-        gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
-        
-        # Get Haar faces first
-        faces = self._haar_faces(gray)
-        
-        if len(faces) == 0:
-            return None
-            
-        # Take the largest face
-        areas = faces[:, 2] * faces[:, 3]
-        i = int(np.argmax(areas))
-        x, y, w, h = faces[i]
+        self.fallback_count += 1
+        PROFILER.count("landmark_fallback")
+        x, y, w, h = (int(v) for v in face)
         
         # Estimate 5 points based on face geometry
         # This is a rough approximation but should work
@@ -318,7 +585,7 @@ class Haar5ptDetector:
         x, y, w, h = faces[i].tolist()
 
         # Try to get landmarks (FaceMesh or fallback)
-        kps = self._facemesh_5pt(frame_bgr)
+        kps = self._facemesh_5pt(frame_bgr, faces[i])
         if kps is None:
             if self.debug:
                 print("[haar_5pt] No landmarks detected, face rejected")
@@ -374,6 +641,10 @@ class Haar5ptDetector:
             kps=kps_s.astype(np.float32)
         )][:max_faces]
 
+    def detect_batch(self, frames: List[np.ndarray], max_faces: int = 1) -> List[List[FaceKpsBox]]:
+        """detect() per frame, in order (the EMA smoothing assumes one stream)."""
+        return [self.detect(f, max_faces=max_faces) for f in frames]
+
 # -------------------------
 # Demo
 # -------------------------
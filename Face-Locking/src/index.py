@@ -0,0 +1,266 @@
+# src/index.py
+"""
+Similarity-search backends for FaceDBMatcher.
+
+All backends index the rows of an (N, D) float32 matrix of L2-normalized
+embeddings and answer top-k by cosine similarity (= dot product):
+
+- ExactIndex : dense mat @ q, exact. Best up to a few thousand identities.
+- IVFIndex   : pure NumPy inverted file. Spherical k-means splits the rows
+               into n_lists clusters stored contiguously; a query scans only
+               the n_probe closest clusters. n_probe is the recall/latency knob.
+- HNSWIndex  : graph index from the optional `hnswlib` package; ef is the knob.
+
+Built indexes can be saved next to the DB (face_db.npz -> face_db.ivf.npz /
+face_db.hnsw.bin) and are reloaded only if the embedding matrix is unchanged.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+try:
+    import hnswlib
+except Exception as e:
+    hnswlib = None
+    _HNSW_IMPORT_ERROR = e
+
+INDEX_KINDS = ("exact", "ivf", "hnsw")
+# IVF lists scanned per query: ~0.92 recall@1 at 100k identities (benchmarks/bench_index.py)
+DEFAULT_N_PROBE = 64
+
+# -------------------------
+# Helpers
+# -------------------------
+
+def matrix_fingerprint(mat: np.ndarray) -> str:
+    """Content hash of the indexed matrix, used to reject stale persisted indexes."""
+    m = np.ascontiguousarray(mat, dtype=np.float32)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.asarray(m.shape, dtype=np.int64).tobytes())
+    h.update(m.tobytes())
+    return h.hexdigest()
+
+def index_path_for(db_path: Path, kind: str) -> Path:
+    """data/db/face_db.npz -> data/db/face_db.ivf.npz (or .hnsw.bin)"""
+    ext = ".bin" if kind == "hnsw" else ".npz"
+    return db_path.with_name(f"{db_path.stem}.{kind}{ext}")
+
+def topk_rows(sims: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k per row of (B, N) sims, sorted descending."""
+    n = sims.shape[1]
+    k = min(k, n)
+    if k < n:
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), sims.shape).copy()
+    vals = np.take_along_axis(sims, part, axis=1)
+    order = np.argsort(-vals, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+# -------------------------
+# Exact
+# -------------------------
+
+class ExactIndex:
+    kind = "exact"
+
+    def __init__(self, mat: np.ndarray):
+        self.mat = np.ascontiguousarray(mat, dtype=np.float32)
+
+    def search(self, q: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """q: (D,) or (B, D). Returns (ids, sims), each (B, k)."""
+        Q = np.asarray(q, dtype=np.float32).reshape(-1, self.mat.shape[1])
+        return topk_rows(Q @ self.mat.T, k)
+
+# -------------------------
+# IVF (pure NumPy)
+# -------------------------
+
+class IVFIndex:
+    kind = "ivf"
+
+    def __init__(
+        self,
+        mat: np.ndarray,
+        n_lists: Optional[int] = None,
+        n_probe: int = DEFAULT_N_PROBE,
+        train_size: int = 50_000,
+        iters: int = 12,
+        seed: int = 0,
+        _prebuilt: Optional[dict] = None,
+    ):
+        """
+        n_lists: clusters (default ~ 4*sqrt(N)); n_probe: clusters scanned per query.
+        k-means trains on at most train_size rows, then every row is assigned.
+        """
+        self.mat = np.ascontiguousarray(mat, dtype=np.float32)
+        self.n_probe = int(n_probe)
+        N = self.mat.shape[0]
+
+        if _prebuilt is not None:
+            self.centroids = _prebuilt["centroids"]
+            self.order = _prebuilt["order"]
+            self.offsets = _prebuilt["offsets"]
+        else:
+            n_lists = int(n_lists or max(1, min(N, int(4 * np.sqrt(N)))))
+            self.centroids = self._train(n_lists, train_size, iters, seed)
+            assign = self._assign(self.mat)
+            self.order = np.argsort(assign, kind="stable").astype(np.int64)
+            counts = np.bincount(assign, minlength=self.centroids.shape[0])
+            self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        # rows stored list-by-list so each probed list is one contiguous slice
+        self._vecs = self.mat[self.order]
+
+    @property
+    def n_lists(self) -> int:
+        return int(self.centroids.shape[0])
+
+    def _assign(self, X: np.ndarray, chunk: int = 16384) -> np.ndarray:
+        out = np.empty(X.shape[0], dtype=np.int64)
+        for s in range(0, X.shape[0], chunk):
+            out[s:s + chunk] = np.argmax(X[s:s + chunk] @ self.centroids.T, axis=1)
+        return out
+
+    def _train(self, n_lists: int, train_size: int, iters: int, seed: int) -> np.ndarray:
+        rng = np.random.default_rng(seed)
+        N = self.mat.shape[0]
+        X = self.mat if N <= train_size else self.mat[rng.choice(N, train_size, replace=False)]
+        C = X[rng.choice(X.shape[0], n_lists, replace=False)].copy()
+        for _ in range(iters):
+            a = np.argmax(X @ C.T, axis=1)
+            sums = np.zeros_like(C)
+            np.add.at(sums, a, X)
+            counts = np.bincount(a, minlength=n_lists)
+            empty = counts == 0
+            if empty.any():  # re-seed empty clusters with random points
+                sums[empty] = X[rng.choice(X.shape[0], int(empty.sum()), replace=False)]
+            C = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-12)
+        return C.astype(np.float32)
+
+    def search(self, q: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        Q = np.asarray(q, dtype=np.float32).reshape(-1, self.mat.shape[1])
+        n_probe = max(1, min(self.n_probe, self.n_lists))
+        probes = topk_rows(Q @ self.centroids.T, n_probe)[0]
+
+        ids = np.full((Q.shape[0], k), -1, dtype=np.int64)
+        sims = np.full((Q.shape[0], k), -np.inf, dtype=np.float32)
+        for b in range(Q.shape[0]):
+            spans = [(int(self.offsets[l]), int(self.offsets[l + 1])) for l in probes[b]]
+            spans = [(s, e) for s, e in spans if e > s]
+            if not spans:
+                continue
+            cand = np.concatenate([self._vecs[s:e] @ Q[b] for s, e in spans])
+            pos = np.concatenate([np.arange(s, e) for s, e in spans])
+            top, vals = topk_rows(cand[None, :], k)
+            ids[b, :top.shape[1]] = self.order[pos[top[0]]]
+            sims[b, :vals.shape[1]] = vals[0]
+        return ids, sims
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            path,
+            centroids=self.centroids,
+            order=self.order,
+            offsets=self.offsets,
+            fingerprint=np.array(matrix_fingerprint(self.mat)),
+        )
+
+    @classmethod
+    def load(cls, path: Path, mat: np.ndarray, n_probe: int = DEFAULT_N_PROBE) -> Optional["IVFIndex"]:
+        """Persisted index for exactly this matrix, else None."""
+        if not path.exists():
+            return None
+        data = np.load(path)
+        if str(data["fingerprint"]) != matrix_fingerprint(mat):
+            return None
+        prebuilt = {k: data[k] for k in ("centroids", "order", "offsets")}
+        return cls(mat, n_probe=n_probe, _prebuilt=prebuilt)
+
+# -------------------------
+# HNSW (optional hnswlib)
+# -------------------------
+
+class HNSWIndex:
+    kind = "hnsw"
+
+    def __init__(self, mat: np.ndarray, M: int = 16, ef_construction: int = 200, ef: int = 64,
+                 _prebuilt=None):
+        if hnswlib is None:
+            raise RuntimeError("HNSW index needs: pip install hnswlib")
+        self.mat = np.ascontiguousarray(mat, dtype=np.float32)
+        N, D = self.mat.shape
+        if _prebuilt is not None:
+            self._idx = _prebuilt
+        else:
+            self._idx = hnswlib.Index(space="ip", dim=D)
+            self._idx.init_index(max_elements=max(1, N), M=int(M), ef_construction=int(ef_construction))
+            self._idx.add_items(self.mat, np.arange(N))
+        self.ef = int(ef)
+
+    @property
+    def ef(self) -> int:
+        return self._ef
+
+    @ef.setter
+    def ef(self, v: int) -> None:
+        self._ef = int(v)
+        self._idx.set_ef(self._ef)
+
+    def search(self, q: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        Q = np.asarray(q, dtype=np.float32).reshape(-1, self.mat.shape[1])
+        k = min(k, self.mat.shape[0])
+        if self._ef < k:
+            self.ef = k
+        labels, dist = self._idx.knn_query(Q, k=k)
+        return labels.astype(np.int64), (1.0 - dist).astype(np.float32)  # ip space: dist = 1 - dot
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._idx.save_index(str(path))
+        path.with_suffix(".json").write_text(json.dumps({"fingerprint": matrix_fingerprint(self.mat)}))
+
+    @classmethod
+    def load(cls, path: Path, mat: np.ndarray, ef: int = 64) -> Optional["HNSWIndex"]:
+        meta = path.with_suffix(".json")
+        if hnswlib is None or not path.exists() or not meta.exists():
+            return None
+        if json.loads(meta.read_text()).get("fingerprint") != matrix_fingerprint(mat):
+            return None
+        idx = hnswlib.Index(space="ip", dim=mat.shape[1])
+        idx.load_index(str(path), max_elements=mat.shape[0])
+        return cls(mat, ef=ef, _prebuilt=idx)
+
+# -------------------------
+# Factory
+# -------------------------
+
+def build_index(kind: str, mat: np.ndarray, path: Optional[Path] = None,
+                n_probe: int = DEFAULT_N_PROBE, ef: int = 64, **kw):
+    """
+    Build (or load from path, if fresh) an index over mat rows.
+    path=None disables persistence.
+    """
+    if kind == "exact":
+        return ExactIndex(mat)
+    if kind == "ivf":
+        idx = IVFIndex.load(path, mat, n_probe=n_probe) if path is not None else None
+        if idx is None:
+            idx = IVFIndex(mat, n_probe=n_probe, **kw)
+            if path is not None:
+                idx.save(path)
+        return idx
+    if kind == "hnsw":
+        idx = HNSWIndex.load(path, mat, ef=ef) if path is not None else None
+        if idx is None:
+            idx = HNSWIndex(mat, ef=ef, **kw)
+            if path is not None:
+                idx.save(path)
+        return idx
+    raise ValueError(f"Unknown index kind: {kind!r} (expected one of {INDEX_KINDS})")
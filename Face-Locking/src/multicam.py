@@ -0,0 +1,436 @@
+# src/multicam.py
+"""
+Multi-camera recognition server: one process serves many streams.
+
+Run:
+    python -m src.multicam --source 0 --source lobby=rtsp://10.0.0.5/stream --source door=clip.mp4
+    python -m src.multicam --source ... --workers 4 --jsonl results.jsonl
+
+Flow:
+    capture thread per camera (device index, RTSP/HTTP URL or video file)
+        keeps only the newest frame of its camera (mailbox)
+    -> detection worker pool (shared by all cameras)
+        a camera is queued when it has a new frame and is picked up by at most
+        one worker at a time, so its FaceTracker state and frame order stay
+        consistent; cameras are served round-robin
+        detect (FaceTracker + HaarFaceMesh5pt or YuNetDetector) + batched alignment
+    -> ONE embedding worker
+        gathers aligned crops of all cameras (up to max_batch crops, or until
+        max_wait_ms after the first) into one embed_batch call, then one
+        match_batch on the single shared FaceDBMatcher
+    -> results per camera: on_result(CameraResult) callback, or
+       server.results(camera).get() (newest-kept queue per camera)
+
+Models come from src/registry.py, so the cascade and ONNX session exist once.
+The shared matcher is hot-reloaded by a DBWatcher like in recognize.py.
+Live sources reconnect with backoff when a read fails; files are paced at
+their own fps (like a camera) and end their camera when done.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from . import registry
+from .embed import OrtSessionConfig
+from .facedb import resolve_db_path
+from .index import DEFAULT_N_PROBE, INDEX_KINDS, index_path_for
+from .haar_5pt import AdaptiveHaarConfig, align_faces_5pt
+from .offline import _face_record
+from .pipeline import DropOldestQueue, StageStats
+from .profiling import PROFILER, start_exporter_from_env
+from .detectors import DETECTORS, create_detector
+from .recognize import (
+    ArcFaceEmbedderONNX, DBWatcher, FaceDBMatcher, FaceDet, LANDMARK_MODES, MatchResult, load_db,
+)
+from .track import FaceTracker
+
+# -------------------------
+# Data
+# -------------------------
+
+@dataclass
+class CameraResult:
+    camera: str
+    seq: int
+    t_capture: float                   # time.perf_counter() at grab
+    frame: np.ndarray
+    faces: List[FaceDet]
+    matches: List[MatchResult]
+    latency_ms: float = 0.0            # capture -> result
+
+ResultFn = Callable[[CameraResult], None]
+
+def parse_source(spec: str, index: int) -> Tuple[str, object]:
+    """
+    "0" -> ("cam0", 0); "lobby=rtsp://..." -> ("lobby", "rtsp://...");
+    "clip.mp4" -> ("clip", "clip.mp4").
+    """
+    name, sep, target = spec.partition("=")
+    if not sep or "://" in name:
+        name, target = "", spec
+    src: object = int(target) if target.isdigit() else target
+    if not name:
+        name = f"cam{src}" if isinstance(src, int) else (Path(target).stem if "://" not in target else f"cam{index}")
+    return name, src
+
+def _is_file(src: object) -> bool:
+    """Paths are files (paced, end their camera); device indices and URLs are live streams."""
+    return isinstance(src, str) and "://" not in src
+
+# -------------------------
+# Camera
+# -------------------------
+
+@dataclass
+class _Camera:
+    name: str
+    source: object
+    tracker: FaceTracker
+    mailbox: DropOldestQueue = field(default_factory=lambda: DropOldestQueue(1))
+    results: DropOldestQueue = field(default_factory=lambda: DropOldestQueue(4))
+    scheduled: bool = False            # queued for / held by a detection worker
+    finished: bool = False             # file ended
+    seq: int = 0
+    frames: int = 0                    # captured
+    processed: int = 0                 # results emitted
+    reconnects: int = 0
+
+# -------------------------
+# Server
+# -------------------------
+
+class MultiCamServer:
+    def __init__(
+        self,
+        sources: Sequence[str],
+        embedder: ArcFaceEmbedderONNX,
+        matcher: FaceDBMatcher,
+        detect_workers: int = 4,
+        detect_every: int = 5,
+        landmark_mode: str = "frame",
+        max_faces: int = 5,
+        haar_budget_ms: float = 0.0,
+        detector: str = "haar",
+        detector_model: Optional[str] = None,
+        max_batch: int = 32,
+        max_wait_ms: float = 5.0,
+        on_result: Optional[ResultFn] = None,
+    ):
+        """
+        sources      : "0", "rtsp://...", "clip.mp4", optionally "name=..." (see parse_source)
+        detect_workers: threads shared by all cameras for detection + alignment
+        haar_budget_ms: > 0 enables the adaptive Haar search (per camera) with this budget
+        detector     : "haar" or "yunet" (src/detectors.py); YuNet's session is shared by all cameras
+        max_batch    : crops per embed_batch call (across cameras)
+        max_wait_ms  : how long the embedding worker waits to fill a batch
+        on_result    : called on the embedding worker's thread; keep it short.
+                       Without it, results are queued per camera (server.results(name)).
+        """
+        self.embedder = embedder
+        self.matcher = matcher
+        self.detect_workers = max(1, int(detect_workers))
+        self.max_faces = int(max_faces)
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self.on_result = on_result
+
+        self.cameras: Dict[str, _Camera] = {}
+        for i, spec in enumerate(sources):
+            name, src = parse_source(spec, i)
+            if name in self.cameras:
+                raise ValueError(f"Duplicate camera name: {name!r}")
+            adaptive = AdaptiveHaarConfig(budget_ms=haar_budget_ms) if haar_budget_ms > 0 else None
+            det = create_detector(detector, min_size=(70, 70), max_faces=max_faces, landmark_mode=landmark_mode,
+                                  adaptive=adaptive, model_path=detector_model)
+            self.cameras[name] = _Camera(name=name, source=src, tracker=FaceTracker(det, detect_every=detect_every))
+
+        self._ready: "queue.Queue[Optional[str]]" = queue.Queue()   # cameras with a new frame
+        self._sched_lock = threading.Lock()
+        self._embed_q = DropOldestQueue(maxsize=2 * len(self.cameras) + 2)
+        self._count_lock = threading.Lock()
+        self._queued = 0    # frames handed to the embedding worker
+        self._emitted = 0   # frames whose results were delivered
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        self.stats: Dict[str, StageStats] = {n: StageStats(n) for n in
+                                             ("detect", "embed_match", "batch_faces", "end_to_end")}
+
+    # ---- capture ----
+
+    def _open(self, cam: _Camera) -> Optional[cv2.VideoCapture]:
+        cap = cv2.VideoCapture(cam.source)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        return cap
+
+    def _capture_loop(self, cam: _Camera):
+        backoff = 1.0
+        cap = self._open(cam)
+        is_file = _is_file(cam.source)
+        period = 0.0
+        if is_file and cap is not None:
+            period = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0)
+        t_next = time.perf_counter()
+
+        while not self._stop.is_set():
+            if cap is None:
+                if is_file:
+                    print(f"[multicam] {cam.name}: cannot open {cam.source}")
+                    break
+                # live source down: retry with backoff
+                if self._stop.wait(backoff):
+                    break
+                backoff = min(30.0, backoff * 2.0)
+                cap = self._open(cam)
+                if cap is not None:
+                    cam.reconnects += 1
+                    print(f"[multicam] {cam.name}: reconnected")
+                continue
+
+            t0 = time.perf_counter()
+            ok, frame = cap.read()
+            if not ok:
+                cap.release()
+                cap = None
+                if is_file:
+                    break
+                print(f"[multicam] {cam.name}: read failed, reconnecting")
+                continue
+            backoff = 1.0
+
+            cam.frames += 1
+            cam.mailbox.put((cam.seq, t0, frame))  # newest frame wins
+            cam.seq += 1
+            self._schedule(cam)
+
+            if period:
+                t_next += period
+                delay = t_next - time.perf_counter()
+                if delay > 0:
+                    self._stop.wait(delay)
+                else:
+                    t_next = time.perf_counter()
+
+        if cap is not None:
+            cap.release()
+        cam.finished = True
+
+    def _schedule(self, cam: _Camera) -> None:
+        with self._sched_lock:
+            if cam.scheduled:
+                return
+            cam.scheduled = True
+        self._ready.put(cam.name)
+
+    # ---- detection pool ----
+
+    def _detect_loop(self):
+        while not self._stop.is_set():
+            try:
+                name = self._ready.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if name is None:
+                return
+            cam = self.cameras[name]
+            item = cam.mailbox.get(timeout=0)
+            if item is not None:
+                seq, t_cap, frame = item
+                t0 = time.perf_counter()
+                faces = cam.tracker.detect(frame, max_faces=self.max_faces)
+                crops, _ = align_faces_5pt(frame, [f.kps for f in faces], out_size=(112, 112))
+                self.stats["detect"].add((time.perf_counter() - t0) * 1000.0)
+                with self._count_lock:
+                    self._queued += 1
+                self._embed_q.put((cam, seq, t_cap, frame, faces, crops))
+
+            # release the camera; re-queue it if a newer frame arrived meanwhile
+            with self._sched_lock:
+                cam.scheduled = False
+            if len(cam.mailbox):
+                self._schedule(cam)
+
+    # ---- embedding worker ----
+
+    def _gather(self) -> list:
+        first = self._embed_q.get(timeout=0.1)
+        if first is None:
+            return []
+        batch = [first]
+        n = len(first[5])
+        deadline = time.perf_counter() + self.max_wait_s
+        while n < self.max_batch:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                break
+            item = self._embed_q.get(timeout=left)
+            if item is None:
+                break
+            batch.append(item)
+            n += len(item[5])
+        return batch
+
+    def _embed_loop(self):
+        while not self._stop.is_set():
+            batch = self._gather()
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            crops = [c for item in batch for c in item[5]]
+            matches: List[MatchResult] = []
+            if crops:
+                matches = self.matcher.match_batch(self.embedder.embed_batch(np.stack(crops)))
+            self.stats["embed_match"].add((time.perf_counter() - t0) * 1000.0)
+            self.stats["batch_faces"].add(float(len(crops)))
+
+            k = 0
+            for cam, seq, t_cap, frame, faces, _ in batch:
+                res = CameraResult(camera=cam.name, seq=seq, t_capture=t_cap, frame=frame,
+                                   faces=faces, matches=matches[k:k + len(faces)])
+                k += len(faces)
+                res.latency_ms = (time.perf_counter() - t_cap) * 1000.0
+                self.stats["end_to_end"].add(res.latency_ms)
+                cam.processed += 1
+                if self.on_result is not None:
+                    try:
+                        self.on_result(res)
+                    except Exception as e:
+                        print(f"[multicam] on_result failed for {cam.name}: {e}")
+                else:
+                    cam.results.put(res)
+            with self._count_lock:
+                self._emitted += len(batch)
+
+    # ---- control ----
+
+    def start(self) -> "MultiCamServer":
+        for cam in self.cameras.values():
+            self._threads.append(threading.Thread(target=self._capture_loop, args=(cam,),
+                                                  name=f"capture-{cam.name}", daemon=True))
+        for i in range(self.detect_workers):
+            self._threads.append(threading.Thread(target=self._detect_loop, name=f"detect-{i}", daemon=True))
+        self._threads.append(threading.Thread(target=self._embed_loop, name="embed", daemon=True))
+        for t in self._threads:
+            t.start()
+        print(f"[multicam] {len(self.cameras)} cameras, {self.detect_workers} detection workers, "
+              f"embed batch <= {self.max_batch}")
+        return self
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self._stop.set()
+        for _ in range(self.detect_workers):
+            self._ready.put(None)
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads.clear()
+
+    def results(self, camera: str) -> DropOldestQueue:
+        """Per-camera result queue (used when no on_result callback is set)."""
+        return self.cameras[camera].results
+
+    @property
+    def done(self) -> bool:
+        """All sources ended (files) and nothing is left in flight."""
+        with self._count_lock:
+            in_flight = self._queued - self._emitted - self._embed_q.dropped
+        return (all(c.finished for c in self.cameras.values())
+                and all(not c.scheduled and len(c.mailbox) == 0 for c in self.cameras.values())
+                and in_flight == 0)
+
+    def format_stats(self) -> str:
+        lines = [f"{'camera':<16}{'captured':>10}{'processed':>11}{'skipped':>9}{'reconnects':>12}"]
+        for c in self.cameras.values():
+            lines.append(f"{c.name:<16}{c.frames:>10}{c.processed:>11}{c.mailbox.dropped:>9}{c.reconnects:>12}")
+        lines.append(f"{'stage':<16}{'n':>10}{'mean':>11}{'p50':>9}{'p95':>12}")
+        for name, st in self.stats.items():
+            s = st.summary()
+            lines.append(f"{name:<16}{int(s['n']):>10}{s['mean']:>11.2f}{s['p50']:>9.2f}{s['p95']:>12.2f}")
+        lines.append(f"embed queue drops: {self._embed_q.dropped}")
+        return "\n".join(lines)
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    ap = argparse.ArgumentParser(description="Multi-camera recognition server")
+    ap.add_argument("--source", action="append", required=True,
+                    help="camera index, RTSP/HTTP URL or video file; name=... to label it (repeatable)")
+    ap.add_argument("--workers", type=int, default=4, help="detection workers shared by all cameras")
+    ap.add_argument("--detect-every", type=int, default=5)
+    ap.add_argument("--landmarks", choices=LANDMARK_MODES, default="frame")
+    ap.add_argument("--haar-budget-ms", type=float, default=0.0, help="> 0: adaptive Haar search per camera")
+    ap.add_argument("--detector", choices=DETECTORS, default="haar")
+    ap.add_argument("--detector-model", help="YuNet ONNX (default models/face_detection_yunet_2023mar.onnx)")
+    ap.add_argument("--max-batch", type=int, default=32, help="crops per ONNX call, across cameras")
+    ap.add_argument("--max-wait-ms", type=float, default=5.0)
+    ap.add_argument("--thr", type=float, default=0.34, help="distance threshold")
+    ap.add_argument("--index", choices=INDEX_KINDS, default="exact", help="DB search: exact | ivf | hnsw")
+    ap.add_argument("--n-probe", type=int, default=DEFAULT_N_PROBE, help="ivf: lists scanned per query")
+    ap.add_argument("--ef", type=int, default=64, help="hnsw: search breadth")
+    ap.add_argument("--jsonl", type=Path, help="write one JSON line per processed frame")
+    ap.add_argument("--stats-every", type=float, default=10.0, help="seconds between stats prints (0 = off)")
+    args = ap.parse_args()
+
+    db_path = resolve_db_path(Path("data/db/face_db.npz"))
+    embedder = ArcFaceEmbedderONNX(model_path="models/embedder_arcface.onnx", input_size=(112, 112),
+                                   max_batch=args.max_batch, session_cfg=OrtSessionConfig.from_env())
+    matcher = FaceDBMatcher(db=load_db(db_path), dist_thresh=args.thr, index=args.index,
+                            index_path=index_path_for(db_path, args.index) if args.index != "exact" else None,
+                            n_probe=args.n_probe, ef=args.ef)
+    watcher = DBWatcher(matcher, Path("data/db/face_db.npz")).start()
+
+    out = open(args.jsonl, "w", encoding="utf-8") if args.jsonl else None
+    out_lock = threading.Lock()
+
+    def on_result(r: CameraResult):
+        named = [m.name for m in r.matches if m.accepted]
+        if out is not None:
+            rec = {"camera": r.camera, "frame": r.seq, "latency_ms": round(r.latency_ms, 1),
+                   "faces": [_face_record(f, m) for f, m in zip(r.faces, r.matches)]}
+            with out_lock:
+                out.write(json.dumps(rec) + "\n")
+        elif named:
+            print(f"[multicam] {r.camera} #{r.seq}: {', '.join(named)}")
+
+    server = MultiCamServer(args.source, embedder, matcher, detect_workers=args.workers,
+                            detect_every=args.detect_every, landmark_mode=args.landmarks,
+                            haar_budget_ms=args.haar_budget_ms, detector=args.detector,
+                            detector_model=args.detector_model,
+                            max_batch=args.max_batch, max_wait_ms=args.max_wait_ms, on_result=on_result)
+    registry.warm_up(batch_sizes=(1, embedder.max_batch))
+    exporter = start_exporter_from_env()
+    server.start()
+    t_report = time.perf_counter()
+    try:
+        while not server.done:
+            time.sleep(0.2)
+            if args.stats_every > 0 and time.perf_counter() - t_report >= args.stats_every:
+                t_report = time.perf_counter()
+                print(server.format_stats())
+    except KeyboardInterrupt:
+        print("\n[multicam] stopping")
+    finally:
+        server.stop()
+        watcher.stop()
+        if exporter is not None:
+            exporter.stop()
+        if out is not None:
+            out.close()
+        print(server.format_stats())
+        print(PROFILER.format())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# src/offline.py
+"""
+Headless batch recognition over recorded footage (no window, no camera).
+
+Run (through recognize.py):
+    python -m src.recognize --input clip.mp4 --output results.jsonl
+    python -m src.recognize --input clip.mp4 --output results.jsonl --annotate out.mp4
+    python -m src.recognize --input data/frames/ --output results.jsonl
+
+Flow:
+    decode thread (FramePipeline, realtime=False: nothing dropped)
+    -> detect thread (FaceTracker on videos, plain detector on image folders)
+    -> main thread: faces of batch_frames frames are aligned and embedded in
+       ONE embed_batch call, matched in one matrix product, then written as
+       JSON lines (+ optional annotated video)
+
+Image folders with a batched detector (--detector yunet): the detect thread is
+skipped and the batch_frames frames go through ONE detector.detect_batch call
+on the main thread, ahead of alignment.
+
+One JSON object per frame:
+    {"frame": 12, "t": 0.48, "faces": [{"track_id": 3, "box": [x1, y1, x2, y2],
+     "score": 0.93, "kps": [[x, y] x5], "name": "alice", "distance": 0.21,
+     "similarity": 0.79, "accepted": true}]}
+Image folders use "file" instead of "t".
+"""
+
+from __future__ import annotations
+import json
+import time
+from pathlib import Path
+from typing import List, Optional, TextIO
+
+import cv2
+import numpy as np
+
+from .haar_5pt import FaceAligner, align_faces_5pt
+from .pipeline import FramePacket, FramePipeline, StageStats
+from .profiling import PROFILER
+from .track import FaceTracker
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# -------------------------
+# Sources
+# -------------------------
+
+class VideoFileSource:
+    def __init__(self, path: Path):
+        self.cap = cv2.VideoCapture(str(path))
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Cannot open video: {path}")
+        self.fps = float(self.cap.get(cv2.CAP_PROP_FPS) or 0.0) or 30.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+
+    def read(self):
+        return self.cap.read()
+
+    def describe(self, seq: int) -> dict:
+        return {"t": round(seq / self.fps, 3)}
+
+    def release(self):
+        self.cap.release()
+
+class ImageFolderSource:
+    fps = 10.0  # annotated output only
+
+    def __init__(self, folder: Path):
+        self.paths = sorted(p for p in folder.iterdir() if p.suffix.lower() in IMAGE_EXTS)
+        if not self.paths:
+            raise RuntimeError(f"No images found in {folder}")
+        self.frame_count = len(self.paths)
+        self._i = 0
+        self._names: List[str] = []  # seq -> file name (unreadable files are skipped)
+
+    def read(self):
+        while self._i < len(self.paths):
+            path = self.paths[self._i]
+            self._i += 1
+            img = cv2.imread(str(path))
+            if img is not None:
+                self._names.append(path.name)
+                return True, img
+            print(f"[offline] skipping unreadable {path.name}")
+        return False, None
+
+    def describe(self, seq: int) -> dict:
+        return {"file": self._names[seq]}
+
+    def release(self):
+        pass
+
+# -------------------------
+# Output
+# -------------------------
+
+def _face_record(f, mr) -> dict:
+    return {
+        "track_id": int(f.track_id),
+        "box": [int(f.x1), int(f.y1), int(f.x2), int(f.y2)],
+        "score": round(float(f.score), 4),
+        "kps": np.round(f.kps.astype(np.float64), 1).tolist(),
+        "name": mr.name,
+        "distance": round(mr.distance, 4),
+        "similarity": round(mr.similarity, 4),
+        "accepted": mr.accepted,
+    }
+
+def draw_results(frame: np.ndarray, faces, matches) -> np.ndarray:
+    vis = frame.copy()
+    for f, mr in zip(faces, matches):
+        color = (0, 255, 0) if mr.accepted else (0, 0, 255)
+        cv2.rectangle(vis, (f.x1, f.y1), (f.x2, f.y2), color, 2)
+        label = f"{mr.name or 'Unknown'} {mr.distance:.2f}"
+        cv2.putText(vis, label, (f.x1, max(0, f.y1 - 8)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+    return vis
+
+# -------------------------
+# Runner
+# -------------------------
+
+class OfflineRecognizer:
+    def __init__(self, detector, embedder, matcher, batch_frames: int = 8, max_faces: int = 10,
+                 batch_detect: bool = False):
+        """batch_detect: detect each batch with detector.detect_batch in _flush (stills only, no tracking)."""
+        self.detector = detector
+        self.batch_detect = bool(batch_detect)
+        self.embedder = embedder
+        self.matcher = matcher
+        self.batch_frames = max(1, int(batch_frames))
+        self.max_faces = int(max_faces)
+        self.frames = 0
+        self.faces = 0
+        self._size = None  # annotated video (w, h), from the first frame
+        self.aligner = FaceAligner(capacity=self.batch_frames * 2)
+
+    def _flush(self, batch: List[FramePacket], source, out: TextIO, writer: Optional[cv2.VideoWriter],
+               stats: dict):
+        if self.batch_detect:
+            t0 = time.perf_counter()
+            found = self.detector.detect_batch([p.frame for p in batch], max_faces=self.max_faces)
+            for p, faces in zip(batch, found):
+                p.data["faces"] = faces
+            stats["detect_batch"].add((time.perf_counter() - t0) * 1000.0)
+
+        # every face of every frame in the batch -> one embed_batch + one match_batch
+        t0 = time.perf_counter()
+        total = sum(len(p.data["faces"]) for p in batch)
+        buf = self.aligner.reserve(total)
+        k = 0
+        for p in batch:
+            n = len(p.data["faces"])
+            align_faces_5pt(p.frame, [f.kps for f in p.data["faces"]], out=buf[k:k + n])
+            k += n
+        matches = self.matcher.match_batch(self.embedder.embed_batch(buf[:total])) if total else []
+        stats["embed_match"].add((time.perf_counter() - t0) * 1000.0)
+
+        k = 0
+        for p in batch:
+            faces = p.data["faces"]
+            mrs = matches[k:k + len(faces)]
+            k += len(faces)
+            rec = {"frame": p.seq, **source.describe(p.seq),
+                   "faces": [_face_record(f, mr) for f, mr in zip(faces, mrs)]}
+            out.write(json.dumps(rec) + "\n")
+            if writer is not None:
+                vis = draw_results(p.frame, faces, mrs)
+                if (vis.shape[1], vis.shape[0]) != self._size:
+                    vis = cv2.resize(vis, self._size)
+                writer.write(vis)
+            self.faces += len(faces)
+            stats["end_to_end"].add((time.perf_counter() - p.t_capture) * 1000.0)
+        self.frames += len(batch)
+
+    def run(self, source, output: Path, annotate: Optional[Path] = None, queue_size: int = 8) -> None:
+        def stage_detect(pkt: FramePacket) -> FramePacket:
+            pkt.data["faces"] = self.detector.detect(pkt.frame, max_faces=self.max_faces)
+            return pkt
+
+        stages = [] if self.batch_detect else [("detect", stage_detect)]
+        pipe = FramePipeline(source, stages, queue_size=queue_size, realtime=False)
+        # no render stage here; (batch detect +) embed + match + write run on this thread instead
+        e2e = pipe.stats.pop("end_to_end")
+        pipe.stats.pop("render")
+        if self.batch_detect:
+            pipe.stats["detect_batch"] = StageStats("detect_batch")
+        pipe.stats["embed_match"] = StageStats("embed_match")
+        pipe.stats["end_to_end"] = e2e
+        writer: Optional[cv2.VideoWriter] = None
+        output.parent.mkdir(parents=True, exist_ok=True)
+
+        t0 = time.perf_counter()
+        t_report = t0
+        batch: List[FramePacket] = []
+        pipe.start()
+        try:
+            with open(output, "w", encoding="utf-8") as out:
+                while True:
+                    try:
+                        pkt = pipe.get(timeout=0.5)
+                    except StopIteration:
+                        break
+                    if pkt is None:
+                        continue
+
+                    if annotate is not None and writer is None:
+                        h, w = pkt.frame.shape[:2]
+                        self._size = (w, h)
+                        annotate.parent.mkdir(parents=True, exist_ok=True)
+                        writer = cv2.VideoWriter(str(annotate), cv2.VideoWriter_fourcc(*"mp4v"), source.fps, self._size)
+
+                    batch.append(pkt)
+                    if len(batch) >= self.batch_frames:
+                        self._flush(batch, source, out, writer, pipe.stats)
+                        batch = []
+
+                    now = time.perf_counter()
+                    if now - t_report >= 5.0:
+                        t_report = now
+                        fps = self.frames / (now - t0)
+                        total = f"/{source.frame_count}" if source.frame_count else ""
+                        print(f"[offline] {self.frames}{total} frames  {fps:.1f} fps  "
+                              f"({fps / source.fps:.1f}x real time)")
+                if batch:
+                    self._flush(batch, source, out, writer, pipe.stats)
+        finally:
+            pipe.stop()
+            source.release()
+            if writer is not None:
+                writer.release()
+
+        dt = time.perf_counter() - t0
+        fps = self.frames / dt if dt > 0 else 0.0
+        print(f"[offline] ✅ {self.frames} frames, {self.faces} faces in {dt:.1f}s "
+              f"({fps:.1f} fps, {fps / source.fps:.1f}x real time) -> {output}")
+        if annotate is not None:
+            print(f"[offline] annotated video -> {annotate}")
+        print(pipe.format_stats())
+        print(PROFILER.format())
+
+def run_offline(input_path: Path, output: Path, annotate: Optional[Path], detector, embedder, matcher,
+                detect_every: int = 5, batch_frames: int = 8) -> None:
+    """
+    Video: detector wrapped in FaceTracker (detect_every). Folder: every image detected,
+    batch_frames images per detect_batch call when the detector batches (YuNetDetector).
+    """
+    batch_detect = False
+    if input_path.is_dir():
+        source = ImageFolderSource(input_path)
+        det = detector  # unrelated stills: nothing to track between them
+        batch_detect = getattr(detector, "batched", False)
+    else:
+        source = VideoFileSource(input_path)
+        det = FaceTracker(detector, detect_every=detect_every)
+    OfflineRecognizer(det, embedder, matcher, batch_frames=batch_frames,
+                      batch_detect=batch_detect).run(source, output, annotate)
@@ -0,0 +1,246 @@
+# src/pipeline.py
+"""
+Threaded frame pipeline:
+capture thread -> stage threads (e.g. detect -> embed -> match) -> render (caller's thread)
+
+- Capture runs on its own thread and keeps ONLY the newest frame, so a slow
+  stage never lets stale frames pile up in the camera driver buffer.
+- Stages are connected by small bounded queues with a drop-oldest policy.
+- Every stage reports rolling latency (mean / p50 / p95) and drop counts.
+- Rendering (imshow / waitKey) stays on the calling thread, as HighGUI requires.
+
+A stage is any callable FramePacket -> Optional[FramePacket]; returning None
+drops the packet. Existing frame -> frame functions (e.g.
+FaceLockingSystem.process_frame) plug in through frame_stage().
+
+Usage:
+    pipe = FramePipeline(cv2.VideoCapture(0), [("process", frame_stage(system.process_frame))])
+    pipe.run(render_fn)   # render_fn(packet) -> False to stop
+"""
+
+from __future__ import annotations
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# -------------------------
+# Data
+# -------------------------
+
+@dataclass
+class FramePacket:
+    seq: int
+    t_capture: float
+    frame: np.ndarray
+    data: Dict[str, Any] = field(default_factory=dict)  # per-stage results
+    output: Optional[np.ndarray] = None                  # frame to display
+
+StageFn = Callable[[FramePacket], Optional[FramePacket]]
+
+_EOS = object()  # end-of-stream marker
+
+def frame_stage(fn: Callable[[np.ndarray], np.ndarray]) -> StageFn:
+    """Adapt a frame -> annotated frame function into a pipeline stage."""
+    def _stage(pkt: FramePacket) -> FramePacket:
+        pkt.output = fn(pkt.frame)
+        return pkt
+    return _stage
+
+# -------------------------
+# Queue + stats
+# -------------------------
+
+class DropOldestQueue:
+    """
+    Bounded FIFO. put() on a full queue discards the oldest item (block=False)
+    or waits for room (block=True, used for files where every frame matters).
+    """
+    def __init__(self, maxsize: int = 2):
+        self.maxsize = max(1, int(maxsize))
+        self.dropped = 0
+        self._q: Deque[Any] = deque()
+        self._cv = threading.Condition()
+
+    def put(self, item: Any, block: bool = False, stop: Optional[threading.Event] = None) -> None:
+        with self._cv:
+            if block:
+                while len(self._q) >= self.maxsize and not (stop is not None and stop.is_set()):
+                    self._cv.wait(0.05)
+            elif len(self._q) >= self.maxsize:
+                self._q.popleft()
+                self.dropped += 1
+            self._q.append(item)
+            self._cv.notify_all()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """Next item, or None on timeout."""
+        with self._cv:
+            if not self._cv.wait_for(lambda: len(self._q) > 0, timeout):
+                return None
+            item = self._q.popleft()
+            self._cv.notify_all()
+            return item
+
+    def __len__(self) -> int:
+        return len(self._q)
+
+class StageStats:
+    """Rolling latency window (milliseconds) for one stage."""
+    def __init__(self, name: str, window: int = 240):
+        self.name = name
+        self.count = 0
+        self._ms: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, ms: float) -> None:
+        with self._lock:
+            self._ms.append(float(ms))
+            self.count += 1
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            a = np.array(self._ms, dtype=np.float64)
+        if a.size == 0:
+            return {"n": float(self.count), "mean": 0.0, "p50": 0.0, "p95": 0.0}
+        return {
+            "n": float(self.count),
+            "mean": float(a.mean()),
+            "p50": float(np.percentile(a, 50)),
+            "p95": float(np.percentile(a, 95)),
+        }
+
+# -------------------------
+# Pipeline
+# -------------------------
+
+class FramePipeline:
+    def __init__(
+        self,
+        source,
+        stages: List[Tuple[str, StageFn]],
+        queue_size: int = 2,
+        realtime: bool = True,
+    ):
+        """
+        source: anything with read() -> (ok, frame), e.g. cv2.VideoCapture.
+        realtime=True : live camera, capture keeps only the newest frame and
+                        full queues drop their oldest packet.
+        realtime=False: video file, nothing is dropped; capture waits instead.
+        """
+        self.source = source
+        self.stage_defs = list(stages)
+        self.realtime = bool(realtime)
+
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        # capture -> q[0] -> stage 0 -> q[1] -> ... -> q[n] -> render
+        cap_q = DropOldestQueue(1 if realtime else queue_size)
+        self._queues = [cap_q] + [DropOldestQueue(queue_size) for _ in self.stage_defs]
+
+        self.stats: Dict[str, StageStats] = {"capture": StageStats("capture")}
+        for name, _ in self.stage_defs:
+            self.stats[name] = StageStats(name)
+        self.stats["render"] = StageStats("render")
+        self.stats["end_to_end"] = StageStats("end_to_end")
+
+    # ---- threads ----
+
+    def _capture_loop(self):
+        q = self._queues[0]
+        seq = 0
+        st = self.stats["capture"]
+        while not self._stop.is_set():
+            t0 = time.perf_counter()
+            ok, frame = self.source.read()
+            if not ok:
+                break
+            st.add((time.perf_counter() - t0) * 1000.0)
+            q.put(FramePacket(seq=seq, t_capture=t0, frame=frame), block=not self.realtime, stop=self._stop)
+            seq += 1
+        q.put(_EOS, block=True, stop=self._stop)
+
+    def _stage_loop(self, idx: int, name: str, fn: StageFn):
+        q_in = self._queues[idx]
+        q_out = self._queues[idx + 1]
+        st = self.stats[name]
+        while not self._stop.is_set():
+            pkt = q_in.get(timeout=0.1)
+            if pkt is None:
+                continue
+            if pkt is _EOS:
+                q_out.put(_EOS, block=True, stop=self._stop)
+                return
+            t0 = time.perf_counter()
+            out = fn(pkt)
+            st.add((time.perf_counter() - t0) * 1000.0)
+            if out is not None:
+                q_out.put(out, block=not self.realtime, stop=self._stop)
+
+    def start(self) -> "FramePipeline":
+        t = threading.Thread(target=self._capture_loop, name="pipeline-capture", daemon=True)
+        self._threads.append(t)
+        for i, (name, fn) in enumerate(self.stage_defs):
+            self._threads.append(threading.Thread(
+                target=self._stage_loop, args=(i, name, fn), name=f"pipeline-{name}", daemon=True))
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads.clear()
+
+    # ---- consumer side ----
+
+    def get(self, timeout: Optional[float] = 0.5) -> Optional[FramePacket]:
+        """Next finished packet, None on timeout. Raises StopIteration at end of stream."""
+        pkt = self._queues[-1].get(timeout=timeout)
+        if pkt is _EOS:
+            raise StopIteration
+        return pkt
+
+    def run(self, render: Callable[[FramePacket], bool]) -> None:
+        """
+        Start, then call render(packet) on this thread for each finished packet
+        until it returns False or the stream ends. Always stops the threads.
+        """
+        self.start()
+        try:
+            while True:
+                try:
+                    pkt = self.get(timeout=0.5)
+                except StopIteration:
+                    break
+                if pkt is None:
+                    continue
+                t0 = time.perf_counter()
+                keep_going = render(pkt)
+                t1 = time.perf_counter()
+                self.stats["render"].add((t1 - t0) * 1000.0)
+                self.stats["end_to_end"].add((t1 - pkt.t_capture) * 1000.0)
+                if keep_going is False:
+                    break
+        finally:
+            self.stop()
+
+    # ---- reporting ----
+
+    def dropped(self) -> Dict[str, int]:
+        names = ["capture"] + [n for n, _ in self.stage_defs]
+        return {n: q.dropped for n, q in zip(names, self._queues)}
+
+    def format_stats(self) -> str:
+        drops = self.dropped()
+        lines = [f"{'stage':<12}{'n':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'dropped':>9}"]
+        for name, st in self.stats.items():
+            s = st.summary()
+            d = drops.get(name, "")
+            lines.append(f"{name:<12}{int(s['n']):>7}{s['mean']:>10.2f}{s['p50']:>10.2f}{s['p95']:>10.2f}{d!s:>9}")
+        return "\n".join(lines)
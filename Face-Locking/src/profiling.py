@@ -0,0 +1,224 @@
+# src/profiling.py
+"""
+Per-stage latency profiler for the face pipeline.
+
+Timing hooks are built into the pipeline code:
+    haar        Haar cascade detectMultiScale      (haar_5pt.py, recognize.py)
+    facemesh    FaceMesh ROI / frame pass          (haar_5pt.py, recognize.py)
+    align       align_face_5pt                     (haar_5pt.py)
+    preprocess  preprocess_into (BGR -> NCHW)      (embed.py)
+    onnx_run    sess.run of the embedder           (embed.py, recognize.py)
+    yunet       YuNet forward pass (per batch)     (detectors.py)
+    match       FaceDBMatcher.match, one per face  (recognize.py)
+    match_batch FaceDBMatcher.match_batch, one per batch (recognize.py)
+
+Every stage keeps a rolling window of the last `window` samples; summaries
+report n / mean / p50 / p95 / p99 in milliseconds, plus total: the sum of
+all n samples (the window only bounds the percentiles).
+
+Events are plain counters next to the stages (PROFILER.count), e.g.
+    landmark_fallback   5pt estimated from the Haar box: MediaPipe missing or found no face
+
+Surfaces:
+- PROFILER.format()                      table (recognize 'l', face_locking 's')
+- PROFILER.to_json() / to_prometheus()   snapshot as JSON / Prometheus text format
+- start_exporter_from_env()              periodic files, configured by env:
+    FACE_PROFILE=0                 disable all hooks (near-zero overhead)
+    FACE_PROFILE_JSON=path.json    write a JSON snapshot every FACE_PROFILE_EVERY s
+    FACE_PROFILE_PROM=path.prom    Prometheus textfile (node_exporter textfile collector)
+    FACE_PROFILE_EVERY=10
+"""
+
+from __future__ import annotations
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Deque, Dict, Iterator, Optional
+
+import numpy as np
+
+# -------------------------
+# Profiler
+# -------------------------
+
+class StageProfiler:
+    def __init__(self, window: int = 2000, enabled: bool = True):
+        self.window = int(window)
+        self.enabled = bool(enabled)
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._totals: Dict[str, float] = {}
+        self._events: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def record(self, stage: str, ms: float) -> None:
+        with self._lock:
+            buf = self._samples.get(stage)
+            if buf is None:
+                buf = self._samples[stage] = deque(maxlen=self.window)
+                self._counts[stage] = 0
+                self._totals[stage] = 0.0
+            buf.append(float(ms))
+            self._counts[stage] += 1
+            self._totals[stage] += float(ms)
+
+    def count(self, event: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._events[event] = self._events.get(event, 0) + int(n)
+
+    def events(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._events)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - t0) * 1000.0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._totals.clear()
+            self._events.clear()
+            self.started = time.time()
+
+    # ---- reporting ----
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            snap = {k: (np.array(v, dtype=np.float64), self._counts[k], self._totals[k])
+                    for k, v in self._samples.items()}
+        out: Dict[str, Dict[str, float]] = {}
+        for stage, (a, n, total) in snap.items():
+            if a.size == 0:
+                continue
+            p50, p95, p99 = np.percentile(a, [50, 95, 99])
+            out[stage] = {"n": n, "mean": float(a.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99),
+                          "total": total}
+        return out
+
+    def format(self) -> str:
+        lines = [f"{'stage':<12}{'n':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for stage, s in self.summary().items():
+            lines.append(f"{stage:<12}{int(s['n']):>8}{s['mean']:>10.2f}{s['p50']:>10.2f}"
+                         f"{s['p95']:>10.2f}{s['p99']:>10.2f}")
+        events = self.events()
+        if events:
+            lines.append(f"{'event':<20}{'count':>8}")
+            lines += [f"{event:<20}{n:>8}" for event, n in events.items()]
+        return "\n".join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps({"timestamp": time.time(), "uptime_s": time.time() - self.started,
+                           "stages_ms": self.summary(), "events": self.events()}, indent=2)
+
+    def to_prometheus(self, prefix: str = "face_pipeline") -> str:
+        """Prometheus text exposition format, one summary metric over all stages."""
+        name = f"{prefix}_stage_latency_seconds"
+        lines = [f"# HELP {name} Per-stage latency over the last window of samples.",
+                 f"# TYPE {name} summary"]
+        for stage, s in self.summary().items():
+            for q, label in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                lines.append(f'{name}{{stage="{stage}",quantile="{label}"}} {s[q] / 1000.0:.6g}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {s["total"] / 1000.0:.6g}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {int(s["n"])}')
+        events = self.events()
+        if events:
+            ev = f"{prefix}_events_total"
+            lines += [f"# HELP {ev} Pipeline events (e.g. landmark fallbacks) since start.", f"# TYPE {ev} counter"]
+            lines += [f'{ev}{{event="{e}"}} {n}' for e, n in events.items()]
+        return "\n".join(lines) + "\n"
+
+PROFILER = StageProfiler(enabled=os.environ.get("FACE_PROFILE", "1") != "0")
+
+def profiled(stage: str):
+    """Decorator: time every call of the function as `stage` on PROFILER."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                PROFILER.record(stage, (time.perf_counter() - t0) * 1000.0)
+        return wrapper
+    return deco
+
+# -------------------------
+# Periodic export
+# -------------------------
+
+def _write_atomic(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+class MetricsExporter:
+    """Writes JSON and/or Prometheus snapshots of a profiler every interval_s (daemon thread)."""
+    def __init__(self, profiler: StageProfiler, json_path: Optional[Path] = None,
+                 prom_path: Optional[Path] = None, interval_s: float = 10.0):
+        self.profiler = profiler
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.interval_s = float(interval_s)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write_now(self) -> None:
+        if self.json_path is not None:
+            _write_atomic(self.json_path, self.profiler.to_json())
+        if self.prom_path is not None:
+            _write_atomic(self.prom_path, self.profiler.to_prometheus())
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.write_now()
+            except OSError as e:
+                print(f"[profiling] export failed: {e}")
+
+    def start(self) -> "MetricsExporter":
+        self._thread = threading.Thread(target=self._loop, name="metrics-export", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        self.write_now()  # final snapshot
+
+def start_exporter_from_env() -> Optional[MetricsExporter]:
+    """MetricsExporter for FACE_PROFILE_JSON / FACE_PROFILE_PROM, or None if neither is set."""
+    json_path = os.environ.get("FACE_PROFILE_JSON")
+    prom_path = os.environ.get("FACE_PROFILE_PROM")
+    if not (json_path or prom_path) or not PROFILER.enabled:
+        return None
+    exp = MetricsExporter(
+        PROFILER,
+        json_path=Path(json_path) if json_path else None,
+        prom_path=Path(prom_path) if prom_path else None,
+        interval_s=float(os.environ.get("FACE_PROFILE_EVERY", "10")),
+    )
+    print(f"[profiling] exporting stage latencies every {exp.interval_s:.0f}s "
+          f"to {', '.join(str(p) for p in (exp.json_path, exp.prom_path) if p)}")
+    return exp.start()
@@ -0,0 +1,224 @@
+# src/quantize.py
+"""
+quantize.py
+
+Build an INT8 (dynamic or static) or FP16 copy of the ArcFace embedder and
+only keep it if recognition quality holds up.
+
+Steps:
+1) quantize models/embedder_arcface.onnx into a temp file
+   - dynamic: weights INT8, activations quantized at runtime (no calibration)
+   - static : weights + activations INT8 (QDQ), calibrated on enrollment crops
+   - fp16   : weights FP16, float32 I/O kept (needs onnxconverter-common)
+2) run the genuine/impostor analysis of evaluate.py with BOTH models
+3) compare FAR/FRR at the recognition threshold; if either regresses past
+   its tolerance the candidate is deleted and nothing is written
+
+On success the model is saved next to the original, e.g.
+models/embedder_arcface.int8.onnx. Load it with
+OrtSessionConfig(model_variant="int8") or FACE_MODEL_VARIANT=int8.
+
+Run:
+    python -m src.quantize
+    python -m src.quantize --mode static --calib-per-person 40
+    python -m src.quantize --mode fp16 --max-frr-increase 0.01
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .embed import (
+    ArcFaceEmbedderONNX, OrtSessionConfig, preprocess_into, variant_path,
+)
+from .evaluate import EvalConfig, far_frr_at, genuine_impostor, load_all_embeddings
+
+# -------------------------
+# Config
+# -------------------------
+
+@dataclass
+class QuantizeConfig:
+    model_path: Path = Path("models/embedder_arcface.onnx")
+    mode: str = "dynamic"  # dynamic | static | fp16
+
+    # calibration (static only)
+    calib_per_person: int = 30
+
+    # accuracy gate: recognition threshold (distance) and allowed regressions
+    dist_thresh: float = 0.34
+    max_far_increase: float = 0.005  # absolute, 0.5 percentage points
+    max_frr_increase: float = 0.02   # absolute, 2 percentage points
+
+    eval: EvalConfig = field(default_factory=EvalConfig)
+
+    @property
+    def variant(self) -> str:
+        return "fp16" if self.mode == "fp16" else "int8"
+
+    @property
+    def out_path(self) -> Path:
+        return variant_path(str(self.model_path), self.variant)
+
+# -------------------------
+# Calibration
+# -------------------------
+
+def iter_calibration_crops(enroll_dir: Path, per_person: int) -> Iterator[np.ndarray]:
+    """Aligned 112x112 crops from data/enroll/<name>/*.jpg, up to per_person each."""
+    for pdir in sorted(p for p in enroll_dir.iterdir() if p.is_dir()):
+        for img_path in sorted(pdir.glob("*.jpg"))[:per_person]:
+            img = cv2.imread(str(img_path))
+            if img is not None:
+                yield img
+
+def _calibration_reader(cfg: QuantizeConfig, input_name: str):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class EnrollCropReader(CalibrationDataReader):
+        """Feeds enrollment crops through the same preprocessing as the embedder."""
+
+        def __init__(self):
+            self._crops = iter_calibration_crops(cfg.eval.enroll_dir, cfg.calib_per_person)
+            self._buf = np.empty((1, 3, 112, 112), dtype=np.float32)
+
+        def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+            img = next(self._crops, None)
+            if img is None:
+                return None
+            return {input_name: preprocess_into([img], self._buf).copy()}
+
+    return EnrollCropReader()
+
+# -------------------------
+# Quantization
+# -------------------------
+
+def build_candidate(cfg: QuantizeConfig, out_path: Path) -> None:
+    src = str(cfg.model_path)
+
+    if cfg.mode == "dynamic":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(src, str(out_path), weight_type=QuantType.QInt8)
+
+    elif cfg.mode == "static":
+        import onnxruntime as ort
+        from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+        input_name = ort.InferenceSession(src, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+        quantize_static(
+            src,
+            str(out_path),
+            _calibration_reader(cfg, input_name),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+
+    elif cfg.mode == "fp16":
+        try:
+            import onnx
+            from onnxconverter_common import float16
+        except ImportError as e:
+            raise RuntimeError("FP16 conversion needs: pip install onnx onnxconverter-common") from e
+        model = onnx.load(src)
+        onnx.save(float16.convert_float_to_float16(model, keep_io_types=True), str(out_path))
+
+    else:
+        raise ValueError(f"Unknown mode: {cfg.mode!r} (dynamic | static | fp16)")
+
+# -------------------------
+# Accuracy gate
+# -------------------------
+
+def far_frr_for_model(model_path: Path, cfg: QuantizeConfig) -> Tuple[float, float]:
+    embedder = ArcFaceEmbedderONNX(
+        model_path=str(model_path),
+        input_size=(112, 112),
+        max_batch=cfg.eval.batch_size,
+        session_cfg=OrtSessionConfig(),
+    )
+    per_person = load_all_embeddings(embedder, cfg.eval, verbose=False)
+    if len(per_person) < 2:
+        raise RuntimeError("Need at least 2 enrolled people with crops to measure FAR/FRR.")
+    genuine, impostor = genuine_impostor(per_person)
+    return far_frr_at(genuine, impostor, cfg.dist_thresh)
+
+def _bench_ms(model_path: Path, n: int = 50) -> float:
+    embedder = ArcFaceEmbedderONNX(model_path=str(model_path), session_cfg=OrtSessionConfig())
+    img = np.full((112, 112, 3), 127, dtype=np.uint8)
+    embedder.embed(img)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        embedder.embed(img)
+    return (time.perf_counter() - t0) / n * 1000.0
+
+# -------------------------
+# Main
+# -------------------------
+
+def main():
+    cfg = QuantizeConfig()
+
+    ap = argparse.ArgumentParser(description="Quantize the ArcFace embedder with an accuracy gate.")
+    ap.add_argument("--model", type=Path, default=cfg.model_path)
+    ap.add_argument("--mode", choices=("dynamic", "static", "fp16"), default=cfg.mode)
+    ap.add_argument("--calib-per-person", type=int, default=cfg.calib_per_person)
+    ap.add_argument("--thr", type=float, default=cfg.dist_thresh, help="recognition distance threshold")
+    ap.add_argument("--max-far-increase", type=float, default=cfg.max_far_increase)
+    ap.add_argument("--max-frr-increase", type=float, default=cfg.max_frr_increase)
+    args = ap.parse_args()
+
+    cfg.model_path = args.model
+    cfg.mode = args.mode
+    cfg.calib_per_person = args.calib_per_person
+    cfg.dist_thresh = args.thr
+    cfg.max_far_increase = args.max_far_increase
+    cfg.max_frr_increase = args.max_frr_increase
+
+    if not cfg.model_path.exists():
+        raise FileNotFoundError(f"Model not found: {cfg.model_path}")
+
+    out_path = cfg.out_path
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+
+    print(f"[quantize] {cfg.model_path} -> {out_path} ({cfg.mode})")
+    build_candidate(cfg, tmp_path)
+
+    try:
+        far0, frr0 = far_frr_for_model(cfg.model_path, cfg)
+        far1, frr1 = far_frr_for_model(tmp_path, cfg)
+
+        print(f"\n=== Accuracy at thr(dist)={cfg.dist_thresh:.2f} ===")
+        print(f"fp32      : FAR={far0*100:5.2f}%  FRR={frr0*100:5.2f}%")
+        print(f"{cfg.variant:<10}: FAR={far1*100:5.2f}%  FRR={frr1*100:5.2f}%")
+
+        far_ok = (far1 - far0) <= cfg.max_far_increase
+        frr_ok = (frr1 - frr0) <= cfg.max_frr_increase
+        if not (far_ok and frr_ok):
+            print(f"\n❌ Rejected: FAR +{(far1-far0)*100:.2f}pp (max {cfg.max_far_increase*100:.2f}), "
+                  f"FRR +{(frr1-frr0)*100:.2f}pp (max {cfg.max_frr_increase*100:.2f}). Nothing written.")
+            raise SystemExit(1)
+
+        ms0 = _bench_ms(cfg.model_path)
+        ms1 = _bench_ms(tmp_path)
+        print(f"\nLatency per face: fp32 {ms0:.2f} ms  ->  {cfg.variant} {ms1:.2f} ms  ({ms0 / max(ms1, 1e-6):.2f}x)")
+
+        os.replace(tmp_path, out_path)
+        print(f"\n✅ Saved {out_path}")
+        print(f"Use it with FACE_MODEL_VARIANT={cfg.variant} (or OrtSessionConfig(model_variant=\"{cfg.variant}\")).")
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+if __name__ == "__main__":
+    main()
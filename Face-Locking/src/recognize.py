@@ -1,33 +1,42 @@
 # src/recognize.py
 """
 Multi-face recognition (CPU-friendly) using your stable pipeline:
-Haar (multi-face) -> FaceMesh 5pt (per-face ROI) -> align_face_5pt (112x112)
+Haar (multi-face) -> FaceMesh 5pt -> align_face_5pt (112x112)
 -> ArcFace ONNX embedding -> cosine distance to DB -> label each face.
 
 Run: python -m src.recognize
+Headless (video file or image folder, see src/offline.py):
+     python -m src.recognize --input clip.mp4 --output results.jsonl [--annotate out.mp4]
 
 Keys:
 q : quit
-r : reload DB from disk (data/db/face_db.npz)
+r : force a DB reload (it also reloads by itself when enroll writes the DB)
 +/- : adjust threshold (distance) live
 d : toggle debug overlay
+l : print per-stage pipeline latency + p50/p95/p99 per pipeline step (src/profiling.py)
 
 Notes:
-- FaceMesh is run on EACH Haar face ROI (not the full frame)
-- DB expected from enroll: data/db/face_db.npz
+- capture / detect / embed / match run on separate threads (src/pipeline.py);
+  only the newest camera frame is processed
+- FaceMesh runs once on the full frame and its faces are matched to the Haar
+  boxes (--landmarks frame); --landmarks track / roi run it per face ROI instead
+- DB expected from enroll: data/db/face_db.npz or the memory-mapped
+  data/db/face_db.emb (src/facedb.py), which is preferred when present
+- FACE_PROFILE_JSON / FACE_PROFILE_PROM export the step latencies periodically
 - Distance = 1 - cosine_similarity. Embeddings are L2-normalized.
 """
 
 from __future__ import annotations
+import argparse
 import time
 import json
+import threading
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
-import onnxruntime as ort
 
 try:
     import mediapipe as mp
@@ -35,7 +44,14 @@ except Exception as e:
     mp = None
     _MP_IMPORT_ERROR = e
 
-from .haar_5pt import align_face_5pt
+from .haar_5pt import AdaptiveHaar, AdaptiveHaarConfig, align_faces_5pt
+from .facedb import FaceDB, resolve_db_path
+from .index import DEFAULT_N_PROBE, INDEX_KINDS, build_index, index_path_for, topk_rows
+from . import registry
+from .embed import OrtSessionConfig, preprocess_into
+from .pipeline import FramePacket, FramePipeline
+from .profiling import PROFILER, profiled, start_exporter_from_env
+from .track import FaceTracker, box_iou
 
 # -------------------------
 # Data
@@ -49,6 +65,7 @@ class FaceDet:
     y2: int
     score: float
     kps: np.ndarray  # (5,2) float32 in FULL-frame coords
+    track_id: int = -1  # set by FaceTracker
 
 @dataclass
 class MatchResult:
@@ -122,9 +139,20 @@ def load_db_npz(db_path: Path) -> Dict[str, np.ndarray]:
     data = np.load(str(db_path), allow_pickle=True)
     out: Dict[str, np.ndarray] = {}
     for k in data.files:
-        out[k] = np.asarray(data[k], dtype=np.float32).reshape(-1)
+        arr = np.asarray(data[k], dtype=np.float32)
+        # (D,) single template, (K, D) multi-template identity
+        out[k] = arr if arr.ndim == 2 else arr.reshape(-1)
     return out
 
+def load_db(db_path: Path):
+    """
+    face_db.emb -> FaceDB (zero-copy memmap), anything else -> load_db_npz.
+    Both behave as name -> (D,) / (K, D) mappings.
+    """
+    if db_path.suffix == ".emb":
+        return FaceDB(db_path) if FaceDB.exists_at(db_path) else {}
+    return load_db_npz(db_path)
+
 # -------------------------
 # Embedder
 # -------------------------
@@ -134,33 +162,38 @@ class ArcFaceEmbedderONNX:
     ArcFace-style ONNX embedder.
     Input: 112x112 BGR -> internally RGB + (x-127.5)/128, NCHW float32
     Output: (D,)
+
+    Preprocessing writes into a reusable (max_batch,3,H,W) buffer owned by
+    the embedder, so an instance must not be shared between threads.
     """
     def __init__(self, model_path: str = "models/embedder_arcface.onnx",
                  input_size: Tuple[int,int] = (112,112),
+                 max_batch: int = 8,
+                 session_cfg: Optional[OrtSessionConfig] = None,
                  debug: bool = False):
         self.model_path = model_path
         self.in_w, self.in_h = int(input_size[0]), int(input_size[1])
         self.debug = bool(debug)
 
-        self.sess = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.sess = registry.get_session(model_path, session_cfg)  # shared per process
         self.in_name = self.sess.get_inputs()[0].name
         self.out_name = self.sess.get_outputs()[0].name
 
+        # Some exported ArcFace graphs pin the batch axis to 1; those can only run face-by-face.
+        batch_dim = self.sess.get_inputs()[0].shape[0]
+        self.fixed_batch = isinstance(batch_dim, int) and batch_dim == 1
+        self.max_batch = 1 if self.fixed_batch else max(1, int(max_batch))
+
+        self._buf = np.empty((self.max_batch, 3, self.in_h, self.in_w), dtype=np.float32)
+
         if self.debug:
             print("[embed] model:", model_path)
             print("[embed] input:", self.in_name, self.sess.get_inputs()[0].shape)
             print("[embed] output:", self.out_name, self.sess.get_outputs()[0].shape)
 
     def _preprocess(self, aligned_bgr_112: np.ndarray) -> np.ndarray:
-        img = aligned_bgr_112
-        if img.shape[1] != self.in_w or img.shape[0] != self.in_h:
-            img = cv2.resize(img, (self.in_w, self.in_h), interpolation=cv2.INTER_LINEAR)
-        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float32)
-        rgb = (rgb - 127.5) / 128.0
-        # Change (H, W, C) to (C, H, W)
-        rgb = np.transpose(rgb, (2, 0, 1))
-        x = rgb[None, ...]
-        return x.astype(np.float32)
+        # NOTE: returns a view of the shared input buffer
+        return preprocess_into([aligned_bgr_112], self._buf, (self.in_w, self.in_h))
 
     @staticmethod
     def _l2_normalize(v: np.ndarray, eps: float = 1e-12) -> np.ndarray:
@@ -168,51 +201,88 @@ class ArcFaceEmbedderONNX:
         n = float(np.linalg.norm(v) + eps)
         return (v / n).astype(np.float32)
 
+    @staticmethod
+    def _l2_normalize_rows(m: np.ndarray, eps: float = 1e-12) -> np.ndarray:
+        m = m.astype(np.float32).reshape(m.shape[0], -1)
+        n = np.linalg.norm(m, axis=1, keepdims=True) + eps
+        return (m / n).astype(np.float32)
+
     def embed(self, aligned_bgr_112: np.ndarray) -> np.ndarray:
         x = self._preprocess(aligned_bgr_112)
-        y = self.sess.run([self.out_name], {self.in_name: x})[0]
+        with PROFILER.time("onnx_run"):
+            y = self.sess.run([self.out_name], {self.in_name: x})[0]
         emb = np.asarray(y, dtype=np.float32).reshape(-1)
         return self._l2_normalize(emb)
 
+    def embed_batch(self, aligned_list: List[np.ndarray]) -> np.ndarray:
+        """
+        Embed several aligned crops, max_batch crops per sess.run.
+        Returns (N, D) float32, each row L2-normalized. N=0 -> (0, 0).
+        """
+        if len(aligned_list) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        outs: List[np.ndarray] = []
+        for s in range(0, len(aligned_list), self.max_batch):
+            chunk = aligned_list[s:s + self.max_batch]
+            x = preprocess_into(chunk, self._buf, (self.in_w, self.in_h))
+            with PROFILER.time("onnx_run"):
+                y = self.sess.run([self.out_name], {self.in_name: x})[0]
+            outs.append(np.asarray(y, dtype=np.float32).reshape(len(chunk), -1))
+        Y = outs[0] if len(outs) == 1 else np.concatenate(outs, axis=0)
+        return self._l2_normalize_rows(Y)
+
 # -------------------------
 # Multi-face Haar + FaceMesh(ROI) 5pt
 # -------------------------
 
+# landmark_mode of HaarFaceMesh5pt:
+#   frame : ONE FaceMesh pass over the full frame (max_num_faces=max_faces, tracking on),
+#           results associated to Haar boxes; boxes left without a mesh face get the ROI pass
+#   track : one tracking FaceMesh per face slot (a slot follows a Haar box by IoU),
+#           run on that face's ROI, so each mesh only ever sees one person
+#   roi   : a static-image FaceMesh on every Haar ROI (no state to clobber)
+LANDMARK_MODES = ("frame", "track", "roi")
+
+@dataclass
+class _MeshSlot:
+    mesh: Any
+    roi: Tuple[int, int, int, int]  # last ROI xyxy this slot's mesh tracked
+    missed: int = 0
+
 class HaarFaceMesh5pt:
     def __init__(self, haar_xml: Optional[str] = None,
                  min_size: Tuple[int,int] = (70,70),
-                 debug: bool = False):
+                 debug: bool = False,
+                 landmark_mode: str = "frame",
+                 max_faces: int = 5,
+                 adaptive: Optional[AdaptiveHaarConfig] = None):
+        if landmark_mode not in LANDMARK_MODES:
+            raise ValueError(f"Unknown landmark_mode: {landmark_mode!r} (expected one of {LANDMARK_MODES})")
         self.debug = bool(debug)
         self.min_size = tuple(map(int, min_size))
+        self.landmark_mode = landmark_mode
+        self.max_faces = int(max_faces)
 
-        if haar_xml is None:
-            haar_xml = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-        self.face_cascade = cv2.CascadeClassifier(haar_xml)
-        if self.face_cascade.empty():
-            raise RuntimeError(f"Failed to load Haar cascade: {haar_xml}")
+        # cascade + static ROI FaceMesh are shared with every other detector in this process
+        self.face_cascade = registry.get_cascade(haar_xml)
+        # adaptive=None: full-resolution search on every detect()
+        self.adaptive = AdaptiveHaar(self.face_cascade, self.min_size, adaptive, debug=self.debug) if adaptive else None
 
         if mp is None:
             print("⚠️  MediaPipe not available, using geometric estimation fallback")
-            self.mesh = None
-            self._use_mediapipe = False
-        else:
-            try:
-                # Try to use MediaPipe solutions (older API)
-                self.mesh = mp.solutions.face_mesh.FaceMesh(
-                    static_image_mode=False,
-                    max_num_faces=1,
-                    refine_landmarks=True,
-                    min_detection_confidence=0.5,
-                    min_tracking_confidence=0.5,
-                )
-                self._use_mediapipe = True
-                if self.debug:
-                    print("✅ Using MediaPipe FaceMesh for landmark detection")
-            except (AttributeError, Exception) as e:
-                if self.debug:
-                    print(f"⚠️  MediaPipe FaceMesh not available ({e}), using geometric estimation")
-                self.mesh = None
-                self._use_mediapipe = False
+        self.mesh = registry.get_face_mesh(max_num_faces=1, static_image_mode=True) if mp is not None else None
+        self._use_mediapipe = self.mesh is not None
+        # tracking meshes see one stream each, so they belong to this detector
+        self.frame_mesh = None
+        if self._use_mediapipe and landmark_mode == "frame":
+            self.frame_mesh = registry.create_face_mesh(max_num_faces=self.max_faces)
+        self._slots: List[_MeshSlot] = []
+        self.fallback_count = 0  # landmarks estimated from the Haar box (also PROFILER "landmark_fallback")
+        self._idle_meshes: List[Any] = []
+        if self.debug:
+            print("✅ Using MediaPipe FaceMesh for landmark detection" if self._use_mediapipe
+                  else "⚠️  MediaPipe FaceMesh not available, using geometric estimation")
 
         # 5pt indices
         self.IDX_LEFT_EYE = 33
@@ -221,7 +291,10 @@ class HaarFaceMesh5pt:
         self.IDX_MOUTH_LEFT = 61
         self.IDX_MOUTH_RIGHT = 291
 
+    @profiled("haar")
     def _haar_faces(self, gray: np.ndarray) -> np.ndarray:
+        if self.adaptive is not None:
+            return self.adaptive.detect(gray)
         faces = self.face_cascade.detectMultiScale(
             gray,
             scaleFactor=1.1,
@@ -233,39 +306,47 @@ class HaarFaceMesh5pt:
             return np.zeros((0, 4), dtype=np.int32)
         return faces.astype(np.int32)
 
-    def _roi_facemesh_5pt(self, roi_bgr: np.ndarray) -> Optional[np.ndarray]:
+    def _lm_5pt(self, lm, W: int, H: int) -> np.ndarray:
+        idxs = [self.IDX_LEFT_EYE, self.IDX_RIGHT_EYE, self.IDX_NOSE_TIP,
+                self.IDX_MOUTH_LEFT, self.IDX_MOUTH_RIGHT]
+        kps = np.array([[lm[i].x * W, lm[i].y * H] for i in idxs], dtype=np.float32)
+
+        # enforce left/right ordering
+        if kps[0,0] > kps[1,0]:
+            kps[[0,1]] = kps[[1,0]]
+        if kps[3,0] > kps[4,0]:
+            kps[[3,4]] = kps[[4,3]]
+        return kps
+
+    @profiled("facemesh")
+    def _frame_facemesh_5pt(self, frame_bgr: np.ndarray) -> List[np.ndarray]:
+        """Full-frame pass: 5pt (full-frame coords) of every face the mesh found."""
+        H, W = frame_bgr.shape[:2]
+        try:
+            res = self.frame_mesh.process(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
+        except Exception as e:
+            if self.debug:
+                print(f"MediaPipe frame processing failed: {e}, using ROI pass")
+            return []
+        return [self._lm_5pt(fl.landmark, W, H) for fl in (res.multi_face_landmarks or [])]
+
+    @profiled("facemesh")
+    def _roi_facemesh_5pt(self, roi_bgr: np.ndarray, mesh=None) -> Optional[np.ndarray]:
         H, W = roi_bgr.shape[:2]
         if H < 20 or W < 20:
             return None
-            
-        if not self._use_mediapipe or self.mesh is None:
+
+        mesh = mesh or self.mesh
+        if not self._use_mediapipe or mesh is None:
             # Use geometric estimation fallback
             return self._estimate_5pt_from_roi(roi_bgr)
             
         try:
             rgb = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2RGB)
-            res = self.mesh.process(rgb)
+            res = mesh.process(rgb)
             if not res.multi_face_landmarks:
                 return self._estimate_5pt_from_roi(roi_bgr)
-
-            lm = res.multi_face_landmarks[0].landmark
-            idxs = [self.IDX_LEFT_EYE, self.IDX_RIGHT_EYE, self.IDX_NOSE_TIP,
-                    self.IDX_MOUTH_LEFT, self.IDX_MOUTH_RIGHT]
-
-            pts = []
-            for i in idxs:
-                p = lm[i]
-                pts.append([p.x * W, p.y * H])
-
-            kps = np.array(pts, dtype=np.float32)
-
-            # enforce left/right ordering
-            if kps[0,0] > kps[1,0]:
-                kps[[0,1]] = kps[[1,0]]
-            if kps[3,0] > kps[4,0]:
-                kps[[3,4]] = kps[[4,3]]
-
-            return kps
+            return self._lm_5pt(res.multi_face_landmarks[0].landmark, W, H)
         except Exception as e:
             if self.debug:
                 print(f"MediaPipe ROI processing failed: {e}, using fallback")
@@ -273,7 +354,9 @@ class HaarFaceMesh5pt:
             return self._estimate_5pt_from_roi(roi_bgr)
     
     def _estimate_5pt_from_roi(self, roi_bgr: np.ndarray) -> Optional[np.ndarray]:
-        """Estimate 5 points from ROI geometry as fallback"""
+        """Estimate 5 points from ROI geometry as fallback (the ROI is the grown Haar box; no second Haar pass)"""
+        self.fallback_count += 1
+        PROFILER.count("landmark_fallback")
         H, W = roi_bgr.shape[:2]
         
         # Simple geometric estimation
@@ -303,6 +386,62 @@ class HaarFaceMesh5pt:
         
         return kps
 
+    @staticmethod
+    def _assign_frame_kps(faces: np.ndarray, mesh_kps: List[np.ndarray]) -> List[Optional[np.ndarray]]:
+        """
+        Haar box i gets the mesh face whose eyes+nose centroid lies inside it,
+        closest to its center first; every mesh face is used at most once.
+        """
+        out: List[Optional[np.ndarray]] = [None] * len(faces)
+        if not mesh_kps:
+            return out
+        pairs = []
+        for mi, k in enumerate(mesh_kps):
+            cx, cy = k[:3].mean(axis=0)
+            for fi, (x, y, w, h) in enumerate(faces):
+                if x <= cx <= x + w and y <= cy <= y + h:
+                    pairs.append((((cx - x - w / 2) / w) ** 2 + ((cy - y - h / 2) / h) ** 2, fi, mi))
+        used = set()
+        for _, fi, mi in sorted(pairs):
+            if out[fi] is None and mi not in used:
+                out[fi] = mesh_kps[mi]
+                used.add(mi)
+        return out
+
+    def _track_meshes(self, rois: List[Tuple[int, int, int, int]]) -> List[Any]:
+        """One tracking FaceMesh per ROI: the slot whose last ROI overlaps best, else a fresh slot."""
+        pairs = sorted(((box_iou(s.roi, r), si, ri) for si, s in enumerate(self._slots)
+                        for ri, r in enumerate(rois)), reverse=True)
+        owner: Dict[int, _MeshSlot] = {}
+        taken = set()
+        for iou, si, ri in pairs:
+            if iou < 0.3:
+                break
+            if ri not in owner and si not in taken:
+                owner[ri] = self._slots[si]
+                taken.add(si)
+
+        # slots not seen for a few detections hand their mesh back to the idle pool
+        keep: List[_MeshSlot] = []
+        for si, s in enumerate(self._slots):
+            s.missed = 0 if si in taken else s.missed + 1
+            if s.missed > 3:
+                self._idle_meshes.append(s.mesh)
+            else:
+                keep.append(s)
+        self._slots = keep
+
+        meshes: List[Any] = []
+        for ri, r in enumerate(rois):
+            slot = owner.get(ri)
+            if slot is None:
+                mesh = self._idle_meshes.pop() if self._idle_meshes else registry.create_face_mesh(max_num_faces=1)
+                slot = _MeshSlot(mesh=mesh, roi=r)
+                self._slots.append(slot)
+            slot.roi = r
+            meshes.append(slot.mesh)
+        return meshes
+
     def detect(self, frame_bgr: np.ndarray, max_faces: int = 5) -> List[FaceDet]:
         H, W = frame_bgr.shape[:2]
         gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
@@ -316,23 +455,34 @@ class HaarFaceMesh5pt:
         order = np.argsort(areas)[::-1]
         faces = faces[order][:max_faces]
 
-        out: List[FaceDet] = []
-
+        # expanded ROIs (ROI / track passes and fallback)
+        rois = []
         for (x,y,w,h) in faces:
-            # expand ROI
             mx, my = 0.25*w, 0.35*h
-            rx1, ry1, rx2, ry2 = _clip_xyxy(x-mx, y-my, x+w+mx, y+h+my, W, H)
-            roi = frame_bgr[ry1:ry2, rx1:rx2]
+            rois.append(_clip_xyxy(x-mx, y-my, x+w+mx, y+h+my, W, H))
 
-            kps_roi = self._roi_facemesh_5pt(roi)
-            if kps_roi is None:
-                if self.debug:
-                    print("[recognize] FaceMesh none for ROI -> skip")
-                continue
+        frame_kps: List[Optional[np.ndarray]] = [None] * len(faces)
+        roi_meshes: List[Any] = [None] * len(faces)  # None -> shared static ROI mesh
+        if self.frame_mesh is not None:
+            frame_kps = self._assign_frame_kps(faces, self._frame_facemesh_5pt(frame_bgr))
+        elif self._use_mediapipe and self.landmark_mode == "track":
+            roi_meshes = self._track_meshes(rois)
+
+        out: List[FaceDet] = []
 
-            kps = kps_roi.copy()
-            kps[:,0] += float(rx1)
-            kps[:,1] += float(ry1)
+        for (x,y,w,h), (rx1, ry1, rx2, ry2), kps_frame, mesh in zip(faces, rois, frame_kps, roi_meshes):
+            if kps_frame is not None:
+                kps = kps_frame
+            else:
+                kps_roi = self._roi_facemesh_5pt(frame_bgr[ry1:ry2, rx1:rx2], mesh)
+                if kps_roi is None:
+                    if self.debug:
+                        print("[recognize] FaceMesh none for ROI -> skip")
+                    continue
+
+                kps = kps_roi.copy()
+                kps[:,0] += float(rx1)
+                kps[:,1] += float(ry1)
 
             if not _kps_span_ok(kps, min_eye_dist=max(10.0, 0.18*float(w))):
                 if self.debug:
@@ -346,86 +496,378 @@ class HaarFaceMesh5pt:
 
         return out
 
+    def detect_batch(self, frames: List[np.ndarray], max_faces: int = 5) -> List[List[FaceDet]]:
+        """detect() per frame (src/detectors.py interface); Haar has no batched path."""
+        return [self.detect(f, max_faces=max_faces) for f in frames]
+
 # -------------------------
 # Matcher
 # -------------------------
 
+@dataclass(frozen=True)
+class MatcherState:
+    """Everything match() reads, built in one go and swapped as a single reference."""
+    db: object
+    names: List[str]
+    mat: Optional[np.ndarray]
+    owner: Optional[np.ndarray]
+    starts: Optional[np.ndarray]
+    max_templates: int
+    index: object
+
 class FaceDBMatcher:
-    def __init__(self, db: Dict[str,np.ndarray], dist_thresh: float = 0.34):
-        self.db = db
+    """
+    Matches embeddings against the enrolled DB.
+
+    An identity holds one template (D,) or several (K, D). All templates live
+    in one contiguous (T, D) matrix grouped by identity; owner maps each row
+    to its identity and starts marks where each group begins. Per-identity
+    scores are pooled over its templates:
+      pool="max"    : best template
+      pool="softmax": softmax(beta * sim)-weighted mean of the template sims
+
+    index: "exact" (dense matrix product, default), "ivf" (pure NumPy ANN) or
+    "hnsw" (needs hnswlib); see src/index.py. n_probe / ef trade recall for
+    latency. With index_path set, the built ANN index is saved there and
+    reused while the DB content is unchanged. ANN backends search templates
+    and always max-pool (only the returned neighbours are scored).
+
+    All derived data sits in one immutable MatcherState. build_state() can run
+    on any thread and swap() publishes it with a single reference assignment,
+    so a DBWatcher can reload while match() keeps running; each match() call
+    reads the state once and never sees a half-built DB.
+    """
+    def __init__(self, db: Dict[str,np.ndarray], dist_thresh: float = 0.34,
+                 index: str = "exact",
+                 index_path: Optional[Path] = None,
+                 n_probe: int = DEFAULT_N_PROBE,
+                 ef: int = 64,
+                 pool: str = "max",
+                 softmax_beta: float = 20.0):
+        if pool not in ("max", "softmax"):
+            raise ValueError(f"Unknown pool: {pool!r} (max | softmax)")
         self.dist_thresh = float(dist_thresh)
-        self._names: List[str] = []
-        self._mat: Optional[np.ndarray] = None
-        self._rebuild()
-
-    def _rebuild(self):
-        self._names = sorted(self.db.keys())
-        if self._names:
-            self._mat = np.stack([self.db[n].reshape(-1).astype(np.float32) for n in self._names], axis=0)
+        self.index_kind = index
+        self.index_path = index_path
+        self.n_probe = int(n_probe)
+        self.ef = int(ef)
+        self.pool = pool
+        self.softmax_beta = float(softmax_beta)
+        self.version = 0  # bumped on every swap()
+        self._state = self.build_state(db)
+
+    # ---- state ----
+
+    def build_state(self, db) -> MatcherState:
+        """Pack db into a new MatcherState. Touches no matcher attributes."""
+        if isinstance(db, FaceDB):
+            # float32 memmap stays shared with other processes (no copy)
+            names, mat, counts = db.packed()
         else:
-            self._mat = None
+            names = sorted(db.keys())
+            blocks = [np.asarray(db[n], dtype=np.float32) for n in names]
+            blocks = [b.reshape(-1, b.shape[-1]) for b in blocks]
+            counts = np.array([b.shape[0] for b in blocks], dtype=np.int64)
+            mat = np.concatenate(blocks, axis=0) if blocks else None
+        if not names:
+            return MatcherState(db=db, names=[], mat=None, owner=None, starts=None, max_templates=1, index=None)
+
+        mat = np.ascontiguousarray(mat, dtype=np.float32)
+        return MatcherState(
+            db=db,
+            names=list(names),
+            mat=mat,
+            owner=np.repeat(np.arange(len(names), dtype=np.int64), counts),
+            starts=np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64),
+            max_templates=int(counts.max()),
+            index=build_index(self.index_kind, mat, path=self.index_path, n_probe=self.n_probe, ef=self.ef),
+        )
+
+    def swap(self, state: MatcherState) -> None:
+        self._state = state
+        self.version += 1
 
     def reload_from(self, path: Path):
-        self.db = load_db_npz(path)
-        self._rebuild()
+        """Synchronous reload (blocks the caller while the index builds); see DBWatcher."""
+        self.swap(self.build_state(load_db(path)))
+
+    @property
+    def db(self):
+        return self._state.db
+
+    @property
+    def names(self) -> List[str]:
+        return self._state.names
+
+    @property
+    def num_templates(self) -> int:
+        mat = self._state.mat
+        return 0 if mat is None else int(mat.shape[0])
+
+    # ---- scoring ----
+
+    def _identity_scores(self, st: MatcherState, sims: np.ndarray) -> np.ndarray:
+        """(..., T) template sims -> (..., N_identities) pooled sims."""
+        if st.max_templates == 1:
+            return sims
+        best = np.maximum.reduceat(sims, st.starts, axis=-1)
+        if self.pool == "max":
+            return best
+        w = np.exp(self.softmax_beta * (sims - best[..., st.owner]))
+        return np.add.reduceat(w * sims, st.starts, axis=-1) / np.add.reduceat(w, st.starts, axis=-1)
+
+    def _ann_identities(self, st: MatcherState, emb: np.ndarray, k: int):
+        """Top-k distinct identities from an ANN template search (max-pooled)."""
+        ids, sims = st.index.search(emb, k=k * st.max_templates)
+        ids, sims = ids[0], sims[0]
+        valid = ids >= 0
+        owners = st.owner[ids[valid]]
+        sims = sims[valid]
+        # results are sorted by sim, so the first hit per owner is its max
+        _, first = np.unique(owners, return_index=True)
+        first = np.sort(first)[:k]
+        return owners[first], sims[first]
+
+    def _result(self, st: MatcherState, i: int, sim: float) -> MatchResult:
+        dist = 1.0 - float(sim)
+        ok = i >= 0 and dist <= self.dist_thresh
+        return MatchResult(
+            name=st.names[i] if ok else None,
+            distance=float(dist),
+            similarity=float(sim),
+            accepted=bool(ok)
+        )
 
+    @profiled("match")
     def match(self, emb: np.ndarray) -> MatchResult:
-        if self._mat is None or len(self._names) == 0:
+        st = self._state
+        if st.mat is None:
             return MatchResult(name=None, distance=1.0, similarity=0.0, accepted=False)
 
-        e = emb.reshape(1,-1).astype(np.float32)
-        sims = (self._mat @ e.T).reshape(-1)
-        best_i = int(np.argmax(sims))
-        best_sim = float(sims[best_i])
-        best_dist = 1.0 - best_sim
-        ok = best_dist <= self.dist_thresh
+        if self.index_kind == "exact":
+            e = emb.reshape(-1).astype(np.float32)
+            scores = self._identity_scores(st, st.mat @ e)
+            best_i = int(np.argmax(scores))
+            return self._result(st, best_i, float(scores[best_i]))
 
-        return MatchResult(
-            name=self._names[best_i] if ok else None,
-            distance=float(best_dist),
-            similarity=float(best_sim),
-            accepted=bool(ok)
-        )
+        owners, sims = self._ann_identities(st, emb, k=1)
+        if owners.size == 0:
+            return MatchResult(name=None, distance=1.0, similarity=0.0, accepted=False)
+        return self._result(st, int(owners[0]), float(sims[0]))
+
+    def match_batch(self, embs: np.ndarray) -> List[MatchResult]:
+        """match() for (N, D) embeddings; one matrix product for the exact index."""
+        st = self._state
+        E = np.asarray(embs, dtype=np.float32).reshape(len(embs), -1) if len(embs) else np.zeros((0, 0), np.float32)
+        if st.mat is None or self.index_kind != "exact" or E.shape[0] == 0:
+            return [self.match(e) for e in E]
+        # one sample per batch: its own stage, so "match" stays per face
+        with PROFILER.time("match_batch"):
+            scores = self._identity_scores(st, E @ st.mat.T)
+            best = np.argmax(scores, axis=1)
+        return [self._result(st, int(i), float(scores[r, i])) for r, i in enumerate(best)]
+
+    @profiled("match")
+    def match_topk(self, emb: np.ndarray, k: int = 5) -> List[MatchResult]:
+        """
+        Best k identities, most similar first. Unlike match(), name is always
+        filled in; accepted tells whether it is under the threshold.
+        """
+        st = self._state
+        if st.index is None:
+            return []
+        if self.index_kind == "exact":
+            scores = self._identity_scores(st, st.mat @ emb.reshape(-1).astype(np.float32))
+            owners, sims = topk_rows(scores[None, :], k)
+            owners, sims = owners[0], sims[0]
+        else:
+            owners, sims = self._ann_identities(st, emb, k=k)
+        out: List[MatchResult] = []
+        for i, v in zip(owners, sims):
+            r = self._result(st, int(i), float(v))
+            r.name = st.names[int(i)]
+            out.append(r)
+        return out
+
+# -------------------------
+# DB hot reload
+# -------------------------
+
+class DBWatcher:
+    """
+    Polls the DB files' mtime/size on a background thread. On a change it
+    loads the DB and builds the new MatcherState (index included) on that
+    thread, then swaps it into the matcher; the recognition loop only ever
+    sees the reference flip.
+
+    db_path is re-resolved on every poll, so migrating face_db.npz to
+    face_db.emb is picked up too. A failed load (e.g. a half-written npz) is
+    logged and retried on the next change/poll.
+    """
+    def __init__(self, matcher: FaceDBMatcher, db_path: Path, interval_s: float = 1.0):
+        self.matcher = matcher
+        self.db_path = Path(db_path)
+        self.interval_s = float(interval_s)
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._sig = self._signature()
+
+    def _signature(self) -> Tuple:
+        path = resolve_db_path(self.db_path)
+        files = [path, path.with_name(path.name + ".idx.npy")] if path.suffix == ".emb" else [path]
+        sig = [str(path)]
+        for f in files:
+            try:
+                st = f.stat()
+                sig.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        return tuple(sig)
+
+    def reload_now(self) -> None:
+        """Ask for a reload on the next tick even if nothing changed."""
+        self._sig = None
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            sig = self._signature()
+            if sig == self._sig:
+                continue
+            try:
+                t0 = time.perf_counter()
+                state = self.matcher.build_state(load_db(resolve_db_path(self.db_path)))
+                self.matcher.swap(state)
+                self._sig = sig
+                self.reloads += 1
+                print(f"[db-watch] reloaded {sig[0]}: {len(state.names)} identities "
+                      f"({(time.perf_counter() - t0) * 1000.0:.0f} ms, off-thread)")
+            except Exception as e:
+                print(f"[db-watch] reload failed, will retry: {e}")
+
+    def start(self) -> "DBWatcher":
+        self._thread = threading.Thread(target=self._loop, name="db-watch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
 
 # -------------------------
 # Demo
 # -------------------------
 
 def main():
-    db_path = Path("data/db/face_db.npz")
+    ap = argparse.ArgumentParser(description="Multi-face recognition (live camera, or headless on files).")
+    ap.add_argument("--input", type=Path, help="video file or image folder (headless mode)")
+    ap.add_argument("--output", type=Path, default=Path("results.jsonl"), help="JSON lines, one per frame")
+    ap.add_argument("--annotate", type=Path, help="also write an annotated video here")
+    ap.add_argument("--thr", type=float, default=0.34, help="distance threshold")
+    ap.add_argument("--detect-every", type=int, default=5, help="video: full detection every N frames")
+    ap.add_argument("--batch-frames", type=int, default=8, help="frames whose faces are embedded together")
+    ap.add_argument("--landmarks", choices=LANDMARK_MODES, default="frame",
+                    help="FaceMesh: one full-frame pass, one tracking mesh per face, or per-ROI static")
+    ap.add_argument("--haar-budget-ms", type=float, default=0.0,
+                    help="> 0: adaptive Haar (downscaled + ROI search) tuned to this per-frame budget")
+    ap.add_argument("--detector", choices=("haar", "yunet"), default="haar",
+                    help="haar: Haar + FaceMesh; yunet: one CNN pass for boxes + 5pt (src/detectors.py)")
+    ap.add_argument("--detector-model", help="YuNet ONNX (default models/face_detection_yunet_2023mar.onnx)")
+    ap.add_argument("--index", choices=INDEX_KINDS, default="exact",
+                    help="DB search: exact, or ANN (ivf / hnsw) saved next to the DB (src/index.py)")
+    ap.add_argument("--n-probe", type=int, default=DEFAULT_N_PROBE, help="ivf: lists scanned per query")
+    ap.add_argument("--ef", type=int, default=64, help="hnsw: search breadth")
+    args = ap.parse_args()
+
+    db_path = resolve_db_path(Path("data/db/face_db.npz"))
+    embedder = ArcFaceEmbedderONNX(model_path="models/embedder_arcface.onnx", input_size=(112,112),
+                                   max_batch=32, session_cfg=OrtSessionConfig.from_env())
+    matcher = FaceDBMatcher(db=load_db(db_path), dist_thresh=args.thr, index=args.index,
+                            index_path=index_path_for(db_path, args.index) if args.index != "exact" else None,
+                            n_probe=args.n_probe, ef=args.ef)
+    from .detectors import create_detector
+    adaptive = AdaptiveHaarConfig(budget_ms=args.haar_budget_ms) if args.haar_budget_ms > 0 else None
+    detector = create_detector(args.detector, min_size=(70,70), landmark_mode=args.landmarks, adaptive=adaptive,
+                               model_path=args.detector_model)
+    # first-inference costs now instead of on the first face
+    registry.warm_up(batch_sizes=(1, embedder.max_batch))
+
+    exporter = start_exporter_from_env()
+    try:
+        if args.input is not None:
+            from .offline import run_offline
+            if not args.input.exists():
+                raise FileNotFoundError(f"Input not found: {args.input}")
+            run_offline(args.input, args.output, args.annotate, detector, embedder, matcher,
+                        detect_every=args.detect_every, batch_frames=args.batch_frames)
+        else:
+            run_live(embedder, matcher, detector)
+    finally:
+        if exporter is not None:
+            exporter.stop()
 
-    det = HaarFaceMesh5pt(min_size=(70,70), debug=False)
-    embedder = ArcFaceEmbedderONNX(model_path="models/embedder_arcface.onnx", input_size=(112,112))
-    db = load_db_npz(db_path)
-    matcher = FaceDBMatcher(db=db, dist_thresh=0.34)
+def run_live(embedder: "ArcFaceEmbedderONNX", matcher: FaceDBMatcher, detector: "HaarFaceMesh5pt"):
+    # Haar + FaceMesh every 5th frame, optical-flow tracking in between
+    det = FaceTracker(detector, detect_every=5)
+    watcher = DBWatcher(matcher, Path("data/db/face_db.npz")).start()
 
     cap = cv2.VideoCapture(0)
     if not cap.isOpened():
         raise RuntimeError("Camera not available")
 
-    print("Recognize (multi-face). q=quit, r=reload DB, +/- threshold, d=debug overlay")
+    print("Recognize (multi-face). q=quit, r=reload DB, +/- threshold, d=debug overlay, l=stage latency")
+
+    # -- pipeline stages (each runs on its own thread) --
+
+    def stage_detect(pkt: FramePacket) -> FramePacket:
+        pkt.data["faces"] = det.detect(pkt.frame, max_faces=5)
+        return pkt
 
-    t0 = time.time()
-    frames = 0
-    fps: Optional[float] = None
-    show_debug = False
+    def stage_embed(pkt: FramePacket) -> FramePacket:
+        # align all faces first (one batched solve, one (N,112,112,3) array), then embed them in one ONNX call
+        faces = pkt.data["faces"]
+        aligned_all, _ = align_faces_5pt(pkt.frame, [f.kps for f in faces], out_size=(112,112))
+        pkt.data["aligned"] = aligned_all
+        pkt.data["embs"] = embedder.embed_batch(aligned_all)
+        return pkt
 
-    while True:
-        ok, frame = cap.read()
-        if not ok:
-            break
+    def stage_match(pkt: FramePacket) -> FramePacket:
+        embs = pkt.data["embs"]
+        pkt.data["matches"] = [matcher.match(embs[i]) for i in range(len(pkt.data["faces"]))]
+        return pkt
 
-        faces = det.detect(frame, max_faces=5)
+    pipe = FramePipeline(cap, [
+        ("detect", stage_detect),
+        ("embed", stage_embed),
+        ("match", stage_match),
+    ])
+
+    # -- render (main thread) --
+
+    state = {"t0": time.time(), "frames": 0, "fps": None, "show_debug": False}
+
+    def render(pkt: FramePacket) -> bool:
+        frame = pkt.frame
+        faces: List[FaceDet] = pkt.data["faces"]
         vis = frame.copy()
 
-        frames += 1
-        dt = time.time() - t0
+        state["frames"] += 1
+        dt = time.time() - state["t0"]
         if dt >= 1.0:
-            fps = frames/dt
-            frames = 0
-            t0 = time.time()
+            state["fps"] = state["frames"]/dt
+            state["frames"] = 0
+            state["t0"] = time.time()
 
-        # draw + recognize each face
+        # draw each recognized face
         h, w = vis.shape[:2]
         thumb = 112
         pad = 8
@@ -438,9 +880,8 @@ def main():
             for (x,y) in f.kps.astype(int):
                 cv2.circle(vis, (int(x), int(y)), 2, (0,255,0), -1)
 
-            aligned,_ = align_face_5pt(frame, f.kps, out_size=(112,112))
-            emb = embedder.embed(aligned)
-            mr = matcher.match(emb)
+            aligned = pkt.data["aligned"][i]
+            mr = pkt.data["matches"][i]
 
             label = mr.name if mr.name else "Unknown"
             line1 = f"{label}"
@@ -456,23 +897,23 @@ def main():
                 y0 += thumb + pad
                 shown += 1
 
-            if show_debug:
+            if state["show_debug"]:
                 dbg = f"kpsLeye=({f.kps[0,0]:.0f},{f.kps[0,1]:.0f})"
                 cv2.putText(vis, dbg, (10, h-20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,255,255), 2)
 
-        header = f"IDs={len(matcher._names)}  thr(dist)={matcher.dist_thresh:.2f}"
-        if fps:
-            header += f"  fps={fps:.1f}"
+        header = f"IDs={len(matcher.names)}  thr(dist)={matcher.dist_thresh:.2f}"
+        if state["fps"]:
+            header += f"  fps={state['fps']:.1f}"
         cv2.putText(vis, header, (10,28), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0,255,0), 2)
 
         cv2.imshow("recognize_new", vis)
         key = cv2.waitKey(1) & 0xFF
 
         if key == ord("q"):
-            break
+            return False
         elif key == ord("r"):
-            matcher.reload_from(db_path)
-            print(f"[recognize] reloaded DB: {len(matcher._names)} identities")
+            watcher.reload_now()
+            print("[recognize] DB reload requested")
         elif key in (ord("+"), ord("=")):
             matcher.dist_thresh = float(min(1.20, matcher.dist_thresh + 0.01))
             print(f"[recognize] thr(dist)={matcher.dist_thresh:.2f} (sim~{1.0-matcher.dist_thresh:.2f})")
@@ -480,11 +921,21 @@ def main():
             matcher.dist_thresh = float(max(0.05, matcher.dist_thresh - 0.01))
             print(f"[recognize] thr(dist)={matcher.dist_thresh:.2f} (sim~{1.0-matcher.dist_thresh:.2f})")
         elif key == ord("d"):
-            show_debug = not show_debug
-            print(f"[recognize] debug overlay: {'ON' if show_debug else 'OFF'}")
-
-    cap.release()
-    cv2.destroyAllWindows()
+            state["show_debug"] = not state["show_debug"]
+            print(f"[recognize] debug overlay: {'ON' if state['show_debug'] else 'OFF'}")
+        elif key == ord("l"):
+            print(pipe.format_stats())
+            print(PROFILER.format())
+        return True
+
+    try:
+        pipe.run(render)
+    finally:
+        watcher.stop()
+        print(pipe.format_stats())
+        print(PROFILER.format())
+        cap.release()
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,209 @@
+# src/registry.py
+"""
+Process-wide model registry: every model is loaded once and shared.
+
+HaarFaceMesh5pt (recognize.py), Haar5ptDetector (haar_5pt.py) and both
+ArcFaceEmbedderONNX classes get their heavy objects from here, so building
+a second detector / embedder in the same process (face_locking, enroll,
+benchmarks) costs nothing:
+
+    get_cascade(xml)           Haar cascade, per cascade file (one classifier per calling thread)
+    get_face_mesh(...)         MediaPipe FaceMesh, per settings (None without MediaPipe)
+    create_face_mesh(...)      a private FaceMesh, for callers that need its tracking state
+    get_session(path, cfg)     onnxruntime.InferenceSession, per model file + config
+    warm_up(batch_sizes)       one dummy pass through every loaded model
+
+Warm-up moves first-inference costs (ORT memory planning per batch shape,
+MediaPipe graph start, cascade buffers) to startup instead of the first
+recognized face.
+
+Loading is lazy and thread-safe. InferenceSession.run may be called from
+several threads. detectMultiScale may not (the classifier keeps its feature
+buffers as members), so SharedCascade parses the XML once and keeps one
+classifier per thread that calls it. FaceMesh is handed out wrapped in
+SharedFaceMesh, which serializes process().
+"""
+
+from __future__ import annotations
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    import mediapipe as mp
+except Exception:
+    mp = None
+
+_lock = threading.RLock()
+_cascades: Dict[str, "SharedCascade"] = {}
+_meshes: Dict[Tuple, Optional["SharedFaceMesh"]] = {}
+_sessions: Dict[Tuple, "object"] = {}
+_warm: Dict[int, set] = {}  # id(model) -> batch sizes / frame sizes already run
+
+DEFAULT_CASCADE = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+
+# -------------------------
+# Models
+# -------------------------
+
+class SharedCascade:
+    """detectMultiScale on a per-thread CascadeClassifier of one cascade file."""
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._classifier()  # load (and validate) on the creating thread
+
+    def _classifier(self) -> cv2.CascadeClassifier:
+        c = getattr(self._local, "classifier", None)
+        if c is None:
+            c = cv2.CascadeClassifier(self.path)
+            if c.empty():
+                raise RuntimeError(f"Failed to load Haar cascade: {self.path}")
+            self._local.classifier = c
+        return c
+
+    def detectMultiScale(self, *args, **kwargs):
+        return self._classifier().detectMultiScale(*args, **kwargs)
+
+def get_cascade(haar_xml: Optional[str] = None) -> SharedCascade:
+    path = str(haar_xml or DEFAULT_CASCADE)
+    with _lock:
+        cascade = _cascades.get(path)
+        if cascade is None:
+            cascade = _cascades[path] = SharedCascade(path)
+        return cascade
+
+class SharedFaceMesh:
+    """FaceMesh behind a lock: the graph keeps per-stream state and is not reentrant."""
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self._lock = threading.Lock()
+
+    def process(self, rgb: np.ndarray):
+        with self._lock:
+            return self.mesh.process(rgb)
+
+def create_face_mesh(
+    max_num_faces: int = 1,
+    static_image_mode: bool = False,
+    refine_landmarks: bool = True,
+    min_detection_confidence: float = 0.5,
+    min_tracking_confidence: float = 0.5,
+) -> Optional[SharedFaceMesh]:
+    """
+    New FaceMesh (not cached), or None when MediaPipe (solutions API) is unavailable.
+    With static_image_mode=False the mesh tracks landmarks from call to call, so it
+    must only ever see one stream; such meshes are created here, not shared.
+    """
+    if mp is None:
+        return None
+    try:
+        return SharedFaceMesh(mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=bool(static_image_mode),
+            max_num_faces=int(max_num_faces),
+            refine_landmarks=bool(refine_landmarks),
+            min_detection_confidence=float(min_detection_confidence),
+            min_tracking_confidence=float(min_tracking_confidence),
+        ))
+    except Exception as e:
+        print(f"[registry] MediaPipe FaceMesh unavailable ({e})")
+        return None
+
+def get_face_mesh(
+    max_num_faces: int = 1,
+    static_image_mode: bool = False,
+    refine_landmarks: bool = True,
+    min_detection_confidence: float = 0.5,
+    min_tracking_confidence: float = 0.5,
+) -> Optional[SharedFaceMesh]:
+    """Shared FaceMesh for these settings, or None when MediaPipe (solutions API) is unavailable."""
+    key = (int(max_num_faces), bool(static_image_mode), bool(refine_landmarks),
+           float(min_detection_confidence), float(min_tracking_confidence))
+    with _lock:
+        if key not in _meshes:
+            _meshes[key] = create_face_mesh(*key)
+        return _meshes[key]
+
+def get_session(model_path: str, session_cfg=None):
+    """
+    Shared InferenceSession for the file model_path resolves to under
+    session_cfg (variant), its SessionOptions and its mtime, so a file
+    rewritten by quantize.py is loaded fresh.
+    """
+    from .embed import OrtSessionConfig, create_session, resolve_model_path
+
+    cfg = session_cfg or OrtSessionConfig()
+    model_file = resolve_model_path(str(model_path), cfg.model_variant)
+    try:
+        mtime = model_file.stat().st_mtime_ns
+    except OSError:
+        mtime = None  # create_session raises the real error
+    key = (str(Path(model_file).resolve()), mtime, repr(cfg))
+    with _lock:
+        sess = _sessions.get(key)
+        if sess is None:
+            t0 = time.perf_counter()
+            sess = create_session(str(model_path), cfg)
+            _sessions[key] = sess
+            print(f"[registry] ONNX session {model_file.name} loaded in {time.perf_counter() - t0:.2f}s")
+        return sess
+
+# -------------------------
+# Warm-up
+# -------------------------
+
+def _session_input(sess, batch: int) -> Optional[np.ndarray]:
+    inp = sess.get_inputs()[0]
+    shape = [d if isinstance(d, int) and d > 0 else 112 for d in inp.shape]
+    if len(shape) != 4:
+        return None
+    if isinstance(inp.shape[0], int) and inp.shape[0] > 0:
+        if batch != inp.shape[0]:
+            return None
+    shape[0] = batch
+    return np.zeros(shape, dtype=np.float32)
+
+def warm_up(batch_sizes: Iterable[int] = (1,), frame_size: Tuple[int, int] = (640, 480)) -> float:
+    """
+    One dummy inference per loaded model (per batch size for sessions),
+    skipping what was warmed before. Returns seconds spent.
+    """
+    t0 = time.perf_counter()
+    w, h = int(frame_size[0]), int(frame_size[1])
+    with _lock:
+        cascades = list(_cascades.values())
+        meshes = [m for m in _meshes.values() if m is not None]
+        sessions = list(_sessions.values())
+
+    for c in cascades:
+        done = _warm.setdefault(id(c), set())
+        if (w, h) not in done:
+            c.detectMultiScale(np.zeros((h, w), dtype=np.uint8), scaleFactor=1.1, minNeighbors=5)
+            done.add((w, h))
+    for m in meshes:
+        done = _warm.setdefault(id(m), set())
+        if not done:
+            m.process(np.zeros((192, 192, 3), dtype=np.uint8))
+            done.add(1)
+    for s in sessions:
+        done = _warm.setdefault(id(s), set())
+        for b in sorted(set(int(b) for b in batch_sizes if b > 0)):
+            if b in done:
+                continue
+            x = _session_input(s, b)
+            done.add(b)
+            if x is None:
+                continue
+            try:
+                s.run(None, {s.get_inputs()[0].name: x})
+            except Exception as e:  # e.g. a detector that needs other spatial sizes; it warms itself
+                print(f"[registry] warm-up skipped for {s.get_inputs()[0].name} {list(x.shape)}: {e.__class__.__name__}")
+
+    dt = time.perf_counter() - t0
+    if dt > 0.01:
+        print(f"[registry] warm-up {dt:.2f}s")
+    return dt
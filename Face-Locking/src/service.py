@@ -0,0 +1,715 @@
+# src/service.py
+"""
+Local recognition service: HTTP + WebSocket API on asyncio (standard library only).
+
+Run:
+    python -m src.service [--host 127.0.0.1] [--port 8765] [--workers 4] [--max-batch 32]
+    python -m src.service --selftest     # start on a free port, send synthetic images, exit
+
+HTTP:
+    POST /v1/recognize   body: JPEG/PNG frame
+                         -> {"faces": [{box, kps, score, name, distance, similarity, accepted}, ...]}
+    POST /v1/crops       body: one JPEG/PNG aligned 112x112 crop,
+                         or JSON {"crops": ["<base64 JPEG/PNG>", ...]}
+                         -> {"matches": [{name, distance, similarity, accepted}, ...]}
+    GET  /healthz        -> {"status": "ok", identities, pending, ...}
+    GET  /metrics        -> Prometheus text (stage latencies + service counters)
+
+WebSocket (GET /v1/ws):
+    binary message       one JPEG/PNG frame -> text reply, same JSON as /v1/recognize
+    text message         {"id": .., "op": "recognize", "image": "<base64>"}
+                         {"id": .., "op": "crops", "crops": ["<base64>", ...]}
+    Replies are JSON text messages carrying the request's "id" (binary: a running number).
+    At most ws_inflight requests per connection are processed at once; replies may
+    arrive out of order.
+
+Flow:
+    decode + Haar/FaceMesh + alignment  -> executor thread, at most `workers` at once
+    embed + match                        -> one batcher task: crops of all pending requests
+                                            (up to max_batch, or max_wait_ms after the first)
+                                            go through ONE embed_batch + match_batch call, on
+                                            its own thread, never queued behind detect jobs
+The event loop only parses requests and moves bytes; every numpy/OpenCV/ONNX call runs
+on the executor.
+
+Backpressure: a request arriving while max_pending requests are already in the service
+gets 503 + Retry-After (HTTP) or {"error": "busy"} (WebSocket) instead of queueing up;
+bodies over max_body_bytes get 413.
+
+The Haar detector runs with landmark_mode="roi": requests are unrelated images, so there
+is no stream for a tracking FaceMesh to follow, and the static path is safe to call from
+several threads. --detector yunet (src/detectors.py) is thread-safe as well.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from . import registry
+from .embed import OrtSessionConfig
+from .facedb import resolve_db_path
+from .index import DEFAULT_N_PROBE, INDEX_KINDS, index_path_for
+from .haar_5pt import align_faces_5pt
+from .offline import _face_record
+from .pipeline import StageStats
+from .profiling import PROFILER
+from .detectors import DETECTORS, FaceDetector, create_detector
+from .recognize import ArcFaceEmbedderONNX, DBWatcher, FaceDBMatcher, MatchResult, load_db
+
+# -------------------------
+# Config / errors
+# -------------------------
+
+@dataclass
+class ServiceConfig:
+    host: str = "127.0.0.1"
+    port: int = 8765
+    workers: int = 4                  # executor threads (decode / detect / align); embed has its own
+    max_batch: int = 32               # crops per embed_batch call, across requests
+    max_wait_ms: float = 5.0          # batcher waits this long after the first crop
+    max_pending: int = 64             # requests in the service before new ones get 503 / busy
+    max_body_bytes: int = 8 << 20
+    ws_inflight: int = 4              # concurrent requests per WebSocket connection
+    max_faces: int = 5                # per frame
+    crop_size: Tuple[int, int] = (112, 112)
+
+class ServiceError(Exception):
+    """Request-level error, mapped to an HTTP status (and a WebSocket error reply)."""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = int(status)
+        self.message = message
+
+class Busy(ServiceError):
+    def __init__(self):
+        super().__init__(503, "busy")
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+def _match_record(mr: MatchResult) -> dict:
+    return {"name": mr.name, "distance": round(mr.distance, 4),
+            "similarity": round(mr.similarity, 4), "accepted": mr.accepted}
+
+def _decode_image(data: bytes) -> np.ndarray:
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ServiceError(400, "body is not a decodable image")
+    return img
+
+def _b64(s: Any) -> bytes:
+    if not isinstance(s, str):
+        raise ServiceError(400, "expected a base64 string")
+    try:
+        return base64.b64decode(s, validate=True)
+    except ValueError:
+        raise ServiceError(400, "invalid base64")
+
+# -------------------------
+# Embedding batcher
+# -------------------------
+
+class _EmbedBatcher:
+    """
+    Collects crops of concurrent requests and embeds + matches them together.
+    embed_batch reuses one preprocessing buffer, so exactly one call is in flight.
+    """
+    def __init__(self, embedder: ArcFaceEmbedderONNX, matcher: FaceDBMatcher,
+                 executor: ThreadPoolExecutor, max_batch: int, max_wait_s: float):
+        self.embedder = embedder
+        self.matcher = matcher
+        self.executor = executor
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_s = max(0.0, float(max_wait_s))
+        self._q: "asyncio.Queue[Tuple[np.ndarray, asyncio.Future]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"embed_match": StageStats("embed_match"), "batch_faces": StageStats("batch_faces")}
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, crops: np.ndarray) -> List[MatchResult]:
+        """crops: (N, h, w, 3) uint8 BGR aligned faces."""
+        if len(crops) == 0:
+            return []
+        fut = asyncio.get_running_loop().create_future()
+        await self._q.put((crops, fut))
+        return await fut
+
+    def _embed_match(self, crops: np.ndarray) -> List[MatchResult]:
+        t0 = time.perf_counter()
+        res = self.matcher.match_batch(self.embedder.embed_batch(crops))
+        self.stats["embed_match"].add((time.perf_counter() - t0) * 1000.0)
+        self.stats["batch_faces"].add(float(len(crops)))
+        return res
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._q.get()]
+            n = len(batch[0][0])
+            deadline = loop.time() + self.max_wait_s
+            while n < self.max_batch:
+                left = deadline - loop.time()
+                if left <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._q.get(), timeout=left)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                n += len(item[0])
+
+            crops = batch[0][0] if len(batch) == 1 else np.concatenate([c for c, _ in batch], axis=0)
+            try:
+                matches = await loop.run_in_executor(self.executor, self._embed_match, crops)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            k = 0
+            for c, fut in batch:
+                if not fut.done():  # caller may have gone away
+                    fut.set_result(matches[k:k + len(c)])
+                k += len(c)
+
+# -------------------------
+# Service
+# -------------------------
+
+class RecognitionService:
+    def __init__(self, detector: FaceDetector, embedder: ArcFaceEmbedderONNX,
+                 matcher: FaceDBMatcher, cfg: Optional[ServiceConfig] = None):
+        self.cfg = cfg or ServiceConfig()
+        self.detector = detector
+        self.embedder = embedder
+        self.matcher = matcher
+        self.executor = ThreadPoolExecutor(max_workers=max(1, self.cfg.workers), thread_name_prefix="service")
+        # embed_batch runs one call at a time; a thread of its own keeps batches from waiting on detect jobs
+        self.embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="service-embed")
+        self.batcher: Optional[_EmbedBatcher] = None
+        self._detect_slots: Optional[asyncio.Semaphore] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.pending = 0
+        self.counters: Dict[str, int] = {"requests": 0, "rejected_busy": 0, "errors": 0,
+                                         "faces": 0, "ws_connections": 0}
+        self.stats: Dict[str, StageStats] = {"detect": StageStats("detect"), "request": StageStats("request")}
+
+    # ---- recognition (loop side) ----
+
+    def _admit(self) -> None:
+        if self.pending >= self.cfg.max_pending:
+            self.counters["rejected_busy"] += 1
+            raise Busy()
+        self.pending += 1
+        self.counters["requests"] += 1
+
+    def _detect_align(self, data: bytes):
+        t0 = time.perf_counter()
+        frame = _decode_image(data)
+        faces = self.detector.detect(frame, max_faces=self.cfg.max_faces)
+        crops, _ = align_faces_5pt(frame, [f.kps for f in faces], out_size=self.cfg.crop_size)
+        self.stats["detect"].add((time.perf_counter() - t0) * 1000.0)
+        return faces, crops
+
+    def _decode_crops(self, blobs: List[bytes]) -> np.ndarray:
+        w, h = self.cfg.crop_size
+        out = np.empty((len(blobs), h, w, 3), dtype=np.uint8)
+        for i, b in enumerate(blobs):
+            img = _decode_image(b)
+            out[i] = img if img.shape[:2] == (h, w) else cv2.resize(img, (w, h), interpolation=cv2.INTER_LINEAR)
+        return out
+
+    async def recognize_image(self, data: bytes) -> dict:
+        """Full frame (encoded JPEG/PNG) -> faces with identities."""
+        self._admit()
+        t0 = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            async with self._detect_slots:
+                faces, crops = await loop.run_in_executor(self.executor, self._detect_align, data)
+            matches = await self.batcher.submit(crops)
+            self.counters["faces"] += len(faces)
+            return {"faces": [_face_record(f, m) for f, m in zip(faces, matches)]}
+        finally:
+            self.pending -= 1
+            self.stats["request"].add((time.perf_counter() - t0) * 1000.0)
+
+    async def recognize_crops(self, blobs: List[bytes]) -> dict:
+        """Aligned crops (encoded JPEG/PNG, resized to crop_size if needed) -> identities."""
+        self._admit()
+        t0 = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            crops = await loop.run_in_executor(self.executor, self._decode_crops, blobs)
+            matches = await self.batcher.submit(crops)
+            self.counters["faces"] += len(matches)
+            return {"matches": [_match_record(m) for m in matches]}
+        finally:
+            self.pending -= 1
+            self.stats["request"].add((time.perf_counter() - t0) * 1000.0)
+
+    def health(self) -> dict:
+        return {"status": "ok", "identities": len(self.matcher.names), "pending": self.pending,
+                **self.counters}
+
+    def metrics(self) -> str:
+        lines = [PROFILER.to_prometheus().rstrip("\n")]
+        for k, v in self.counters.items():
+            lines.append(f"# TYPE face_service_{k}_total counter")
+            lines.append(f"face_service_{k}_total {v}")
+        lines.append("# TYPE face_service_pending gauge")
+        lines.append(f"face_service_pending {self.pending}")
+        stats = dict(self.stats)
+        if self.batcher is not None:
+            stats.update(self.batcher.stats)
+        for name, st in stats.items():
+            s = st.summary()
+            lines.append(f'face_service_{name}{{stat="p50"}} {s["p50"]:.6g}')
+            lines.append(f'face_service_{name}{{stat="p95"}} {s["p95"]:.6g}')
+        return "\n".join(lines) + "\n"
+
+    # ---- HTTP ----
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """(method, path, headers, body) or None on EOF."""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise ServiceError(400, "request header too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise ServiceError(400, "malformed request line")
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise ServiceError(400, "invalid Content-Length")
+        if length < 0:
+            raise ServiceError(400, "invalid Content-Length")
+        if length > self.cfg.max_body_bytes:
+            raise ServiceError(413, f"body larger than {self.cfg.max_body_bytes} bytes")
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    @staticmethod
+    def _response(status: int, body: bytes, ctype: str = "application/json",
+                  extra: Optional[Dict[str, str]] = None, keep_alive: bool = True) -> bytes:
+        hdr = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}",
+               f"Content-Type: {ctype}",
+               f"Content-Length: {len(body)}",
+               f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        for k, v in (extra or {}).items():
+            hdr.append(f"{k}: {v}")
+        return ("\r\n".join(hdr) + "\r\n\r\n").encode("latin-1") + body
+
+    @staticmethod
+    def _json(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, bytes, str]:
+        if path == "/healthz":
+            return 200, self._json(self.health()), "application/json"
+        if path == "/metrics":
+            return 200, self.metrics().encode("utf-8"), "text/plain; version=0.0.4"
+        if path not in ("/v1/recognize", "/v1/crops"):
+            raise ServiceError(404, f"no route {path}")
+        if method != "POST":
+            raise ServiceError(405, "use POST")
+        if not body:
+            raise ServiceError(400, "empty body")
+
+        if path == "/v1/recognize":
+            return 200, self._json(await self.recognize_image(body)), "application/json"
+        if headers.get("content-type", "").startswith("application/json"):
+            try:
+                crops = json.loads(body).get("crops")
+            except (ValueError, AttributeError):
+                raise ServiceError(400, "invalid JSON")
+            if not isinstance(crops, list):
+                raise ServiceError(400, '"crops" must be a list')
+            blobs = [_b64(c) for c in crops]
+        else:
+            blobs = [body]
+        return 200, self._json(await self.recognize_crops(blobs)), "application/json"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    req = await self._read_request(reader)
+                except ServiceError as e:
+                    writer.write(self._response(e.status, self._json({"error": e.message}), keep_alive=False))
+                    await writer.drain()
+                    return
+                if req is None:
+                    return
+                method, path, headers, body = req
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                if path == "/v1/ws" and headers.get("upgrade", "").lower() == "websocket":
+                    await self._websocket(reader, writer, headers)
+                    return
+
+                extra = None
+                try:
+                    status, out, ctype = await self._dispatch(method, path, headers, body)
+                except ServiceError as e:
+                    status, out, ctype = e.status, self._json({"error": e.message}), "application/json"
+                    if isinstance(e, Busy):
+                        extra = {"Retry-After": "1"}
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    print(f"[service] {method} {path} failed: {e}")
+                    status, out, ctype = 500, self._json({"error": "internal error"}), "application/json"
+                writer.write(self._response(status, out, ctype, extra, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # ---- WebSocket (RFC 6455, server side) ----
+
+    _WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    @staticmethod
+    def _ws_frame(opcode: int, payload: bytes) -> bytes:
+        n = len(payload)
+        if n < 126:
+            head = struct.pack("!BB", 0x80 | opcode, n)
+        elif n < (1 << 16):
+            head = struct.pack("!BBH", 0x80 | opcode, 126, n)
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+        return head + payload
+
+    async def _ws_read(self, reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+        """One complete message (continuation frames joined): (opcode, payload)."""
+        opcode, chunks, size = None, [], 0
+        while True:
+            b0, b1 = await reader.readexactly(2)
+            op, fin = b0 & 0x0F, bool(b0 & 0x80)
+            n = b1 & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", await reader.readexactly(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", await reader.readexactly(8))[0]
+            size += n
+            if size > self.cfg.max_body_bytes:
+                raise ServiceError(413, "message too large")
+            mask = await reader.readexactly(4) if b1 & 0x80 else None
+            data = await reader.readexactly(n)
+            if mask is not None:
+                data = (np.frombuffer(data, dtype=np.uint8)
+                        ^ np.resize(np.frombuffer(mask, dtype=np.uint8), n)).tobytes()
+            if op >= 0x8:  # control frames may sit between fragments
+                return op, data
+            if op != 0x0:
+                opcode = op
+            chunks.append(data)
+            if fin:
+                return opcode if opcode is not None else 0x2, b"".join(chunks)
+
+    @staticmethod
+    def _ws_parse(data: bytes) -> dict:
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            raise ServiceError(400, "invalid JSON")
+        if not isinstance(msg, dict):
+            raise ServiceError(400, "expected a JSON object")
+        return msg
+
+    async def _ws_message(self, opcode: int, data: bytes, msg: Optional[dict], rid: Any) -> dict:
+        """msg: parsed text message (None for binary frames); rid: id to reply with."""
+        if opcode == 0x2:
+            return {"id": rid, **(await self.recognize_image(data))}
+        op = msg.get("op", "recognize")
+        if op == "recognize":
+            return {"id": rid, **(await self.recognize_image(_b64(msg.get("image"))))}
+        if op == "crops":
+            crops = msg.get("crops")
+            if not isinstance(crops, list):
+                raise ServiceError(400, '"crops" must be a list')
+            return {"id": rid, **(await self.recognize_crops([_b64(c) for c in crops]))}
+        raise ServiceError(400, f"unknown op {op!r}")
+
+    async def _websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                         headers: Dict[str, str]) -> None:
+        key = headers.get("sec-websocket-key")
+        if not key:
+            writer.write(self._response(400, self._json({"error": "missing Sec-WebSocket-Key"}), keep_alive=False))
+            await writer.drain()
+            return
+        accept = base64.b64encode(hashlib.sha1((key + self._WS_GUID).encode("ascii")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        self.counters["ws_connections"] += 1
+
+        send_lock = asyncio.Lock()
+        inflight = asyncio.Semaphore(max(1, self.cfg.ws_inflight))
+        tasks: set = set()
+
+        async def send(opcode: int, payload: bytes):
+            async with send_lock:
+                writer.write(self._ws_frame(opcode, payload))
+                await writer.drain()
+
+        async def serve(opcode: int, data: bytes, seq: int):
+            # replies (errors included) carry the client's id; seq only for binary / unparseable messages
+            rid: Any = seq
+            try:
+                msg = None
+                if opcode != 0x2:
+                    msg = self._ws_parse(data)
+                    rid = msg.get("id", seq)
+                reply = await self._ws_message(opcode, data, msg, rid)
+            except ServiceError as e:
+                reply = {"id": rid, "error": e.message}
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"[service] websocket request failed: {e}")
+                reply = {"id": rid, "error": "internal error"}
+            finally:
+                inflight.release()
+            try:
+                await send(0x1, self._json(reply))
+            except ConnectionError:
+                pass
+
+        seq = 0
+        try:
+            while True:
+                try:
+                    opcode, data = await self._ws_read(reader)
+                except ServiceError as e:
+                    await send(0x8, struct.pack("!H", 1009) + e.message.encode("utf-8"))
+                    return
+                if opcode == 0x8:
+                    await send(0x8, data[:2])
+                    return
+                if opcode == 0x9:
+                    await send(0xA, data)
+                    continue
+                if opcode == 0xA:
+                    continue
+                # stop reading (TCP backpressure on the client) while this connection is at its limit
+                await inflight.acquire()
+                t = asyncio.get_running_loop().create_task(serve(opcode, data, seq))
+                tasks.add(t)
+                t.add_done_callback(tasks.discard)
+                seq += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for t in list(tasks):
+                t.cancel()
+
+    # ---- control ----
+
+    async def start(self) -> "RecognitionService":
+        self._detect_slots = asyncio.Semaphore(max(1, self.cfg.workers))
+        self.batcher = _EmbedBatcher(self.embedder, self.matcher, self.embed_executor,
+                                     self.cfg.max_batch, self.cfg.max_wait_ms / 1000.0)
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.cfg.host, self.cfg.port)
+        self.cfg.port = self._server.sockets[0].getsockname()[1]  # port 0 -> the one bound
+        print(f"[service] listening on http://{self.cfg.host}:{self.cfg.port} "
+              f"({self.cfg.workers} workers, embed batch <= {self.cfg.max_batch})")
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self.batcher is not None:
+            await self.batcher.stop()
+        self.executor.shutdown(wait=True)
+        self.embed_executor.shutdown(wait=True)
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+# -------------------------
+# Self-test client (localhost, synthetic images)
+# -------------------------
+
+def _synthetic_images(n: int, seed: int = 0) -> Tuple[List[bytes], List[bytes]]:
+    """
+    (frames, crops) as JPEG bytes: enrollment crops from data/enroll when present
+    (tiled into 640x480 frames so Haar finds faces), random noise otherwise.
+    """
+    rng = np.random.default_rng(seed)
+    files = sorted(Path("data/enroll").glob("*/*.jpg"))[:max(1, n)]
+    crops = [cv2.imread(str(p)) for p in files]
+    crops = [c for c in crops if c is not None]
+    if not crops:
+        crops = [rng.integers(0, 256, (112, 112, 3), dtype=np.uint8) for _ in range(n)]
+    enc = lambda img: cv2.imencode(".jpg", img)[1].tobytes()
+
+    frames = []
+    for i in range(n):
+        frame = np.full((480, 640, 3), 90, dtype=np.uint8)
+        for j in range(2):
+            face = cv2.resize(crops[(i + j) % len(crops)], (160, 160))
+            x, y = 60 + j * 300, 140
+            frame[y:y + 160, x:x + 160] = face
+        frames.append(enc(frame))
+    return frames, [enc(c) for c in crops[:n]]
+
+async def _selftest_client(host: str, port: int, frames: List[bytes], crops: List[bytes]) -> None:
+    async def http(method: str, path: str, body: bytes = b"", ctype: str = "image/jpeg"):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write((f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: {ctype}\r\n"
+                      f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+        raw = await reader.read()
+        writer.close()
+        head, _, payload = raw.partition(b"\r\n\r\n")
+        return int(head.split(b" ", 2)[1]), payload
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*[http("POST", "/v1/recognize", f) for f in frames])
+    dt = time.perf_counter() - t0
+    faces = sum(len(json.loads(p)["faces"]) for s, p in results if s == 200)
+    print(f"[selftest] HTTP  /v1/recognize: {len(frames)} concurrent frames -> "
+          f"{[s for s, _ in results].count(200)} ok, {faces} faces in {dt * 1000:.0f} ms")
+
+    body = json.dumps({"crops": [base64.b64encode(c).decode("ascii") for c in crops]}).encode("utf-8")
+    status, payload = await http("POST", "/v1/crops", body, "application/json")
+    print(f"[selftest] HTTP  /v1/crops: {status} {json.loads(payload).get('matches', [])[:2]}")
+
+    # WebSocket: pipelined binary frames, replies matched by id
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(np.random.default_rng(1).bytes(16)).decode("ascii")
+    writer.write((f"GET /v1/ws HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    if not head.startswith(b"HTTP/1.1 101"):
+        raise RuntimeError(f"WebSocket upgrade failed: {head[:40]!r}")
+    mask = b"\x01\x02\x03\x04"
+    for f in frames:
+        n = len(f)
+        hdr = struct.pack("!BB", 0x82, 0x80 | 126) + struct.pack("!H", n) if n < (1 << 16) \
+            else struct.pack("!BBQ", 0x82, 0x80 | 127, n)
+        masked = (np.frombuffer(f, dtype=np.uint8) ^ np.resize(np.frombuffer(mask, dtype=np.uint8), n)).tobytes()
+        writer.write(hdr + mask + masked)
+    await writer.drain()
+    ids = []
+    for _ in frames:
+        b0, b1 = await reader.readexactly(2)
+        n = b1 & 0x7F
+        if n == 126:
+            n = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif n == 127:
+            n = struct.unpack("!Q", await reader.readexactly(8))[0]
+        ids.append(json.loads(await reader.readexactly(n)).get("id"))
+    writer.write(struct.pack("!BB", 0x88, 0x80) + mask)
+    await writer.drain()
+    writer.close()
+    print(f"[selftest] WS    /v1/ws: {len(ids)} replies (ids {sorted(ids)})")
+
+    status, payload = await http("GET", "/healthz")
+    print(f"[selftest] HTTP  /healthz: {status} {payload.decode('utf-8')}")
+
+async def _selftest(service: RecognitionService, n: int) -> None:
+    service.cfg.port = 0
+    await service.start()
+    try:
+        frames, crops = _synthetic_images(n)
+        await _selftest_client(service.cfg.host, service.cfg.port, frames, crops)
+        for name, st in {**service.stats, **service.batcher.stats}.items():
+            s = st.summary()
+            print(f"[selftest] {name:<12} n={int(s['n']):<4} p50={s['p50']:.2f} p95={s['p95']:.2f}")
+    finally:
+        await service.stop()
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    ap = argparse.ArgumentParser(description="Recognition service (HTTP + WebSocket)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=4, help="executor threads for decode/detect/align")
+    ap.add_argument("--max-batch", type=int, default=32, help="crops per ONNX call, across requests")
+    ap.add_argument("--max-wait-ms", type=float, default=5.0)
+    ap.add_argument("--max-pending", type=int, default=64, help="requests in flight before 503 / busy")
+    ap.add_argument("--thr", type=float, default=0.34, help="distance threshold")
+    ap.add_argument("--index", choices=INDEX_KINDS, default="exact", help="DB search: exact | ivf | hnsw")
+    ap.add_argument("--n-probe", type=int, default=DEFAULT_N_PROBE, help="ivf: lists scanned per query")
+    ap.add_argument("--ef", type=int, default=64, help="hnsw: search breadth")
+    ap.add_argument("--detector", choices=DETECTORS, default="haar")
+    ap.add_argument("--detector-model", help="YuNet ONNX (default models/face_detection_yunet_2023mar.onnx)")
+    ap.add_argument("--selftest", type=int, nargs="?", const=8, metavar="N",
+                    help="serve on a free port, send N synthetic frames over HTTP and WebSocket, exit")
+    args = ap.parse_args()
+
+    cfg = ServiceConfig(host=args.host, port=args.port, workers=args.workers, max_batch=args.max_batch,
+                        max_wait_ms=args.max_wait_ms, max_pending=args.max_pending)
+    db_path = resolve_db_path(Path("data/db/face_db.npz"))
+    embedder = ArcFaceEmbedderONNX(model_path="models/embedder_arcface.onnx", input_size=cfg.crop_size,
+                                   max_batch=cfg.max_batch, session_cfg=OrtSessionConfig.from_env())
+    matcher = FaceDBMatcher(db=load_db(db_path), dist_thresh=args.thr, index=args.index,
+                            index_path=index_path_for(db_path, args.index) if args.index != "exact" else None,
+                            n_probe=args.n_probe, ef=args.ef)
+    detector = create_detector(args.detector, min_size=(70, 70), max_faces=cfg.max_faces, landmark_mode="roi",
+                               model_path=args.detector_model)
+    registry.warm_up(batch_sizes=(1, embedder.max_batch))
+    watcher = DBWatcher(matcher, Path("data/db/face_db.npz")).start()
+
+    service = RecognitionService(detector, embedder, matcher, cfg)
+    try:
+        if args.selftest:
+            asyncio.run(_selftest(service, args.selftest))
+        else:
+            asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        print("\n[service] stopping")
+    finally:
+        watcher.stop()
+
+if __name__ == "__main__":
+    main()
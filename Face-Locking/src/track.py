@@ -0,0 +1,210 @@
+# src/track.py
+"""
+Detection-skipping face tracker.
+
+Full-frame Haar is the most expensive CPU stage, and faces barely move
+between consecutive frames. FaceTracker wraps any detector with
+detect(frame, max_faces) -> List[FaceDet] (HaarFaceMesh5pt, Haar5ptDetector):
+
+- the wrapped detector runs every `detect_every` frames, or sooner when
+  tracking confidence drops / a track is lost
+- in between, the 5 keypoints of every track are propagated with pyramidal
+  Lucas-Kanade optical flow (forward-backward checked); the box follows the
+  keypoint motion (translation + scale)
+- detections are associated to existing tracks by IoU, so track_id stays
+  stable across frames and across re-detections
+
+Returned faces are the detector's own dataclass with track_id filled in
+(score = tracking confidence on propagated frames).
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, replace
+from typing import Any, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# -------------------------
+# Helpers
+# -------------------------
+
+def box_iou(a: Tuple[float, float, float, float], b: Tuple[float, float, float, float]) -> float:
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    iw, ih = max(0.0, ix2 - ix1), max(0.0, iy2 - iy1)
+    inter = iw * ih
+    area_a = max(0.0, a[2] - a[0]) * max(0.0, a[3] - a[1])
+    area_b = max(0.0, b[2] - b[0]) * max(0.0, b[3] - b[1])
+    union = area_a + area_b - inter
+    return float(inter / union) if union > 0 else 0.0
+
+def _xyxy(f: Any) -> Tuple[float, float, float, float]:
+    return (float(f.x1), float(f.y1), float(f.x2), float(f.y2))
+
+def _cxcywh(f: Any) -> Tuple[float, float, float, float]:
+    """center x, center y, half width, half height"""
+    return ((f.x1 + f.x2) * 0.5, (f.y1 + f.y2) * 0.5, (f.x2 - f.x1) * 0.5, (f.y2 - f.y1) * 0.5)
+
+# -------------------------
+# Tracker
+# -------------------------
+
+@dataclass
+class _Track:
+    track_id: int
+    face: Any                # detector dataclass (FaceDet / FaceKpsBox), box clipped to the frame
+    box: Tuple[float, float, float, float]  # unclipped cx, cy, half w, half h that flow moves
+    confidence: float = 1.0
+
+class FaceTracker:
+    def __init__(
+        self,
+        detector,
+        detect_every: int = 5,
+        min_confidence: float = 0.6,
+        iou_match: float = 0.3,
+        max_fb_error: float = 1.5,
+        lk_win: int = 21,
+        lk_levels: int = 3,
+    ):
+        """
+        detect_every : run the detector every N frames (1 = every frame, IDs only)
+        min_confidence: fraction of a track's keypoints that must survive the
+                        flow check, below it the detector runs on this frame
+        iou_match    : min IoU to carry a track_id over to a new detection
+        max_fb_error : forward-backward LK error (px) for a keypoint to count as tracked
+        """
+        self.detector = detector
+        self.detect_every = max(1, int(detect_every))
+        self.min_confidence = float(min_confidence)
+        self.iou_match = float(iou_match)
+        self.max_fb_error = float(max_fb_error)
+        self._lk = dict(
+            winSize=(int(lk_win), int(lk_win)),
+            maxLevel=int(lk_levels),
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+        )
+
+        self._tracks: List[_Track] = []
+        self._prev_gray: Optional[np.ndarray] = None
+        self._since_detect = 0
+        self._next_id = 1
+
+        # counters (useful to verify how often Haar actually runs)
+        self.frames = 0
+        self.detections = 0
+
+    def reset(self) -> None:
+        self._tracks = []
+        self._prev_gray = None
+        self._since_detect = 0
+
+    # ---- detection + association ----
+
+    def _associate(self, faces: List[Any]) -> List[_Track]:
+        """Greedy IoU matching of new detections to existing tracks."""
+        pairs = []
+        for ti, t in enumerate(self._tracks):
+            for fi, f in enumerate(faces):
+                iou = box_iou(_xyxy(t.face), _xyxy(f))
+                if iou >= self.iou_match:
+                    pairs.append((iou, ti, fi))
+        pairs.sort(reverse=True)
+
+        used_t, used_f = set(), set()
+        ids: List[Optional[int]] = [None] * len(faces)
+        for _, ti, fi in pairs:
+            if ti in used_t or fi in used_f:
+                continue
+            used_t.add(ti)
+            used_f.add(fi)
+            ids[fi] = self._tracks[ti].track_id
+
+        out: List[_Track] = []
+        for fi, f in enumerate(faces):
+            tid = ids[fi]
+            if tid is None:
+                tid = self._next_id
+                self._next_id += 1
+            out.append(_Track(track_id=tid, face=replace(f, track_id=tid), box=_cxcywh(f), confidence=1.0))
+        return out
+
+    def _run_detector(self, frame_bgr: np.ndarray, max_faces: int) -> None:
+        faces = self.detector.detect(frame_bgr, max_faces=max_faces)
+        self._tracks = self._associate(faces)
+        self._since_detect = 0
+        self.detections += 1
+
+    # ---- optical flow propagation ----
+
+    def _propagate(self, gray: np.ndarray) -> bool:
+        """Move every track with LK flow. Returns False if detection is needed."""
+        if not self._tracks or self._prev_gray is None:
+            return False
+
+        H, W = gray.shape[:2]
+        p0 = np.concatenate([t.face.kps.reshape(-1, 1, 2) for t in self._tracks], axis=0).astype(np.float32)
+        p1, st1, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, p0, None, **self._lk)
+        if p1 is None:
+            return False
+        p0r, st2, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, p1, None, **self._lk)
+        if p0r is None:
+            return False
+
+        fb = np.linalg.norm((p0 - p0r).reshape(-1, 2), axis=1)
+        good = (st1.reshape(-1) == 1) & (st2.reshape(-1) == 1) & (fb < self.max_fb_error)
+
+        kept: List[_Track] = []
+        for i, t in enumerate(self._tracks):
+            sl = slice(5 * i, 5 * i + 5)
+            g = good[sl]
+            conf = float(g.mean())
+            if conf < self.min_confidence:
+                return False
+
+            old = p0[sl].reshape(5, 2)
+            new = p1[sl].reshape(5, 2).copy()
+            shift = np.median(new[g] - old[g], axis=0)
+            new[~g] = old[~g] + shift  # lost points follow the rest
+
+            # box follows keypoints: translation + isotropic scale
+            s_old = float(np.linalg.norm(old - old.mean(axis=0), axis=1).mean())
+            s_new = float(np.linalg.norm(new - new.mean(axis=0), axis=1).mean())
+            scale = float(np.clip(s_new / max(s_old, 1e-6), 0.8, 1.25))
+
+            # from the unclipped box: a face at the edge keeps its size instead of shrinking every frame
+            cx, cy, hw, hh = t.box
+            cx += float(shift[0])
+            cy += float(shift[1])
+            hw *= scale
+            hh *= scale
+            x1, y1 = int(round(max(0, cx - hw))), int(round(max(0, cy - hh)))
+            x2, y2 = int(round(min(W - 1, cx + hw))), int(round(min(H - 1, cy + hh)))
+            if x2 - x1 < 8 or y2 - y1 < 8:
+                continue  # left the frame
+
+            kept.append(_Track(
+                track_id=t.track_id,
+                face=replace(t.face, x1=x1, y1=y1, x2=x2, y2=y2, score=conf, kps=new.astype(np.float32)),
+                box=(cx, cy, hw, hh),
+                confidence=conf,
+            ))
+
+        self._tracks = kept
+        return len(kept) > 0
+
+    # ---- public ----
+
+    def detect(self, frame_bgr: np.ndarray, max_faces: int = 5) -> List[Any]:
+        self.frames += 1
+        gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+
+        due = self._since_detect + 1 >= self.detect_every
+        if due or not self._propagate(gray):
+            self._run_detector(frame_bgr, max_faces)
+        else:
+            self._since_detect += 1
+
+        self._prev_gray = gray
+        return [t.face for t in self._tracks][:max_faces]
@@ -85,20 +85,24 @@ def test_face_database():
     """Test if face database exists and is readable"""
     print("\n👤 Testing face database...")
     
-    db_path = Path("data/db/face_db.npz")
-    
-    if not db_path.exists():
-        print("⚠️  No face database found. Run enrollment first:")
-        print("   python -m src.enroll")
-        return False
-    
     try:
-        data = np.load(str(db_path), allow_pickle=True)
-        identities = list(data.files)
-        print(f"✅ Face database loaded successfully")
+        sys.path.insert(0, str(Path.cwd()))
+        from src.facedb import resolve_db_path
+        from src.recognize import load_db
+        
+        # face_db.emb (enroll's default) when present, else the legacy face_db.npz
+        db_path = resolve_db_path(Path("data/db/face_db.npz"))
+        data = load_db(db_path)
+        if len(data) == 0:
+            print("⚠️  No face database found. Run enrollment first:")
+            print("   python -m src.enroll")
+            return False
+        
+        identities = list(data.keys())
+        print(f"✅ Face database loaded successfully ({db_path.name})")
         print(f"📊 Found {len(identities)} enrolled identities:")
         for identity in identities:
-            embedding = data[identity]
+            embedding = np.asarray(data[identity])
             print(f"   - {identity}: {embedding.shape} embedding")
         return True
     except Exception as e: